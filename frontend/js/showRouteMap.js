@@ -144,6 +144,8 @@ async function calculateRoute() {
 }
 
 // Función para obtener datos de una ruta específica
+// Pide la ruta en NDJSON: cada paso llega en su propia línea y se va dibujando
+// una línea provisional; la última línea es el resumen con el tiempo estimado
 async function fetchRoute(routeType, startLocation, endLocation) {
     const endpoint = routeConfig[routeType].endpoint;
     
@@ -154,7 +156,8 @@ async function fetchRoute(routeType, startLocation, endLocation) {
         },
         body: JSON.stringify({
             start_location: startLocation,
-            end_location: endLocation
+            end_location: endLocation,
+            format: 'ndjson'
         })
     });
     
@@ -162,9 +165,46 @@ async function fetchRoute(routeType, startLocation, endLocation) {
         throw new Error(`Error HTTP: ${response.status} - ${response.statusText}`);
     }
     
-    const data = await response.json();
-    const routeData = data["ruta"];
-    const totalTime = data["tiempo_estimado"];
+    const routeData = [];
+    let totalTime = null;
+    const preview = L.polyline([], {
+        color: routeConfig[routeType].color,
+        weight: 4,
+        opacity: 0.4,
+        dashArray: '6 6'
+    }).addTo(map);
+    
+    const handleLine = (line) => {
+        if (!line.trim()) return;
+        const item = JSON.parse(line);
+        if (item.tipo === 'resumen') {
+            totalTime = item.tiempo_estimado;
+            return;
+        }
+        if (routeData.length === 0) {
+            preview.addLatLng([item.fromLat, item.fromLng]);
+        }
+        preview.addLatLng([item.toLat, item.toLng]);
+        routeData.push(item);
+    };
+    
+    try {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.forEach(handleLine);
+        }
+        handleLine(buffer + decoder.decode());
+    } finally {
+        // La ruta definitiva la dibuja visualizeRoute
+        map.removeLayer(preview);
+    }
     
     if (!routeData || routeData.length === 0) {
         throw new Error('No se encontró una ruta válida entre las ubicaciones especificadas.');
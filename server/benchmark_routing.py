@@ -0,0 +1,98 @@
+import time
+import random
+import argparse
+import statistics
+from utils.neo4j_funcs import (
+    Neo4jController,
+    A_STAR_STEP_BY_STEP_CYPHER_QUERY,
+    BELLMAN_FORD_STEP_BY_STEP_CYPHER_QUERY
+)
+from utils.contraction import load_hierarchy
+from utils.traffic_profiles import LENGTH_PROFILE
+
+# Compara latencia y nodos asentados de las consultas Cypher actuales contra
+# Dijkstra, A* y la jerarquía de contracción en memoria, sobre pares hospital/dirección
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def summary(name, latencies, settled=None):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    settled_text = f"{statistics.median(settled):>10.0f}" if settled else f"{'n/a':>10}"
+    print(f"{name:<28}{statistics.median(latencies):>12.2f}{p95:>12.2f}{settled_text}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de consultas de rutas")
+    parser.add_argument("--pairs", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--skip-cypher", action="store_true")
+    args = parser.parse_args()
+
+    controller = Neo4jController()
+    graph = controller.road_graph
+    profiles = controller.traffic_profiles
+    rng = random.Random(args.seed)
+
+    hospital_nodes = [
+        graph.node_for_address(address) for address in controller.hospitals.values()
+    ]
+    hospital_nodes = [node for node in hospital_nodes if node is not None]
+    address_nodes = list(graph.address_to_node.values())
+
+    pairs = []
+    for _ in range(args.pairs):
+        hospital = rng.choice(hospital_nodes)
+        address = rng.choice(address_nodes)
+        pairs.append((address, hospital) if rng.random() < 0.5 else (hospital, address))
+
+    weights, heuristic_scale = profiles.get(LENGTH_PROFILE)
+    hierarchy = load_hierarchy(graph, profiles.weights[LENGTH_PROFILE], LENGTH_PROFILE)
+
+    results = {}
+
+    def record(name, latency, settled=None):
+        entry = results.setdefault(name, ([], []))
+        entry[0].append(latency)
+        if settled is not None:
+            entry[1].append(settled)
+
+    for source, target in pairs:
+        if not args.skip_cypher:
+            start_address, end_address = graph.addresses[source], graph.addresses[target]
+            latency, _ = timed(lambda: controller._run_cypher_route(
+                A_STAR_STEP_BY_STEP_CYPHER_QUERY, start_address, end_address
+            ))
+            record("Cypher A*", latency)
+            latency, _ = timed(lambda: controller._run_cypher_route(
+                BELLMAN_FORD_STEP_BY_STEP_CYPHER_QUERY, start_address, end_address,
+                current_hour=12, day_type="weekday"
+            ))
+            record("Cypher Bellman", latency)
+
+        latency, (_, _, settled) = timed(lambda: graph.astar(source, target, weights, 0.0))
+        record("Dijkstra (memoria)", latency, settled)
+        latency, (_, _, settled) = timed(lambda: graph.astar(source, target, weights, heuristic_scale))
+        record("A* haversine (memoria)", latency, settled)
+        if hierarchy is not None:
+            latency, (_, _, settled) = timed(lambda: hierarchy.query(source, target))
+            record("Contraction Hierarchy", latency, settled)
+
+    print(f"{len(pairs)} pares hospital/dirección")
+    print(f"{'Algoritmo':<28}{'mediana ms':>12}{'p95 ms':>12}{'asentados':>10}")
+    for name, (latencies, settled) in results.items():
+        summary(name, latencies, settled)
+
+    if hierarchy is None:
+        print("Sin jerarquía de contracción para 'length': ejecuta preprocess_ch.py primero")
+
+    controller.driver.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import json
+import time
+import random
+import argparse
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Servidor HERE local para probar el servicio de factores de tráfico sin la API real:
+#   python here_stub.py --factor 1.6 --fail-rate 0.2
+#   HERE_API_KEY=stub HERE_API_BASE_URL=http://127.0.0.1:8090/v8/routes python server.py
+# Solo responde lo que usa extract_real_time_traffic_factor (summary.duration / baseDuration)
+
+
+def make_handler(args):
+    class HereStubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+
+            if url.path != "/v8/routes" or "origin" not in params or "destination" not in params:
+                self._reply(400, {"title": "Malformed request"})
+                return
+            if args.latency:
+                time.sleep(args.latency)
+            if random.random() < args.fail_rate:
+                self._reply(503, {"title": "Service unavailable (stub)"})
+                return
+
+            base_duration = random.randint(300, 900)
+            factor = max(args.factor + random.uniform(-args.jitter, args.jitter), 0.1)
+            self._reply(200, {
+                "routes": [{
+                    "sections": [{
+                        "summary": {
+                            "duration": int(base_duration * factor),
+                            "baseDuration": base_duration
+                        }
+                    }]
+                }]
+            })
+
+        def _reply(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *log_args):
+            if args.verbose:
+                super().log_message(format, *log_args)
+
+    return HereStubHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub local de la API de rutas de HERE")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--factor", type=float, default=1.4, help="duration / baseDuration devuelto")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fracción de respuestas 503")
+    parser.add_argument("--latency", type=float, default=0.0, help="segundos de espera por respuesta")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args))
+    print(f"HERE stub en http://127.0.0.1:{args.port}/v8/routes (factor {args.factor}, fallos {args.fail_rate:.0%})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
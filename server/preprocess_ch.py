@@ -0,0 +1,34 @@
+import time
+import argparse
+from utils.neo4j_funcs import Neo4jController
+from utils.contraction import ContractionHierarchy, CH_DATA_DIR, profile_file_name
+
+# Preprocesamiento fuera de línea: una jerarquía de contracción por perfil de pesos
+# (distancia y cada franja horaria de tráfico), guardada en data/ch/
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye las jerarquías de contracción del grafo vial")
+    parser.add_argument("--output", default=str(CH_DATA_DIR), help="Directorio de salida")
+    parser.add_argument("--profile", action="append", help="Solo este perfil (ej. length, weekday_morning_rush)")
+    args = parser.parse_args()
+
+    controller = Neo4jController()
+    graph = controller.road_graph
+    profiles = controller.traffic_profiles
+
+    for profile_key, weights in profiles.weights.items():
+        file_name = profile_file_name(profile_key)
+        if args.profile and file_name[:-len(".npz")] not in args.profile:
+            continue
+
+        start = time.perf_counter()
+        hierarchy = ContractionHierarchy.build(graph, weights)
+        hierarchy.save(f"{args.output}/{file_name}")
+        shortcuts = int(((hierarchy.child_a != -1) & hierarchy.alive).sum())
+        print(f"{file_name}: {time.perf_counter() - start:.1f}s, {shortcuts} shortcuts")
+
+    controller.driver.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,27 @@
 import os
+import json
+import zlib
+import uuid
+import asyncio
+import msgpack
 import uvicorn
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from typing import Optional, Literal, List, Union
+from datetime import datetime
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 from utils.neo4j_funcs import Neo4jController
-from utils.cars_licenses import read_whole_csv, change_lanes
+from utils.cars_licenses import get_registry, change_lanes
+from utils.trafficDetails import close_async_client
+from utils.route_format import compact_route
+from utils.live_tracking import TrackingHub
+from utils.lane_clearing import LaneScene
+from utils.ttl_cache import TTLCache
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
@@ -15,9 +30,29 @@ DATA_PATH = Path(__file__).parent.parent / "data" / "placas_carros.csv"
 NEO4J_URI = os.getenv("NEO4J_URI")
 NEO4J_USER = os.getenv("NEO4J_USER")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
+MATRIX_MAX_CELLS = int(os.getenv("MATRIX_MAX_CELLS", "10000"))
+SNAP_MAX_POINTS = int(os.getenv("SNAP_MAX_POINTS", "100000"))
+MAP_MATCH_MAX_POINTS = int(os.getenv("MAP_MATCH_MAX_POINTS", "200000"))
+VEHICLES_MAX_PAGE = int(os.getenv("VEHICLES_MAX_PAGE", "1000"))
+LANE_SCENES_MAX = int(os.getenv("LANE_SCENES_MAX", "64"))
+LANE_SCENE_TTL_S = float(os.getenv("LANE_SCENE_TTL_S", "600"))
+LANE_SCENE_MAX_VEHICLES = int(os.getenv("LANE_SCENE_MAX_VEHICLES", "5000"))
 
-app = FastAPI()
 neo4j_admin = Neo4jController()
+# Posiciones en vivo de las unidades para los visores de la sala de control
+tracking_hub = TrackingHub(neo4j_admin.live_route, neo4j_admin.overlay_version)
+# Escenas de /lane-scenes: el cliente manda solo los cambios entre pasos
+lane_scenes = TTLCache(LANE_SCENES_MAX, LANE_SCENE_TTL_S)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tracking_hub.start()
+    yield
+    await tracking_hub.stop()
+    await close_async_client()
+    await neo4j_admin.close_async()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:8082",
@@ -29,20 +64,268 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
-    allow_methods=["POST", "GET"],
+    allow_methods=["POST", "GET", "DELETE"],
     allow_headers=["*"],
 )
+# Se comprime solo si el cliente manda Accept-Encoding: gzip
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+class Coordinate(BaseModel):
+    lat: float
+    lng: float
 
 class LocationRequest(BaseModel):
-    start_location: str
-    end_location: str
+    # Dirección, nombre de hospital o coordenadas GPS ajustadas a la calle más cercana
+    start_location: Union[str, Coordinate]
+    end_location: Union[str, Coordinate]
+    departure_time: Optional[datetime] = None
+    heuristic: Optional[Literal["haversine", "alt"]] = None
+    bypass_cache: bool = False
+    # "compact": resumen una vez, polyline codificada y maniobras por calle; zoom simplifica la geometría
+    # "ndjson": una línea JSON por paso apenas se arma y al final una línea de resumen con tiempo_estimado
+    format: Literal["verbose", "compact", "ndjson"] = "verbose"
+    zoom: Optional[int] = Field(None, ge=0, le=22)
+
+class AlternativesRequest(BaseModel):
+    start_location: Union[str, Coordinate]
+    end_location: Union[str, Coordinate]
+    k: int = Field(3, ge=1, le=5)
+    departure_time: Optional[datetime] = None
+    bypass_cache: bool = False
+
+class MatrixRequest(BaseModel):
+    # Direcciones, nombres de hospital o coordenadas; sin targets, todos los hospitales
+    sources: List[Union[str, Coordinate]]
+    targets: Optional[List[Union[str, Coordinate]]] = None
+    departure_time: Optional[datetime] = None
+
+class DispatchUnit(BaseModel):
+    id: str
+    location: Union[str, Coordinate]
+
+class DispatchIncident(BaseModel):
+    location: Union[str, Coordinate]
+    # 1 = más urgente; pesa el ETA x4, 2 lo pesa x2 y 3 x1
+    priority: Literal[1, 2, 3] = 2
+
+class DispatchRequest(BaseModel):
+    units: List[DispatchUnit]
+    incidents: List[DispatchIncident]
+    # Nombres de clinicas.json a considerar para el traslado; por defecto, todos
+    hospitals: Optional[List[str]] = None
+    departure_time: Optional[datetime] = None
+    time_budget_ms: Optional[float] = None
+
+class ClosureRequest(BaseModel):
+    # "bloqueo" corta las aristas; "multiplicar" multiplica su costo por valor; "velocidad" la fija en valor km/h
+    tipo: Literal["bloqueo", "multiplicar", "velocidad"] = "bloqueo"
+    valor: Optional[float] = None
+    duracion_s: Optional[float] = None
+    motivo: Optional[str] = None
+    # Aristas afectadas: segmento entre dos nodos, calle y/o radio alrededor de un punto
+    desde_osmid: Optional[int] = None
+    hasta_osmid: Optional[int] = None
+    calle: Optional[str] = None
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+    radio_m: Optional[float] = None
+
+class RerouteRequest(BaseModel):
+    ambulance_id: str
+    # Posición actual: dirección o coordenadas GPS
+    location: Union[str, Coordinate]
+    # Obligatorio en la primera llamada de cada ambulancia
+    end_location: Optional[Union[str, Coordinate]] = None
+    departure_time: Optional[datetime] = None
+
+class SnapRequest(BaseModel):
+    points: List[Coordinate]
+    # "arista": proyección sobre la calle más cercana; "nodo": intersección más cercana
+    modo: Literal["arista", "nodo"] = "arista"
+    # En calles de un sentido, ajustar como destino (se llega por el inicio de la arista)
+    destino: bool = False
+
+class TracePoint(BaseModel):
+    lat: float
+    lng: float
+    # Segundos epoch del ping (hasta el año 2100)
+    t: float = Field(ge=0, le=4102444800)
+
+class Trace(BaseModel):
+    vehicle_id: str
+    points: List[TracePoint]
+
+class MapMatchRequest(BaseModel):
+    traces: List[Trace]
+
+class UnitPosition(BaseModel):
+    lat: float
+    lng: float
+    t: Optional[float] = None
+    # Destino nuevo de la unidad; mientras no cambie se sigue la misma ruta
+    destino: Optional[Union[str, Coordinate]] = None
+    # La unidad llegó o canceló: se deja de calcular su ETA
+    fin: bool = False
+
+class LiveFilter(BaseModel):
+    unidades: Optional[List[str]] = None
+    # lat_min, lng_min, lat_max, lng_max
+    area: Optional[List[float]] = Field(default=None, min_length=4, max_length=4)
+
+class LaneVehicle(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    placa: str
+    # En un auto nuevo, carril y posicion (metros sobre la via) son obligatorios; en uno existente, solo lo que cambió
+    carril: Optional[int] = None
+    posicion: Optional[float] = None
+    velocidad: Optional[float] = None
+    # 0 a 100; si falta en un auto nuevo se busca la placa en placas_carros.csv
+    nivel: Optional[float] = Field(default=None, alias="nivel de conduccion")
+
+class LaneAmbulance(BaseModel):
+    id: str
+    carril: Optional[int] = None
+    posicion: Optional[float] = None
+    velocidad: Optional[float] = None
+
+class LaneSceneUpdate(BaseModel):
+    vehiculos: List[LaneVehicle] = []
+    ambulancias: List[LaneAmbulance] = []
+    quitar: List[str] = []
+    quitar_ambulancias: List[str] = []
+    dt: float = Field(0.1, gt=0, le=5)
+    pasos: int = Field(1, ge=0, le=1000)
+
+class LaneSceneRequest(LaneSceneUpdate):
+    carriles: int = Field(2, ge=1, le=16)
+
+class NearestHospitalRequest(BaseModel):
+    location: Optional[Union[str, Coordinate]] = None
+    osmid: Optional[int] = None
+    k: int = Field(3, ge=1, le=10)
+    departure_time: Optional[datetime] = None
+
+def as_point(point):
+    return point.model_dump() if isinstance(point, Coordinate) else point
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+def route_response(request: Request, data: LocationRequest, result):
+    if data.format == "compact":
+        result = compact_route(result, data.zoom)
+    # MessagePack solo si el cliente lo pide en Accept; si no, JSON como siempre
+    accept = request.headers.get("accept", "")
+    if any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES):
+        return Response(content=msgpack.packb(result), media_type="application/msgpack")
+    return result
+
+def ndjson_route_response(data: LocationRequest, bellman: bool):
+    async def lines():
+        async for item in neo4j_admin.stream_shortest_path(
+            as_point(data.start_location),
+            as_point(data.end_location),
+            bellman=bellman,
+            departure_time=data.departure_time,
+            heuristic=data.heuristic
+        ):
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    # GZipMiddleware no hace flush por línea: sin comprimir, cada paso sale apenas se arma
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"Content-Encoding": "identity"})
+
+def etag_for(request: Request, version: str):
+    # Misma versión del CSV y misma consulta: mismo cuerpo
+    return f'W/"{version}-{zlib.crc32(request.url.query.encode()):08x}"'
+
+def not_modified(request: Request, etag: str):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+def json_response(request: Request, version: str, content, headers=None):
+    etag = etag_for(request, version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", **(headers or {})}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    body = content if isinstance(content, bytes) else json.dumps(content, ensure_ascii=False).encode("utf-8")
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def vehicle_query(clase, marca, nivel_min, nivel_max, fields):
+    filters = {"clase": clase, "marca": marca}
+    return filters, nivel_min, nivel_max, fields.split(",") if fields else None
 
 @app.get("/whole-csv")
-def read_whole_csv_endpoint():
-    return read_whole_csv(DATA_PATH)
+async def read_whole_csv_endpoint(
+    request: Request,
+    clase: Optional[str] = None,
+    marca: Optional[str] = None,
+    nivel_min: Optional[float] = None,
+    nivel_max: Optional[float] = None,
+    fields: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1)
+):
+    registry = get_registry(DATA_PATH)
+    if not request.url.query:
+        # Sin parámetros, la tabla completa como siempre, serializada una vez por versión del archivo
+        version, body = await asyncio.to_thread(registry.full_json)
+        return json_response(request, version, body)
+    filters, level_min, level_max, fields = vehicle_query(clase, marca, nivel_min, nivel_max, fields)
+    try:
+        rows, total, version = await asyncio.to_thread(registry.query, filters, level_min, level_max, fields, offset, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return json_response(request, version, rows, {"X-Total-Count": str(total)})
+
+@app.get("/vehicles")
+async def vehicles_endpoint(
+    request: Request,
+    clase: Optional[str] = None,
+    marca: Optional[str] = None,
+    nivel_min: Optional[float] = None,
+    nivel_max: Optional[float] = None,
+    fields: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1)
+):
+    limit = min(limit, VEHICLES_MAX_PAGE)
+    filters, level_min, level_max, fields = vehicle_query(clase, marca, nivel_min, nivel_max, fields)
+    try:
+        rows, total, version = await asyncio.to_thread(get_registry(DATA_PATH).query, filters, level_min, level_max, fields, offset, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return json_response(request, version, {"total": total, "offset": offset, "limit": limit, "vehiculos": rows})
+
+@app.get("/vehicles/sample")
+async def vehicles_sample_endpoint(
+    n: int = Query(4, ge=1, le=VEHICLES_MAX_PAGE),
+    clase: Optional[str] = None,
+    marca: Optional[str] = None,
+    nivel_min: Optional[float] = None,
+    nivel_max: Optional[float] = None,
+    fields: Optional[str] = None
+):
+    filters, level_min, level_max, fields = vehicle_query(clase, marca, nivel_min, nivel_max, fields)
+    try:
+        return await asyncio.to_thread(get_registry(DATA_PATH).sample, n, filters, level_min, level_max, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/vehicles/{placa}")
+async def vehicle_endpoint(request: Request, placa: str, fields: Optional[str] = None):
+    registry = get_registry(DATA_PATH)
+    try:
+        vehicle = await asyncio.to_thread(registry.find_plate, placa, fields.split(",") if fields else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if vehicle is None:
+        raise HTTPException(status_code=404, detail="Placa no encontrada")
+    return json_response(request, registry.version, vehicle)
 
 @app.post("/change-lanes")
-def change_lanes_endpoint(data: dict):
+async def change_lanes_endpoint(data: dict):
     num_lanes = data.get("num_lanes", 2)
     cars_data = data.get("cars_data", [])
 
@@ -50,43 +333,325 @@ def change_lanes_endpoint(data: dict):
     
     return {"cars_in_front": processed_cars_data, "driver_chosen": driver_chosen}
 
+def driver_level(placa):
+    vehicle = get_registry(DATA_PATH).find_plate(placa, ["nivel de conduccion"])
+    return vehicle["nivel de conduccion"] if vehicle is not None else None
+
+def run_lane_scene(scene: LaneScene, data: LaneSceneUpdate):
+    with scene.lock:
+        scene.apply_updates(
+            [vehicle.model_dump(by_alias=True) for vehicle in data.vehiculos],
+            [ambulance.model_dump() for ambulance in data.ambulancias],
+            data.quitar,
+            data.quitar_ambulancias,
+            driver_level,
+            LANE_SCENE_MAX_VEHICLES
+        )
+        return scene.run(data.dt, data.pasos)
+
+@app.post("/lane-scenes")
+async def create_lane_scene_endpoint(data: LaneSceneRequest):
+    scene_id = uuid.uuid4().hex
+    try:
+        scene = LaneScene(data.carriles)
+        result = await asyncio.to_thread(run_lane_scene, scene, data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    lane_scenes.put(scene_id, scene)
+    return {"escena": scene_id, **result}
+
+@app.post("/lane-scenes/{scene_id}/step")
+async def step_lane_scene_endpoint(scene_id: str, data: LaneSceneUpdate):
+    scene = lane_scenes.get(scene_id)
+    if scene is None:
+        raise HTTPException(status_code=404, detail="Escena no encontrada o vencida")
+    try:
+        result = await asyncio.to_thread(run_lane_scene, scene, data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Cada paso renueva el vencimiento de la escena
+    lane_scenes.put(scene_id, scene)
+    return {"escena": scene_id, **result}
+
 @app.post("/find-similar-address")
-def find_similar_address_neo4j(data: dict):
-    similar_addresses = neo4j_admin.find_similar_address(data.get("address"))
+async def find_similar_address_neo4j(data: dict):
+    await neo4j_admin.load_road_graph_async()
+    similar_addresses = await asyncio.to_thread(neo4j_admin.find_similar_address, data.get("address"))
+    return { "similar_addresses": similar_addresses }
+
+@app.get("/autocomplete")
+async def autocomplete_endpoint(
+    q: str = Query(..., min_length=1, max_length=120),
+    limit: int = Query(8, ge=1, le=50)
+):
+    await neo4j_admin.load_road_graph_async()
+    return { "sugerencias": await asyncio.to_thread(neo4j_admin.autocomplete, q, limit) }
+
+@app.post("/find-similar-address-batch")
+async def find_similar_address_batch_neo4j(data: dict):
+    await neo4j_admin.load_road_graph_async()
+    similar_addresses = await asyncio.to_thread(
+        neo4j_admin.find_similar_addresses,
+        data.get("addresses", []),
+        limit=data.get("limit", 5)
+    )
     return { "similar_addresses": similar_addresses }
 
 @app.post("/shortest-path")
-def shortest_path_endpoint(data: LocationRequest):
-    return neo4j_admin.find_shortest_path(
-        data.start_location,
-        data.end_location,
-        bellman=True
+async def shortest_path_endpoint(request: Request, data: LocationRequest):
+    if data.format == "ndjson":
+        return ndjson_route_response(data, bellman=True)
+    result = await neo4j_admin.find_shortest_path_async(
+        as_point(data.start_location),
+        as_point(data.end_location),
+        bellman=True,
+        departure_time=data.departure_time,
+        heuristic=data.heuristic,
+        bypass_cache=data.bypass_cache
     )
+    return route_response(request, data, result)
 
 @app.post("/shortest-path-astar")
-def shortest_path_astar_endpoint(data: LocationRequest):
-    return neo4j_admin.find_shortest_path(
-        data.start_location,
-        data.end_location,
-        bellman=False
+async def shortest_path_astar_endpoint(request: Request, data: LocationRequest):
+    if data.format == "ndjson":
+        return ndjson_route_response(data, bellman=False)
+    result = await neo4j_admin.find_shortest_path_async(
+        as_point(data.start_location),
+        as_point(data.end_location),
+        bellman=False,
+        departure_time=data.departure_time,
+        heuristic=data.heuristic,
+        bypass_cache=data.bypass_cache
+    )
+    return route_response(request, data, result)
+
+@app.post("/shortest-path-alternatives")
+async def shortest_path_alternatives_endpoint(data: AlternativesRequest):
+    await neo4j_admin.load_road_graph_async()
+    return await asyncio.to_thread(
+        neo4j_admin.find_alternative_routes,
+        as_point(data.start_location),
+        as_point(data.end_location),
+        k=data.k,
+        departure_time=data.departure_time,
+        bypass_cache=data.bypass_cache
     )
 
 @app.post("/shortest-path-roads")
-def shortest_path_just_roads(data: LocationRequest):
-    result = neo4j_admin.find_shortest_path(
-        data.start_location,
-        data.end_location
+async def shortest_path_just_roads(data: LocationRequest):
+    # Solo calles en orden de recorrido y metros por calle: sin registros por paso ni ETA
+    await neo4j_admin.load_road_graph_async()
+    return await asyncio.to_thread(
+        neo4j_admin.find_route_streets,
+        as_point(data.start_location),
+        as_point(data.end_location),
+        departure_time=data.departure_time,
+        bypass_cache=data.bypass_cache
+    )
+
+@app.post("/snap")
+async def snap_endpoint(data: SnapRequest):
+    if len(data.points) > SNAP_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"No se pueden ajustar más de {SNAP_MAX_POINTS} puntos por llamada")
+    await neo4j_admin.load_road_graph_async()
+    points = [point.model_dump() for point in data.points]
+    return await asyncio.to_thread(neo4j_admin.snap_points, points, data.modo, data.destino)
+
+@app.post("/matrix")
+async def matrix_endpoint(data: MatrixRequest):
+    targets = data.targets if data.targets is not None else list(neo4j_admin.hospitals)
+    if len(data.sources) * len(targets) > MATRIX_MAX_CELLS:
+        raise HTTPException(status_code=400, detail=f"La matriz no puede tener más de {MATRIX_MAX_CELLS} celdas")
+
+    await neo4j_admin.load_road_graph_async()
+    return await asyncio.to_thread(
+        neo4j_admin.travel_matrix,
+        [as_point(point) for point in data.sources],
+        [as_point(point) for point in targets],
+        data.departure_time
+    )
+
+@app.post("/dispatch")
+async def dispatch_endpoint(data: DispatchRequest):
+    unknown = [name for name in data.hospitals or [] if name not in neo4j_admin.hospitals]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Hospitales desconocidos: {', '.join(unknown)}")
+    if len(data.units) * len(data.incidents) > MATRIX_MAX_CELLS:
+        raise HTTPException(status_code=400, detail=f"El despacho no puede tener más de {MATRIX_MAX_CELLS} pares unidad-incidente")
+
+    units = [{"id": unit.id, "location": as_point(unit.location)} for unit in data.units]
+    incidents = [{"location": as_point(incident.location), "priority": incident.priority} for incident in data.incidents]
+    options = {"time_budget_ms": data.time_budget_ms} if data.time_budget_ms is not None else {}
+
+    await neo4j_admin.load_road_graph_async()
+    return await asyncio.to_thread(
+        neo4j_admin.dispatch, units, incidents, data.hospitals, data.departure_time, **options
+    )
+
+@app.post("/closures")
+async def add_closure_endpoint(data: ClosureRequest):
+    await neo4j_admin.load_road_graph_async()
+    try:
+        closure = await asyncio.to_thread(
+            neo4j_admin.add_road_closure,
+            data.tipo, data.valor, data.duracion_s, data.motivo, data.calle,
+            data.lat, data.lng, data.radio_m, data.desde_osmid, data.hasta_osmid
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if closure is None:
+        raise HTTPException(status_code=404, detail="Ningún tramo coincide con el cierre")
+    return closure
+
+@app.get("/closures")
+async def list_closures_endpoint():
+    await neo4j_admin.load_road_graph_async()
+    return neo4j_admin.list_road_closures()
+
+@app.delete("/closures/{closure_id}")
+async def remove_closure_endpoint(closure_id: int):
+    await neo4j_admin.load_road_graph_async()
+    if not neo4j_admin.remove_road_closure(closure_id):
+        raise HTTPException(status_code=404, detail="Cierre no encontrado")
+    return neo4j_admin.list_road_closures()
+
+@app.post("/reroute")
+async def reroute_endpoint(data: RerouteRequest):
+    await neo4j_admin.load_road_graph_async()
+    result = await asyncio.to_thread(
+        neo4j_admin.reroute,
+        data.ambulance_id,
+        as_point(data.location),
+        as_point(data.end_location) if data.end_location is not None else None,
+        data.departure_time
     )
+    if result is None:
+        raise HTTPException(status_code=404, detail="No se pudo resolver la posición o el destino de la ambulancia")
+    return result
+
+@app.post("/map-match")
+async def map_match_endpoint(data: MapMatchRequest):
+    if sum(len(trace.points) for trace in data.traces) > MAP_MATCH_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"No se pueden emparejar más de {MAP_MATCH_MAX_POINTS} puntos por llamada")
+    await neo4j_admin.load_road_graph_async()
+    traces = [trace.model_dump() for trace in data.traces]
+
+    def lines():
+        # Generador síncrono: Starlette lo recorre en un hilo aparte
+        for item in neo4j_admin.map_match(traces):
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"Content-Encoding": "identity"})
+
+@app.get("/telemetry/stats")
+async def telemetry_stats_endpoint():
+    # telemetry_store traduce las aristas al grafo: se carga sin bloquear el event loop
+    await neo4j_admin.load_road_graph_async()
+    store = await asyncio.to_thread(lambda: neo4j_admin.telemetry_store)
+    return store.stats()
+
+@app.websocket("/ws/units/{unit_id}")
+async def unit_position_socket(websocket: WebSocket, unit_id: str):
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                position = UnitPosition.model_validate_json(await websocket.receive_text())
+            except ValidationError as e:
+                await websocket.send_json({"tipo": "error", "detalle": e.errors(include_url=False, include_context=False)})
+                continue
+            if position.destino is not None:
+                await neo4j_admin.load_road_graph_async()
+            destination = as_point(position.destino) if position.destino is not None else None
+            tracking_hub.publish(unit_id, position.lat, position.lng, position.t, destination)
+            if position.fin:
+                tracking_hub.finish(unit_id)
+    except WebSocketDisconnect:
+        pass
+
+@app.websocket("/ws/live")
+async def live_tracking_socket(websocket: WebSocket, unidades: Optional[str] = None, area: Optional[str] = None):
+    # Filtro inicial por query (?unidades=a,b o ?area=lat_min,lng_min,lat_max,lng_max); después, por mensajes LiveFilter
+    try:
+        live_filter = LiveFilter(
+            unidades=unidades.split(",") if unidades else None,
+            area=[float(value) for value in area.split(",")] if area else None
+        )
+    except (ValidationError, ValueError):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscriber = tracking_hub.subscribe(live_filter.unidades, live_filter.area)
 
-    # In case the name of the street is a list, we take the first element
-    def get_street_name(road):
-        name = road.get("nombreCalle")
-        if isinstance(name, list) and name:  
-            return name[0]
-        return name
+    async def send():
+        while True:
+            await websocket.send_text(await subscriber.queue.get())
 
-    roads = list({get_street_name(road) for road in result if get_street_name(road) is not None})
-    return { "calles": roads }
+    async def receive():
+        while True:
+            try:
+                live_filter = LiveFilter.model_validate_json(await websocket.receive_text())
+            except ValidationError as e:
+                subscriber.queue.put(json.dumps({"tipo": "error", "detalle": e.errors(include_url=False, include_context=False)}))
+                continue
+            subscriber.set_filter(live_filter.unidades, live_filter.area)
+            tracking_hub.send_snapshot(subscriber)
+
+    tasks = [asyncio.create_task(send()), asyncio.create_task(receive())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # La desconexión llega como excepción de alguna de las dos tareas
+        await asyncio.gather(*tasks, return_exceptions=True)
+        tracking_hub.unsubscribe(subscriber)
+
+@app.get("/live/stats")
+async def live_stats_endpoint():
+    return tracking_hub.stats()
+
+@app.get("/geocode-cache/stats")
+async def geocode_cache_stats_endpoint():
+    return neo4j_admin.geocode_cache.stats()
+
+@app.post("/geocode-cache/invalidate")
+async def geocode_cache_invalidate_endpoint(data: dict = None):
+    # Con {"recargar_grafo": true} también se descarta el grafo en memoria (tras reimportar en Neo4j)
+    if data and data.get("recargar_grafo"):
+        await asyncio.to_thread(neo4j_admin.reload_road_graph)
+    else:
+        neo4j_admin.invalidate_geocode_cache()
+    return neo4j_admin.geocode_cache.stats()
+
+@app.get("/traffic-factors/stats")
+async def traffic_factors_stats_endpoint():
+    await neo4j_admin.load_road_graph_async()
+    traffic_factors = await asyncio.to_thread(lambda: neo4j_admin.traffic_factors)
+    if traffic_factors is None:
+        return {"circuito": "deshabilitado", "detalle": "HERE_API_KEY no configurada"}
+    return traffic_factors.stats()
+
+@app.get("/route-cache/stats")
+async def route_cache_stats_endpoint():
+    return neo4j_admin.route_cache.stats()
+
+@app.post("/nearest-hospital")
+async def nearest_hospital_endpoint(data: NearestHospitalRequest):
+    if data.location is None and data.osmid is None:
+        raise HTTPException(status_code=400, detail="Se requiere 'location' u 'osmid'")
+
+    await neo4j_admin.load_road_graph_async()
+    result = await asyncio.to_thread(
+        neo4j_admin.find_nearest_hospitals,
+        location=as_point(data.location),
+        osmid=data.osmid,
+        k=data.k,
+        departure_time=data.departure_time
+    )
+    if result is None:
+        raise HTTPException(status_code=404, detail="Ubicación no encontrada en el grafo vial")
+    return result
 
 
 if __name__ == "__main__":
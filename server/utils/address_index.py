@@ -0,0 +1,124 @@
+import re
+import random
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import numpy as np
+from unidecode import unidecode
+
+DIGIT_RUN = re.compile(r'[0-9]+')
+
+
+def normalize_text(text):
+    return unidecode(text.lower().strip())
+
+
+def street_key(normalized_address):
+    # La calle es la dirección normalizada sin sus números
+    return " ".join(token for token in normalized_address.split() if not token.isdigit())
+
+
+def first_house_number(address):
+    # Igual que la consulta Cypher: primer token que sea solo dígitos
+    for token in address.split(' '):
+        if DIGIT_RUN.fullmatch(token):
+            return int(token)
+    return None
+
+
+class AddressIndex:
+    """Índice en memoria sobre Intersection.address para find_similar_address.
+
+    Reproduce las particiones de candidatos que antes salían de consultas
+    Cypher: coincidencia exacta, número contenido, rango de números y
+    texto contenido, más una muestra aleatoria de respaldo.
+    """
+
+    def __init__(self, addresses):
+        self.addresses = list(dict.fromkeys(address for address in addresses if address))
+        self.normalized = [normalize_text(address) for address in self.addresses]
+        self.normalized_by_address = dict(zip(self.addresses, self.normalized))
+
+        self.exact = defaultdict(list)
+        tokens = defaultdict(list)
+        digit_runs = defaultdict(list)
+        numbers = []
+        streets = defaultdict(list)
+
+        for i, (address, normalized) in enumerate(zip(self.addresses, self.normalized)):
+            self.exact[normalized].append(i)
+
+            for token in dict.fromkeys(address.lower().split()):
+                tokens[token].append(i)
+
+            for run in dict.fromkeys(DIGIT_RUN.findall(address)):
+                digit_runs[run].append(i)
+
+            number = first_house_number(address)
+            if number is not None:
+                numbers.append((number, i))
+                streets[street_key(normalized)].append((number, i))
+
+        self.tokens = dict(tokens)
+        self.digit_runs = dict(digit_runs)
+        self.numbers = self._sorted_numbers(numbers)
+        self.street_numbers = {street: self._sorted_numbers(entries) for street, entries in streets.items()}
+
+    @staticmethod
+    def _sorted_numbers(entries):
+        entries.sort()
+        return [number for number, _ in entries], [i for _, i in entries]
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def _take(self, ids, limit):
+        return [self.addresses[i] for i in ids[:limit]]
+
+    def exact_matches(self, normalized_input, limit=10):
+        return self._take(self.exact.get(normalized_input, []), limit)
+
+    def containing_number(self, number_str, limit=300):
+        # Un número solo puede aparecer dentro de una secuencia de dígitos de la dirección
+        ids = []
+        for run, run_ids in self.digit_runs.items():
+            if number_str in run:
+                ids.extend(run_ids)
+        ids = sorted(set(ids))
+        return self._take(ids, limit)
+
+    def number_range(self, target, normalized_input=None, limit=800, radius=100):
+        # Primero la misma calle que la entrada, luego cualquier calle; en ambos casos por cercanía
+        ids = []
+        sources = []
+        if normalized_input is not None and street_key(normalized_input) in self.street_numbers:
+            sources.append(self.street_numbers[street_key(normalized_input)])
+        sources.append(self.numbers)
+
+        seen = set()
+        for numbers, number_ids in sources:
+            lo = bisect_left(numbers, target - radius)
+            hi = bisect_right(numbers, target + radius)
+            window = np.asarray(numbers[lo:hi], dtype=np.int64)
+            window_ids = number_ids[lo:hi]
+            distance = np.abs(window - target)
+            for j in np.argsort(distance, kind="stable"):
+                i = window_ids[j]
+                if distance[j] > 0 and i not in seen:
+                    seen.add(i)
+                    ids.append(i)
+            if len(ids) >= limit:
+                break
+        return self._take(ids, limit)
+
+    def containing_text(self, word, limit=1000):
+        # `word` no tiene espacios: solo puede estar contenido dentro de un token
+        ids = set()
+        for token, token_ids in self.tokens.items():
+            if word in token:
+                ids.update(token_ids)
+        return self._take(sorted(ids), limit)
+
+    def sample(self, k=2000):
+        if len(self.addresses) <= k:
+            return list(self.addresses)
+        return random.sample(self.addresses, k)
@@ -0,0 +1,61 @@
+import os
+import numpy as np
+
+ALTERNATIVE_PENALTY = float(os.getenv("ALTERNATIVE_PENALTY", "1.4"))
+# Una alternativa se descarta si comparte más de esta fracción de su longitud con otra ya elegida
+ALTERNATIVE_MAX_OVERLAP = float(os.getenv("ALTERNATIVE_MAX_OVERLAP", "0.7"))
+# ...o si su costo (sin penalizar) supera en este factor al de la mejor ruta
+ALTERNATIVE_MAX_STRETCH = float(os.getenv("ALTERNATIVE_MAX_STRETCH", "1.5"))
+
+
+def overlap_ratio(graph, edges, other_edges):
+    # Fracción de la longitud de `edges` que también recorre `other_edges`
+    edges = np.asarray(edges, dtype=np.int64)
+    total = float(graph.length[edges].sum())
+    if total == 0:
+        return 1.0
+    shared = np.isin(edges, np.asarray(other_edges, dtype=np.int64))
+    return float(graph.length[edges[shared]].sum()) / total
+
+
+def alternative_routes(graph, source, target, weights, heuristic_scale, k=3, penalty=ALTERNATIVE_PENALTY,
+                       max_overlap=ALTERNATIVE_MAX_OVERLAP, max_stretch=ALTERNATIVE_MAX_STRETCH):
+    """Hasta `k` rutas distintas de `source` a `target` por el método de penalización.
+
+    Tras cada búsqueda los pesos de las aristas usadas se multiplican por
+    `penalty`, así la siguiente A* prefiere calles nuevas. Como los pesos solo
+    suben, la heurística haversine se calcula una vez y sigue siendo
+    admisible. Devuelve [(aristas, costo con los pesos originales,
+    solapamiento máximo con las anteriores, nodos asentados)] ordenadas por
+    costo, la más rápida primero.
+    """
+    penalized = list(weights)
+    heuristic = graph.haversine_heuristic(target, heuristic_scale)
+    routes = []
+    best_cost = None
+    for _ in range(3 * k):
+        edges, _, settled = graph.astar(source, target, penalized, heuristic_scale, heuristic)
+        if edges is None:
+            break
+        cost = sum(weights[edge] for edge in edges)
+        if best_cost is None:
+            best_cost = cost
+        elif cost > max_stretch * best_cost:
+            break
+
+        overlap = max((overlap_ratio(graph, edges, previous) for previous, *_ in routes), default=0.0)
+        if not routes or overlap <= max_overlap:
+            routes.append((edges, cost, overlap, settled))
+            if len(routes) == k:
+                break
+        if not edges:
+            break
+        for edge in set(edges):
+            penalized[edge] *= penalty
+    # Se encuentran en orden de penalización, no de costo: se ordenan y el
+    # solapamiento se recalcula contra las que quedan antes de cada una
+    routes.sort(key=lambda route: route[1])
+    return [
+        (edges, cost, max((overlap_ratio(graph, edges, previous) for previous, *_ in routes[:rank]), default=0.0), settled)
+        for rank, (edges, cost, _, settled) in enumerate(routes)
+    ]
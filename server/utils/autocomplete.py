@@ -0,0 +1,118 @@
+import math
+import heapq
+from bisect import bisect_left
+from collections import Counter
+import numpy as np
+from .address_index import normalize_text
+
+# Peso por tipo de sugerencia: hospitales primero, luego calles, luego direcciones
+KIND_WEIGHTS = {'hospital': 3.0, 'calle': 1.0, 'direccion': 0.0}
+
+
+def _keys_for(normalized):
+    # El texto completo y cada sufijo que empieza en una palabra (sin los que empiezan con número),
+    # para que "arequipa" encuentre "Avenida Arequipa 4545"
+    words = normalized.split()
+    keys = [normalized]
+    for i in range(1, len(words)):
+        if not words[i].isdigit():
+            keys.append(" ".join(words[i:]))
+    return keys
+
+
+class AutocompleteIndex:
+    """Índice de prefijos sobre un arreglo ordenado de llaves normalizadas.
+
+    Las k mejores sugerencias de un prefijo salen de una sparse table de
+    máximos sobre el rango [lo, hi) de llaves que comparten el prefijo, así
+    que el costo no depende de cuántas direcciones empiezan igual.
+    """
+
+    def __init__(self, entries):
+        # entries: lista de (texto, tipo, popularidad, datos extra)
+        self.entries = entries
+        keyed = []
+        scores = []
+        for i, (text, kind, popularity, _) in enumerate(entries):
+            # A igual popularidad, los textos más cortos primero
+            scores.append(KIND_WEIGHTS[kind] + math.log1p(popularity) - len(text) * 1e-4)
+            for key in _keys_for(normalize_text(text)):
+                keyed.append((key, i))
+
+        keyed.sort()
+        self.keys = [key for key, _ in keyed]
+        self.key_entries = np.asarray([i for _, i in keyed], dtype=np.int32)
+        self.key_scores = np.asarray(scores, dtype=np.float64)[self.key_entries] if keyed else np.zeros(0)
+        self._build_sparse_table()
+
+    def _build_sparse_table(self):
+        n = len(self.keys)
+        levels = [np.arange(n, dtype=np.int32)]
+        span = 1
+        while span * 2 <= n:
+            prev = levels[-1]
+            left, right = prev[:n - span * 2 + 1], prev[span:n - span + 1]
+            levels.append(np.where(self.key_scores[left] >= self.key_scores[right], left, right).astype(np.int32))
+            span *= 2
+        self._levels = levels
+
+    def _range_argmax(self, lo, hi):
+        # Posición del mejor puntaje en [lo, hi]
+        level = (hi - lo + 1).bit_length() - 1
+        a = self._levels[level][lo]
+        b = self._levels[level][hi - (1 << level) + 1]
+        return int(a) if self.key_scores[a] >= self.key_scores[b] else int(b)
+
+    @classmethod
+    def from_graph(cls, graph, hospitals):
+        degree = np.bincount(graph.edge_source, minlength=graph.node_count) + \
+            np.bincount(graph.edge_target, minlength=graph.node_count)
+
+        address_popularity = Counter()
+        for node, address in enumerate(graph.addresses):
+            if address:
+                address_popularity[address] += int(degree[node])
+
+        street_popularity = Counter()
+        for name_id, count in zip(*np.unique(graph.name_id, return_counts=True)):
+            names = graph.names[name_id]
+            for name in (names if isinstance(names, list) else [names]):
+                if isinstance(name, str) and name:
+                    street_popularity[name] += int(count)
+
+        max_popularity = max(list(address_popularity.values()) + list(street_popularity.values()) + [1])
+        entries = [(name, 'hospital', max_popularity, address) for name, address in hospitals.items()]
+        entries += [(name, 'calle', count, None) for name, count in street_popularity.items()]
+        entries += [(address, 'direccion', count, None) for address, count in address_popularity.items()]
+        return cls(entries)
+
+    def suggest(self, prefix, limit=8):
+        prefix = normalize_text(prefix)
+        if not prefix or not self.keys:
+            return []
+
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + "\uffff") - 1
+        if lo > hi:
+            return []
+
+        # Extrae máximos de subrangos hasta juntar `limit` entradas distintas
+        suggestions = []
+        seen = set()
+        best = self._range_argmax(lo, hi)
+        heap = [(-self.key_scores[best], best, lo, hi)]
+        while heap and len(suggestions) < limit:
+            _, position, left, right = heapq.heappop(heap)
+            entry = int(self.key_entries[position])
+            if entry not in seen:
+                seen.add(entry)
+                text, kind, _, address = self.entries[entry]
+                suggestion = {"texto": text, "tipo": kind}
+                if address is not None:
+                    suggestion["direccion"] = address
+                suggestions.append(suggestion)
+            for a, b in ((left, position - 1), (position + 1, right)):
+                if a <= b:
+                    m = self._range_argmax(a, b)
+                    heapq.heappush(heap, (-self.key_scores[m], m, a, b))
+        return suggestions
@@ -1,17 +1,188 @@
+import os
+import json
+import threading
+from types import SimpleNamespace
+import numpy as np
 import pandas as pd
+from .address_index import normalize_text
+
+PLATE_COLUMN = 'placa'
+LEVEL_COLUMN = 'nivel de conduccion'
+# Columnas con índice de filtro (valor normalizado -> filas)
+FILTER_COLUMNS = ('clase', 'marca')
+
+
+class VehicleRegistry:
+    """Tabla de placas_carros.csv cargada una vez, por columnas, con índices.
+
+    Se vuelve a leer solo cuando cambia el mtime (o el tamaño) del archivo.
+    Guarda cada columna como lista, un dict placa -> fila, un índice por
+    valor de `clase` y `marca`, y las filas ordenadas por nivel de conducción
+    para filtrar por rango con búsqueda binaria. Las filas se arman como dict
+    solo para la página pedida. Todo vive en `table`, que se reemplaza
+    entero al recargar: una consulta en curso sigue con la versión que tomó.
+    """
+
+    def __init__(self, path_document):
+        self.path = path_document
+        self.table = None
+        self._failed_version = None
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng()
+        self.refresh()
+
+    @property
+    def version(self):
+        return self.table.version
+
+    def refresh(self):
+        stat = os.stat(self.path)
+        version = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        table = self.table
+        if table is not None and version in (table.version, self._failed_version):
+            return table
+        with self._lock:
+            if self.table is not None and version in (self.table.version, self._failed_version):
+                return self.table
+            try:
+                df = pd.read_csv(self.path)
+            except (pd.errors.ParserError, UnicodeDecodeError) as e:
+                # Archivo a medio escribir: se sigue con la versión anterior hasta el próximo cambio
+                if self.table is None:
+                    raise
+                self._failed_version = version
+                print(f"Vehicle registry reload failed, keeping previous version: {e}")
+                return self.table
+            columns = list(df.columns)
+            # NaN -> None para que el JSON sea válido
+            values = {column: df[column].astype(object).where(df[column].notna(), None).tolist() for column in columns}
+
+            plates = {}
+            if PLATE_COLUMN in values:
+                for row, plate in enumerate(values[PLATE_COLUMN]):
+                    if plate is not None:
+                        plates.setdefault(normalize_text(str(plate)), row)
+
+            filters = {}
+            for column in FILTER_COLUMNS:
+                if column in values:
+                    groups = {}
+                    for row, value in enumerate(values[column]):
+                        if value is not None:
+                            groups.setdefault(normalize_text(str(value)), []).append(row)
+                    filters[column] = {key: np.asarray(rows, dtype=np.int64) for key, rows in groups.items()}
+
+            level_order = level_sorted = None
+            if LEVEL_COLUMN in values:
+                levels = pd.to_numeric(df[LEVEL_COLUMN], errors='coerce').to_numpy(dtype=np.float64)
+                level_order = np.argsort(levels, kind="stable")
+                level_sorted = levels[level_order]
+
+            self.table = SimpleNamespace(
+                version=version,
+                columns=columns,
+                values=values,
+                size=len(df),
+                plates=plates,
+                filters=filters,
+                level_order=level_order,
+                level_sorted=level_sorted,
+                full_json=None
+            )
+            print(f"Vehicle registry loaded: {len(df)} rows from {self.path}")
+            return self.table
+
+    @staticmethod
+    def _records(table, rows=None, fields=None):
+        columns = fields or table.columns
+        values = [table.values[column] for column in columns]
+        rows = range(table.size) if rows is None else rows
+        return [dict(zip(columns, (column_values[row] for column_values in values))) for row in rows]
+
+    @staticmethod
+    def _check_fields(table, fields):
+        unknown = [field for field in fields or [] if field not in table.values]
+        if unknown:
+            raise ValueError(f"Campos desconocidos: {', '.join(unknown)}")
+
+    def records(self, fields=None):
+        return self._records(self.refresh(), fields=fields)
+
+    def full_json(self):
+        # (versión, tabla completa ya serializada como la devolvía read_whole_csv); se rehace si cambia el archivo
+        table = self.refresh()
+        if table.full_json is None:
+            table.full_json = json.dumps(self._records(table), ensure_ascii=False).encode("utf-8")
+        return table.version, table.full_json
+
+    def find_plate(self, plate, fields=None):
+        table = self.refresh()
+        self._check_fields(table, fields)
+        row = table.plates.get(normalize_text(plate))
+        return self._records(table, [row], fields)[0] if row is not None else None
+
+    @staticmethod
+    def _matching_rows(table, filters=None, level_min=None, level_max=None):
+        # Filas que cumplen los filtros, en orden de archivo; None si no hay filtros (todas)
+        rows = None
+        for column, value in (filters or {}).items():
+            if value is None:
+                continue
+            if column not in table.filters:
+                raise ValueError(f"No se puede filtrar por '{column}'")
+            matches = table.filters[column].get(normalize_text(value), np.empty(0, dtype=np.int64))
+            rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+
+        if level_min is not None or level_max is not None:
+            if table.level_order is None:
+                raise ValueError(f"El archivo no tiene la columna '{LEVEL_COLUMN}'")
+            lo = np.searchsorted(table.level_sorted, level_min, side="left") if level_min is not None else 0
+            hi = np.searchsorted(table.level_sorted, level_max, side="right") if level_max is not None else table.size
+            matches = np.sort(table.level_order[lo:hi])
+            rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+        return rows
+
+    def query(self, filters=None, level_min=None, level_max=None, fields=None, offset=0, limit=None):
+        """(página de filas como dicts, total que cumple los filtros, versión del archivo)."""
+        table = self.refresh()
+        self._check_fields(table, fields)
+        rows = self._matching_rows(table, filters, level_min, level_max)
+        total = table.size if rows is None else len(rows)
+        end = total if limit is None else min(offset + limit, total)
+        page = range(offset, end) if rows is None else rows[offset:end].tolist()
+        return self._records(table, page, fields), total, table.version
+
+    def sample(self, n, filters=None, level_min=None, level_max=None, fields=None):
+        # Índices al azar sobre las filas ya filtradas: no recorre ni copia la tabla
+        table = self.refresh()
+        self._check_fields(table, fields)
+        rows = self._matching_rows(table, filters, level_min, level_max)
+        total = table.size if rows is None else len(rows)
+        picks = self._rng.choice(total, size=min(n, total), replace=False)
+        picks = picks if rows is None else rows[picks]
+        return self._records(table, picks.tolist(), fields)
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+def get_registry(path_document) -> VehicleRegistry:
+    path_document = str(path_document)
+    registry = _registries.get(path_document)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(path_document)
+            if registry is None:
+                registry = VehicleRegistry(path_document)
+                _registries[path_document] = registry
+    return registry
 
 def read_whole_csv(path_document: str) -> list:
-    df = pd.read_csv(path_document)
-    return df.to_dict(orient='records')
+    return get_registry(path_document).records()
 
 def sort_licenses(path_document: str)-> list:
-    df = pd.read_csv(path_document)
     required_columns = ['placa', 'clase', 'marca', 'modelo', 'dueño', 'nivel de conduccion']
-    df = df[required_columns] 
-
-    sampled_df = df.sample(n=4, random_state=None)
-    result = sampled_df.to_dict(orient='records')
-    return result
+    return get_registry(path_document).sample(4, fields=required_columns)
     
 
 def change_lanes(num_lanes: int, cars_data: list)-> tuple:
@@ -0,0 +1,319 @@
+import math
+import heapq
+import hashlib
+from pathlib import Path
+import numpy as np
+
+CH_DATA_DIR = Path(__file__).parent.parent.parent / "data" / "ch"
+
+# Límite de nodos asentados en la búsqueda de testigos durante la contracción
+WITNESS_SETTLE_LIMIT = 60
+
+
+def graph_fingerprint(graph, weights):
+    digest = hashlib.sha1()
+    digest.update(graph.osmids.tobytes())
+    digest.update(graph.edge_source.tobytes())
+    digest.update(graph.edge_target.tobytes())
+    digest.update(np.asarray(weights, dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+def profile_file_name(profile_key):
+    if isinstance(profile_key, tuple):
+        return "_".join(profile_key) + ".npz"
+    return f"{profile_key}.npz"
+
+
+def _witness_search(out_adj, ch_w, source, skip, max_cost, targets):
+    # Dijkstra local desde `source` sin pasar por `skip`, acotado en costo y nodos asentados
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    pending = len(targets)
+    settled = 0
+    while heap and pending and settled < WITNESS_SETTLE_LIMIT:
+        d, node = heapq.heappop(heap)
+        if d > dist[node]:
+            continue
+        if d > max_cost:
+            break
+        settled += 1
+        if node in targets:
+            pending -= 1
+        for nxt, edge in out_adj[node].items():
+            if nxt == skip:
+                continue
+            nd = d + ch_w[edge]
+            if nd < dist.get(nxt, math.inf):
+                dist[nxt] = nd
+                heapq.heappush(heap, (nd, nxt))
+    return dist
+
+
+class ContractionHierarchy:
+    """Jerarquía de contracción de un perfil de pesos del RoadGraph.
+
+    Las aristas de la jerarquía son las originales (child_a == -1, child_b es
+    el índice de la arista del grafo) o atajos (child_a y child_b son las dos
+    aristas de la jerarquía que reemplazan).
+    """
+
+    def __init__(self, rank, src, dst, weight, child_a, child_b, alive, fingerprint):
+        self.rank = np.asarray(rank, dtype=np.int32)
+        self.src = np.asarray(src, dtype=np.int32)
+        self.dst = np.asarray(dst, dtype=np.int32)
+        self.weight = np.asarray(weight, dtype=np.float64)
+        self.child_a = np.asarray(child_a, dtype=np.int32)
+        self.child_b = np.asarray(child_b, dtype=np.int32)
+        self.alive = np.asarray(alive, dtype=bool)
+        self.fingerprint = fingerprint
+        self._build_search_graphs()
+
+    def _build_search_graphs(self):
+        n = len(self.rank)
+        upward = self.rank[self.src] < self.rank[self.dst]
+
+        # Hacia adelante: aristas u->v que suben, guardadas en u
+        forward_edges = np.nonzero(upward & self.alive)[0]
+        forward_nodes = self.src[forward_edges]
+        # Hacia atrás: aristas u->v que bajan, guardadas en v (se recorren al revés)
+        backward_edges = np.nonzero(~upward & self.alive)[0]
+        backward_nodes = self.dst[backward_edges]
+
+        def csr(nodes, edges):
+            order = np.argsort(nodes, kind="stable")
+            indptr = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(nodes, minlength=n), out=indptr[1:])
+            return indptr.tolist(), edges[order].tolist()
+
+        self._fwd_indptr, self._fwd_edges = csr(forward_nodes, forward_edges)
+        self._bwd_indptr, self._bwd_edges = csr(backward_nodes, backward_edges)
+        self._src = self.src.tolist()
+        self._dst = self.dst.tolist()
+        self._weight = self.weight.tolist()
+        self._child_a = self.child_a.tolist()
+        self._child_b = self.child_b.tolist()
+
+    @classmethod
+    def build(cls, graph, weights):
+        n = graph.node_count
+        weights = np.asarray(weights, dtype=np.float64)
+
+        out_adj = [dict() for _ in range(n)]
+        in_adj = [dict() for _ in range(n)]
+        src, dst, ch_w, child_a, child_b = [], [], [], [], []
+        alive = []
+
+        def add_edge(u, v, w, a, b):
+            current = out_adj[u].get(v)
+            if current is not None:
+                if ch_w[current] <= w:
+                    return
+                alive[current] = False
+            edge = len(src)
+            src.append(u)
+            dst.append(v)
+            ch_w.append(w)
+            child_a.append(a)
+            child_b.append(b)
+            alive.append(True)
+            out_adj[u][v] = edge
+            in_adj[v][u] = edge
+
+        edge_source = graph.edge_source.tolist()
+        edge_target = graph.edge_target.tolist()
+        for edge, (u, v) in enumerate(zip(edge_source, edge_target)):
+            if u != v:
+                add_edge(u, v, float(weights[edge]), -1, edge)
+
+        contracted_neighbors = [0] * n
+
+        def shortcuts(node):
+            found = []
+            outs = list(out_adj[node].items())
+            if not outs:
+                return found
+            for u, in_edge in in_adj[node].items():
+                w_in = ch_w[in_edge]
+                needed = {v: w_in + ch_w[out_edge] for v, out_edge in outs if v != u}
+                if not needed:
+                    continue
+                dist = _witness_search(out_adj, ch_w, u, node, max(needed.values()), needed)
+                for v, out_edge in outs:
+                    if v != u and dist.get(v, math.inf) > needed[v]:
+                        found.append((u, v, needed[v], in_edge, out_edge))
+            return found
+
+        def priority(node):
+            edge_difference = len(shortcuts(node)) - len(in_adj[node]) - len(out_adj[node])
+            return edge_difference + contracted_neighbors[node]
+
+        heap = [(priority(node), node) for node in range(n)]
+        heapq.heapify(heap)
+        rank = [0] * n
+        contracted = [False] * n
+        order = 0
+
+        while heap:
+            _, node = heapq.heappop(heap)
+            if contracted[node]:
+                continue
+            # Actualización perezosa: si la prioridad empeoró, se vuelve a encolar
+            current = priority(node)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, node))
+                continue
+
+            for u, v, w, in_edge, out_edge in shortcuts(node):
+                add_edge(u, v, w, in_edge, out_edge)
+
+            neighbors = set(in_adj[node]) | set(out_adj[node])
+            for u in in_adj[node]:
+                out_adj[u].pop(node, None)
+            for v in out_adj[node]:
+                in_adj[v].pop(node, None)
+            for neighbor in neighbors:
+                contracted_neighbors[neighbor] += 1
+
+            contracted[node] = True
+            rank[node] = order
+            order += 1
+
+        # Las aristas reemplazadas por otras más baratas no se usan en las búsquedas,
+        # pero se conservan para no renumerar los hijos de los atajos
+        return cls(rank, src, dst, ch_w, child_a, child_b, alive, graph_fingerprint(graph, weights))
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path,
+            rank=self.rank,
+            src=self.src,
+            dst=self.dst,
+            weight=self.weight,
+            child_a=self.child_a,
+            child_b=self.child_b,
+            alive=self.alive,
+            fingerprint=np.array(self.fingerprint)
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["rank"],
+                data["src"],
+                data["dst"],
+                data["weight"],
+                data["child_a"],
+                data["child_b"],
+                data["alive"],
+                str(data["fingerprint"])
+            )
+
+    def query(self, source, target):
+        """Búsqueda bidireccional ascendente.
+
+        Devuelve (aristas originales del camino, costo total, nodos asentados);
+        la lista es None si no existe camino.
+        """
+        if source == target:
+            return [], 0.0, 0
+
+        src, dst, weight = self._src, self._dst, self._weight
+        fwd_indptr, fwd_edges = self._fwd_indptr, self._fwd_edges
+        bwd_indptr, bwd_edges = self._bwd_indptr, self._bwd_edges
+
+        dist_f = {source: 0.0}
+        dist_b = {target: 0.0}
+        parent_f = {}
+        parent_b = {}
+        heap_f = [(0.0, source)]
+        heap_b = [(0.0, target)]
+        best = math.inf
+        meeting = None
+        settled = 0
+
+        while heap_f or heap_b:
+            top_f = heap_f[0][0] if heap_f else math.inf
+            top_b = heap_b[0][0] if heap_b else math.inf
+            if min(top_f, top_b) >= best:
+                break
+
+            if top_f <= top_b:
+                d, node = heapq.heappop(heap_f)
+                if d > dist_f[node]:
+                    continue
+                settled += 1
+                other = dist_b.get(node)
+                if other is not None and d + other < best:
+                    best = d + other
+                    meeting = node
+                for i in range(fwd_indptr[node], fwd_indptr[node + 1]):
+                    edge = fwd_edges[i]
+                    nxt = dst[edge]
+                    nd = d + weight[edge]
+                    if nd < dist_f.get(nxt, math.inf):
+                        dist_f[nxt] = nd
+                        parent_f[nxt] = edge
+                        heapq.heappush(heap_f, (nd, nxt))
+            else:
+                d, node = heapq.heappop(heap_b)
+                if d > dist_b[node]:
+                    continue
+                settled += 1
+                other = dist_f.get(node)
+                if other is not None and d + other < best:
+                    best = d + other
+                    meeting = node
+                for i in range(bwd_indptr[node], bwd_indptr[node + 1]):
+                    edge = bwd_edges[i]
+                    nxt = src[edge]
+                    nd = d + weight[edge]
+                    if nd < dist_b.get(nxt, math.inf):
+                        dist_b[nxt] = nd
+                        parent_b[nxt] = edge
+                        heapq.heappush(heap_b, (nd, nxt))
+
+        if meeting is None:
+            return None, math.inf, settled
+
+        ch_path = []
+        node = meeting
+        while node != source:
+            edge = parent_f[node]
+            ch_path.append(edge)
+            node = src[edge]
+        ch_path.reverse()
+        node = meeting
+        while node != target:
+            edge = parent_b[node]
+            ch_path.append(edge)
+            node = dst[edge]
+
+        return self.unpack(ch_path), best, settled
+
+    def unpack(self, ch_path):
+        child_a, child_b = self._child_a, self._child_b
+        edges = []
+        stack = list(reversed(ch_path))
+        while stack:
+            edge = stack.pop()
+            if child_a[edge] == -1:
+                edges.append(child_b[edge])
+            else:
+                stack.append(child_b[edge])
+                stack.append(child_a[edge])
+        return edges
+
+
+def load_hierarchy(graph, weights, profile_key, directory=CH_DATA_DIR):
+    path = Path(directory) / profile_file_name(profile_key)
+    if not path.exists():
+        return None
+    hierarchy = ContractionHierarchy.load(path)
+    if hierarchy.fingerprint != graph_fingerprint(graph, weights):
+        print(f"Contraction hierarchy {path.name} is stale, rebuild it with preprocess_ch.py")
+        return None
+    return hierarchy
@@ -0,0 +1,116 @@
+import os
+import time
+import numpy as np
+
+# Peso del ETA según prioridad del incidente (1 = más urgente)
+PRIORITY_WEIGHTS = {1: 4.0, 2: 2.0, 3: 1.0}
+# Costo (en segundos, antes del peso) de dejar un incidente sin unidad: mayor que cualquier ETA real
+UNASSIGNED_PENALTY_S = float(os.getenv("DISPATCH_UNASSIGNED_PENALTY_S", "21600"))
+# Por encima de este tamaño (incidentes x unidades) se usa directamente la asignación voraz
+DISPATCH_HUNGARIAN_MAX_CELLS = int(os.getenv("DISPATCH_HUNGARIAN_MAX_CELLS", "250000"))
+# Tiempo de la asignación (sin contar la matriz de ETAs) tras el cual el método húngaro cede a la voraz
+DISPATCH_TIME_BUDGET_MS = float(os.getenv("DISPATCH_TIME_BUDGET_MS", "500"))
+
+
+def hungarian(cost, deadline=None):
+    """Asignación de costo mínimo para una matriz filas <= columnas.
+
+    Camino aumentante más corto con potenciales (Jonker-Volgenant): una fila
+    por vez, cada paso del Dijkstra sobre todas las columnas es vectorizado.
+    Devuelve la columna de cada fila, o None si se pasa de `deadline`
+    (time.perf_counter()).
+    """
+    n, m = cost.shape
+    if n > m:
+        raise ValueError("hungarian espera filas <= columnas")
+
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    # row_of[j]: fila (desde 1) asignada a la columna j; la columna 0 es ficticia
+    row_of = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+
+    for i in range(1, n + 1):
+        if deadline is not None and time.perf_counter() > deadline:
+            return None
+        row_of[0] = i
+        j0 = 0
+        min_reduced = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = row_of[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            improve = free & (reduced < min_reduced[1:])
+            min_reduced[1:][improve] = reduced[improve]
+            way[1:][improve] = j0
+
+            candidates = np.where(free, min_reduced[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[row_of[used]] += delta
+            v[used] -= delta
+            min_reduced[~used] -= delta
+            j0 = j1
+            if row_of[j0] == 0:
+                break
+
+        # Invierte el camino aumentante
+        while j0:
+            j1 = way[j0]
+            row_of[j0] = row_of[j1]
+            j0 = j1
+
+    assignment = np.full(n, -1, dtype=np.int64)
+    columns = np.nonzero(row_of[1:])[0]
+    assignment[row_of[columns + 1] - 1] = columns
+    return assignment
+
+
+def greedy_assignment(cost, order):
+    # Cada fila, en el orden dado (prioridad), toma la columna libre más barata
+    n, m = cost.shape
+    taken = np.zeros(m, dtype=bool)
+    assignment = np.full(n, -1, dtype=np.int64)
+    for row in order:
+        costs = np.where(taken, np.inf, cost[row])
+        column = int(np.argmin(costs))
+        if np.isfinite(costs[column]):
+            assignment[row] = column
+            taken[column] = True
+    return assignment
+
+
+def assign_units(eta_seconds, priorities, deadline=None):
+    """Unidad para cada incidente minimizando la suma de ETAs ponderados por prioridad.
+
+    `eta_seconds` es incidentes x unidades (NaN si no hay ruta). Se agrega
+    una columna ficticia por incidente con el costo de dejarlo sin unidad,
+    así sobran unidades o incidentes. Devuelve (unidad o -1 por incidente,
+    método usado).
+    """
+    n_incidents, n_units = eta_seconds.shape
+    weights = np.array([PRIORITY_WEIGHTS[priority] for priority in priorities], dtype=np.float64)
+    penalty = weights * UNASSIGNED_PENALTY_S
+
+    weighted = eta_seconds * weights[:, None]
+    # Una unidad sin ruta nunca le gana a quedarse sin unidad
+    weighted = np.where(np.isfinite(weighted), weighted, 2.0 * penalty[:, None])
+    unassigned = np.full((n_incidents, n_incidents), np.inf)
+    np.fill_diagonal(unassigned, penalty)
+    cost = np.hstack([weighted, unassigned])
+
+    assignment = None
+    method = "voraz"
+    if cost.size <= DISPATCH_HUNGARIAN_MAX_CELLS:
+        assignment = hungarian(cost, deadline)
+        method = "hungaro"
+    if assignment is None:
+        method = "voraz"
+        # Más urgentes primero; a igual prioridad, los que tienen la unidad más cercana
+        order = np.lexsort((weighted.min(axis=1), -weights))
+        assignment = greedy_assignment(cost, order)
+
+    assignment[assignment >= n_units] = -1
+    return assignment, method
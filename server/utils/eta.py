@@ -0,0 +1,68 @@
+import numpy as np
+from .traffic_profiles import base_travel_seconds, road_type_multipliers
+from .trafficDetails import format_hours
+
+
+class EtaEngine:
+    """ETA por columnas: mismo modelo que calculate_approx_time, sobre arreglos por arista.
+
+    Las velocidades se interpretan una sola vez al cargar el grafo; el tiempo
+    de una ruta (o de muchas) es una indexación y una suma acumulada de NumPy.
+    """
+
+    def __init__(self, graph, overlay=None):
+        self.graph = graph
+        # A diferencia de los pesos de ruteo, calculate_approx_time usa el tipo de calle sin exponente
+        self.base_edge_seconds = base_travel_seconds(graph) * road_type_multipliers(graph)
+        self.overlay = overlay
+        self._overlay_seconds = (None, None)
+
+    @property
+    def edge_seconds(self):
+        # Con un RoadOverlay vigente, los tramos con costo multiplicado o velocidad fijada tardan más (o menos)
+        if self.overlay is None or not self.overlay.active:
+            return self.base_edge_seconds
+        version = self.overlay.current_version()
+        cached_version, seconds = self._overlay_seconds
+        if cached_version != version:
+            seconds = self.base_edge_seconds.copy()
+            for edge, multiplier in self.overlay.multipliers().items():
+                if np.isfinite(multiplier):
+                    seconds[edge] *= multiplier
+            self._overlay_seconds = (version, seconds)
+        return seconds
+
+    def step_seconds(self, edges, traffic_factor):
+        return self.edge_seconds[np.asarray(edges, dtype=np.int64)] * traffic_factor
+
+    def route_eta(self, edges, traffic_factor):
+        # (segundos por paso, segundos acumulados al terminar cada paso)
+        steps = self.step_seconds(edges, traffic_factor)
+        return steps, np.cumsum(steps)
+
+    def batch_totals(self, routes, traffic_factors):
+        """Segundos totales de muchas rutas (listas de aristas) en una sola pasada.
+
+        `traffic_factors` puede ser un escalar o un factor por ruta.
+        """
+        lengths = np.fromiter((len(edges) for edges in routes), dtype=np.int64, count=len(routes))
+        totals = np.zeros(len(routes), dtype=np.float64)
+        if lengths.sum() == 0:
+            return totals
+        all_edges = np.concatenate([np.asarray(edges, dtype=np.int64) for edges in routes])
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        non_empty = lengths > 0
+        totals[non_empty] = np.add.reduceat(self.edge_seconds[all_edges], starts[non_empty])
+        return totals * np.asarray(traffic_factors, dtype=np.float64)
+
+    def annotate(self, records, edges, traffic_factor):
+        # Agrega los segundos por paso y acumulados a los registros de build_records
+        steps, cumulative = self.route_eta(edges, traffic_factor)
+        for record, step, total in zip(records, steps.tolist(), cumulative.tolist()):
+            record["tiempo_paso_segundos"] = round(step, 1)
+            record["tiempo_acumulado_segundos"] = round(total, 1)
+        return float(cumulative[-1]) if len(cumulative) else 0.0
+
+
+def format_seconds(total_seconds):
+    return format_hours(total_seconds / 3600.0)
@@ -0,0 +1,26 @@
+from .ttl_cache import TTLCache
+
+
+class GeocodeCache(TTLCache):
+    """Caché LRU con expiración (TTL) para resolver textos de entrada a direcciones del grafo.
+
+    Las llaves son el texto normalizado; los valores, lo que haya resuelto el
+    controlador (dirección de Intersection y nodo, o la lista de coincidencias
+    de find_similar_address). Cuenta aciertos y fallos para /geocode-cache/stats.
+    """
+
+    def __init__(self, maxsize=2048, ttl_s=3600.0):
+        super().__init__(maxsize, ttl_s)
+        self.generation = 0
+
+    def put(self, key, value, generation=None):
+        with self._lock:
+            # Un resultado calculado antes de invalidar no debe volver a entrar
+            if generation is not None and generation != self.generation:
+                return
+            self._store(key, value)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
@@ -0,0 +1,116 @@
+import time
+import threading
+import numpy as np
+
+
+class HospitalTrees:
+    """Árboles de caminos mínimos inversos con raíz en cada hospital, para un perfil de pesos.
+
+    `cost[h, v]` es el costo desde v hasta el hospital h y `next_edge[h, v]` la
+    arista que sale de v en ese camino, así que la ruta se reconstruye en
+    O(largo del camino).
+    """
+
+    def __init__(self, graph, weights, hospitals, version=0):
+        self.graph = graph
+        self.version = version
+        self.names = list(hospitals.keys())
+        self.nodes = np.asarray(list(hospitals.values()), dtype=np.int32)
+
+        cost = np.empty((len(self.names), graph.node_count), dtype=np.float32)
+        next_edge = np.empty((len(self.names), graph.node_count), dtype=np.int32)
+        for i, node in enumerate(self.nodes):
+            cost[i], next_edge[i] = graph.shortest_path_tree(int(node), weights, reverse=True)
+        self.cost = cost
+        self.next_edge = next_edge
+
+    def nearest(self, node, k=3):
+        costs = self.cost[:, node]
+        reachable = np.nonzero(np.isfinite(costs))[0]
+        if len(reachable) > k:
+            reachable = reachable[np.argpartition(costs[reachable], k)[:k]]
+        ranked = reachable[np.argsort(costs[reachable], kind="stable")]
+        return [(int(h), float(costs[h])) for h in ranked]
+
+    def path_edges(self, hospital, node):
+        edges = []
+        next_edge = self.next_edge[hospital]
+        target = int(self.nodes[hospital])
+        edge_target = self.graph.edge_target
+        while node != target:
+            edge = int(next_edge[node])
+            if edge < 0:
+                return None
+            edges.append(edge)
+            node = int(edge_target[edge])
+        return edges
+
+
+class HospitalTreeService:
+    """Mantiene un HospitalTrees por perfil de pesos y los recalcula en segundo plano.
+
+    `weights_version(profile_key)` indica la versión vigente de los pesos de un
+    perfil; cuando cambia, el árbol de ese perfil se vuelve a calcular en el
+    hilo de fondo y se reemplaza de forma atómica. Mientras tanto `get`
+    devuelve el anterior; solo se calcula en línea si el perfil no tiene
+    ninguno todavía.
+    """
+
+    def __init__(self, graph, profiles, hospitals, weights_version=None):
+        self.graph = graph
+        self.profiles = profiles
+        self.hospitals = hospitals
+        self.weights_version = weights_version or (lambda profile_key: 0)
+        self._trees = {}
+        self._build_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def get(self, profile_key):
+        trees = self._trees.get(profile_key)
+        if trees is None or (self._thread is None and trees.version != self.weights_version(profile_key)):
+            return self.refresh(profile_key)
+        if trees.version != self.weights_version(profile_key):
+            # Pesos nuevos: se despierta al hilo de fondo y se responde con los árboles anteriores
+            self._wake.set()
+        return trees
+
+    def refresh(self, profile_key):
+        with self._build_lock:
+            version = self.weights_version(profile_key)
+            trees = self._trees.get(profile_key)
+            if trees is not None and trees.version == version:
+                return trees
+
+            start = time.perf_counter()
+            weights, _ = self.profiles.get(profile_key)
+            trees = HospitalTrees(self.graph, weights, self.hospitals, version)
+            self._trees[profile_key] = trees
+            print(f"Hospital trees for {profile_key} built in {time.perf_counter() - start:.1f}s")
+            return trees
+
+    def start_background_refresh(self, profile_keys, interval_s=60.0):
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                for profile_key in profile_keys:
+                    if self._stop.is_set():
+                        break
+                    trees = self._trees.get(profile_key)
+                    if trees is None or trees.version != self.weights_version(profile_key):
+                        try:
+                            self.refresh(profile_key)
+                        except Exception as e:
+                            print(f"Error al recalcular árboles de hospitales: {str(e)}")
+                self._wake.wait(interval_s)
+                self._wake.clear()
+
+        self._thread = threading.Thread(target=run, name="hospital-trees", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
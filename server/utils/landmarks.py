@@ -0,0 +1,81 @@
+import numpy as np
+
+LANDMARK_COUNT = 16
+# Landmarks usados por consulta: los que dan la mejor cota para el par origen/destino
+ACTIVE_LANDMARKS = 4
+
+
+class LandmarkIndex:
+    """Heurística ALT (A*, landmarks y desigualdad triangular) para un perfil de pesos.
+
+    Guarda, para cada landmark L, d(L, v) y d(v, L) de todos los nodos. Para
+    cualquier destino t, d(v, t) >= max(d(v, L) - d(t, L), d(L, t) - d(L, v)).
+    """
+
+    def __init__(self, graph, weights, hospital_nodes=(), count=LANDMARK_COUNT):
+        self.graph = graph
+        count = min(count, graph.node_count)
+        hospital_nodes = [node for node in dict.fromkeys(hospital_nodes) if node is not None]
+
+        landmarks = []
+        from_landmark = []
+        to_landmark = []
+
+        def add(node):
+            landmarks.append(node)
+            from_landmark.append(graph.shortest_distances(node, weights))
+            to_landmark.append(graph.shortest_distances(node, weights, reverse=True))
+
+        def farthest(candidates):
+            # Candidato más lejano (alcanzable) del conjunto de landmarks ya elegidos
+            separation = np.min(np.vstack(from_landmark) + np.vstack(to_landmark), axis=0)
+            separation = np.where(np.isfinite(separation), separation, -1.0)
+            separation[landmarks] = -1.0
+            best = candidates[int(np.argmax(separation[candidates]))]
+            return best if separation[best] >= 0 else None
+
+        # Selección por punto más lejano sobre todo el grafo, partiendo del nodo
+        # más alejado de un nodo inicial (el primer hospital si existe)
+        start = hospital_nodes[0] if hospital_nodes else 0
+        dist = graph.shortest_distances(start, weights)
+        dist = np.where(np.isfinite(dist), dist, -1.0)
+        add(int(np.argmax(dist)))
+
+        all_nodes = np.arange(graph.node_count)
+        hospital_slots = min(len(hospital_nodes), count // 2)
+        while len(landmarks) < count - hospital_slots:
+            node = farthest(all_nodes)
+            if node is None:
+                break
+            add(int(node))
+
+        # El resto, entre los hospitales: son los destinos más frecuentes y un
+        # landmark en el destino da la cota exacta
+        candidates = np.asarray(hospital_nodes, dtype=np.int64)
+        while len(landmarks) < count and len(candidates):
+            node = farthest(candidates)
+            if node is None:
+                break
+            add(int(node))
+
+        self.landmarks = np.asarray(landmarks, dtype=np.int32)
+        self.from_landmark = np.vstack(from_landmark).astype(np.float32)
+        self.to_landmark = np.vstack(to_landmark).astype(np.float32)
+
+    def heuristic(self, source, target, active=ACTIVE_LANDMARKS):
+        to_l, from_l = self.to_landmark, self.from_landmark
+
+        with np.errstate(invalid="ignore"):
+            pair_bounds = np.fmax(to_l[:, source] - to_l[:, target], from_l[:, target] - from_l[:, source])
+            pair_bounds = np.nan_to_num(pair_bounds, nan=0.0, posinf=np.finfo(np.float32).max)
+            chosen = np.argsort(-pair_bounds)[:active]
+
+            bound = np.fmax(
+                to_l[chosen] - to_l[chosen, target][:, None],
+                from_l[chosen, target][:, None] - from_l[chosen]
+            )
+            bound = np.fmax.reduce(bound, axis=0)
+
+        bound = np.nan_to_num(bound.astype(np.float64), nan=0.0)
+        # Margen para los redondeos de float32
+        return np.maximum(0.999 * bound, 0.0)
@@ -0,0 +1,409 @@
+import os
+import heapq
+import threading
+import numpy as np
+
+# Distancia por delante de cada ambulancia en la que los conductores deben ceder
+LANE_HORIZON_M = float(os.getenv("LANE_HORIZON_M", "60"))
+# Hueco libre (hacia adelante y atrás) que necesita un auto para pasarse a otro carril
+LANE_MIN_GAP_M = float(os.getenv("LANE_MIN_GAP_M", "8"))
+LANE_CHANGE_S = float(os.getenv("LANE_CHANGE_S", "2"))
+# Reacción de un conductor con nivel 0; con nivel 100, un tercio
+LANE_REACTION_S = float(os.getenv("LANE_REACTION_S", "1.5"))
+# Costo de un carril con un auto que no tiene a dónde moverse
+LANE_STUCK_PENALTY_S = 10.0
+# Distancia mínima de la ambulancia al auto de adelante en su carril
+AMBULANCE_SAFE_GAP_M = 10.0
+# La ambulancia debe dejar atrás al auto orillado por esto antes de que se reincorpore
+REJOIN_CLEARANCE_M = 20.0
+
+NORMAL, CHANGING, WAITING, SHOULDER = 0, 1, 2, 3
+STATE_NAMES = ("normal", "cambiando", "esperando", "orilla")
+
+
+class LaneScene:
+    """Escena de varios carriles con autos y ambulancias, que avanza por pasos de tiempo.
+
+    Los autos se guardan por columnas (carril, posición en metros sobre la vía,
+    velocidad, nivel 0..1 y estado) para calcular en bloque quién bloquea a
+    cada ambulancia y qué hueco tiene al lado. En cada paso, los que bloquean
+    van a un montículo por carril según cuánto falta para que la ambulancia
+    los alcance; se atienden en ese orden (mezclando los carriles), y cada
+    uno que cede reserva su hueco antes de que decida el siguiente. La
+    ambulancia además se pasa al carril vecino si despejarlo cuesta menos.
+
+    El carril -1 es la orilla: ahí se detienen los autos de los carriles de
+    los extremos que no tienen hueco, hasta que pasen las ambulancias.
+    """
+
+    def __init__(self, lanes, capacity=256):
+        if lanes < 1:
+            raise ValueError("La escena necesita al menos un carril")
+        self.lanes = lanes
+        self.t = 0.0
+        self.ids = []
+        self.slots = {}
+        self._free = []
+        self.lane = np.zeros(capacity, dtype=np.int32)
+        self.pos = np.zeros(capacity)
+        self.speed = np.zeros(capacity)
+        self.skill = np.zeros(capacity)
+        self.state = np.zeros(capacity, dtype=np.int8)
+        self.target = np.zeros(capacity, dtype=np.int32)
+        self.timer = np.zeros(capacity)
+        # Carril y velocidad antes de orillarse, para reincorporarse
+        self.home_lane = np.zeros(capacity, dtype=np.int32)
+        self.home_speed = np.zeros(capacity)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.ambulances = {}
+        self._changed = set()
+        self._order = 0
+        self.lock = threading.Lock()
+
+    def _grow(self):
+        capacity = 2 * len(self.alive)
+        for name in ("lane", "pos", "speed", "skill", "state", "target", "timer", "home_lane", "home_speed", "alive"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _check_lane(self, lane):
+        if not 0 <= lane < self.lanes:
+            raise ValueError(f"Carril {lane} fuera de la escena (0 a {self.lanes - 1})")
+
+    def upsert_vehicle(self, vehicle_id, lane=None, position=None, speed=None, skill=None):
+        # Alta o actualización parcial; un auto nuevo necesita carril y posición
+        if lane is not None:
+            self._check_lane(lane)
+        slot = self.slots.get(vehicle_id)
+        if slot is None:
+            if lane is None or position is None:
+                raise ValueError(f"El vehículo nuevo {vehicle_id} necesita carril y posicion")
+            if not self._free and len(self.ids) == len(self.alive):
+                self._grow()
+            slot = self._free.pop() if self._free else len(self.ids)
+            if slot == len(self.ids):
+                self.ids.append(vehicle_id)
+            else:
+                self.ids[slot] = vehicle_id
+            self.slots[vehicle_id] = slot
+            self.alive[slot] = True
+            self.state[slot] = NORMAL
+            self.speed[slot] = 0.0
+            self.skill[slot] = 0.5
+        if lane is not None:
+            self.lane[slot] = lane
+            self.state[slot] = NORMAL
+        if position is not None:
+            self.pos[slot] = position
+        if speed is not None:
+            self.speed[slot] = speed
+        if skill is not None:
+            self.skill[slot] = min(max(skill, 0.0), 1.0)
+        self._changed.add(slot)
+
+    def remove_vehicle(self, vehicle_id):
+        slot = self.slots.pop(vehicle_id, None)
+        if slot is not None:
+            self.alive[slot] = False
+            self.ids[slot] = None
+            self._free.append(slot)
+            self._changed.discard(slot)
+
+    def upsert_ambulance(self, ambulance_id, lane=None, position=None, speed=None):
+        if lane is not None:
+            self._check_lane(lane)
+        ambulance = self.ambulances.get(ambulance_id)
+        if ambulance is None:
+            if lane is None or position is None:
+                raise ValueError(f"La ambulancia nueva {ambulance_id} necesita carril y posicion")
+            ambulance = {"id": ambulance_id, "velocidad_deseada": 15.0, "velocidad": 15.0, "bloqueada": False}
+            self.ambulances[ambulance_id] = ambulance
+        if lane is not None:
+            ambulance["carril"] = lane
+        if position is not None:
+            ambulance["posicion"] = float(position)
+        if speed is not None:
+            ambulance["velocidad_deseada"] = float(speed)
+
+    def remove_ambulance(self, ambulance_id):
+        self.ambulances.pop(ambulance_id, None)
+
+    def validate_updates(self, vehicles=(), ambulances=(), removed=(), removed_ambulances=(), max_vehicles=None):
+        # Revisa el delta completo sin tocar la escena: si algo falla, no se aplica nada
+        known = set(self.slots) - set(removed)
+        for vehicle in vehicles:
+            if vehicle["placa"] not in known:
+                if vehicle.get("carril") is None or vehicle.get("posicion") is None:
+                    raise ValueError(f"El vehículo nuevo {vehicle['placa']} necesita carril y posicion")
+                known.add(vehicle["placa"])
+            if vehicle.get("carril") is not None:
+                self._check_lane(vehicle["carril"])
+        if max_vehicles is not None and len(known) > max_vehicles:
+            raise ValueError(f"La escena no puede tener más de {max_vehicles} vehículos")
+
+        known = set(self.ambulances) - set(removed_ambulances)
+        for ambulance in ambulances:
+            if ambulance["id"] not in known:
+                if ambulance.get("carril") is None or ambulance.get("posicion") is None:
+                    raise ValueError(f"La ambulancia nueva {ambulance['id']} necesita carril y posicion")
+                known.add(ambulance["id"])
+            if ambulance.get("carril") is not None:
+                self._check_lane(ambulance["carril"])
+
+    def apply_updates(self, vehicles=(), ambulances=(), removed=(), removed_ambulances=(), skill_lookup=None, max_vehicles=None):
+        """Aplica un delta de la escena: altas y cambios parciales, y bajas por placa o id.
+
+        Los vehículos vienen como {"placa", "carril", "posicion", "velocidad",
+        "nivel de conduccion" (0..100)}; si un auto nuevo no trae nivel, se
+        pide a `skill_lookup(placa)`. Un delta inválido (ValueError) no cambia
+        la escena.
+        """
+        self.validate_updates(vehicles, ambulances, removed, removed_ambulances, max_vehicles)
+        for vehicle_id in removed:
+            self.remove_vehicle(vehicle_id)
+        for ambulance_id in removed_ambulances:
+            self.remove_ambulance(ambulance_id)
+        for vehicle in vehicles:
+            level = vehicle.get("nivel de conduccion")
+            if level is None and vehicle["placa"] not in self.slots and skill_lookup is not None:
+                level = skill_lookup(vehicle["placa"])
+            self.upsert_vehicle(
+                vehicle["placa"], vehicle.get("carril"), vehicle.get("posicion"), vehicle.get("velocidad"),
+                level / 100.0 if level is not None else None
+            )
+        for ambulance in ambulances:
+            self.upsert_ambulance(ambulance["id"], ambulance.get("carril"), ambulance.get("posicion"), ambulance.get("velocidad"))
+
+    def _lane_positions(self, active):
+        # Posiciones ordenadas de los autos de cada carril (la orilla no cuenta)
+        lanes = self.lane[active]
+        positions = self.pos[active]
+        order = np.lexsort((positions, lanes))
+        lanes, positions = lanes[order], positions[order]
+        bounds = np.searchsorted(lanes, np.arange(self.lanes + 1))
+        return [positions[bounds[lane]:bounds[lane + 1]] for lane in range(self.lanes)]
+
+    @staticmethod
+    def _gaps(sorted_positions, positions):
+        # Distancia de cada posición al auto más cercano del carril (inf si está vacío)
+        if len(sorted_positions) == 0:
+            return np.full(len(positions), np.inf)
+        i = np.searchsorted(sorted_positions, positions)
+        ahead = np.where(i < len(sorted_positions), sorted_positions[np.minimum(i, len(sorted_positions) - 1)] - positions, np.inf)
+        behind = np.where(i > 0, positions - sorted_positions[np.maximum(i - 1, 0)], np.inf)
+        return np.minimum(ahead, behind)
+
+    def _side_gaps(self, lane_positions, lanes, positions):
+        # Hueco en el carril de la izquierda (carril - 1) y de la derecha (carril + 1); -inf si no existe
+        left = np.full(len(lanes), -np.inf)
+        right = np.full(len(lanes), -np.inf)
+        for lane in range(self.lanes):
+            here = lanes == lane
+            if not here.any():
+                continue
+            if lane > 0:
+                left[here] = self._gaps(lane_positions[lane - 1], positions[here])
+            if lane < self.lanes - 1:
+                right[here] = self._gaps(lane_positions[lane + 1], positions[here])
+        return left, right
+
+    def _reaction(self, slots):
+        return LANE_REACTION_S * (1.0 - 2.0 / 3.0 * self.skill[slots])
+
+    def step(self, dt):
+        """Avanza la escena `dt` segundos y devuelve los eventos del paso."""
+        events = []
+        self.t += dt
+        n = len(self.ids)
+        alive = self.alive[:n]
+        ambulances = sorted(self.ambulances.values(), key=lambda ambulance: ambulance["posicion"])
+
+        # Movimiento y cambios de carril que terminan
+        moving = alive & (self.state[:n] != SHOULDER)
+        self.pos[:n][moving] += self.speed[:n][moving] * dt
+        self.timer[:n][moving] -= dt
+        done = np.flatnonzero(alive & (self.state[:n] == CHANGING) & (self.timer[:n] <= 0))
+        for slot in done.tolist():
+            if self.target[slot] < 0:
+                self.home_speed[slot] = self.speed[slot]
+                self.speed[slot] = 0.0
+                self.state[slot] = SHOULDER
+            else:
+                self.state[slot] = NORMAL
+            self.lane[slot] = self.target[slot]
+            self._changed.add(slot)
+
+        # Orillados que ya dejaron pasar a todas las ambulancias vuelven a su carril
+        parked = np.flatnonzero(alive & (self.state[:n] == SHOULDER))
+        if len(parked):
+            last = min((ambulance["posicion"] for ambulance in ambulances), default=np.inf)
+            behind_everyone = self.pos[parked] + REJOIN_CLEARANCE_M < last
+            for slot in parked[behind_everyone].tolist():
+                self.lane[slot] = self.home_lane[slot]
+                self.speed[slot] = self.home_speed[slot]
+                self.state[slot] = NORMAL
+                self._changed.add(slot)
+                events.append(self._event("reincorporar", slot, -1, int(self.home_lane[slot])))
+
+        active = np.flatnonzero(alive & (self.lane[:n] >= 0))
+        if not ambulances or len(active) == 0:
+            self._advance_ambulances(ambulances, active, dt)
+            return events
+        lane_positions = self._lane_positions(active)
+        lanes, positions = self.lane[active], self.pos[active]
+
+        # Cuánto falta para que cada ambulancia alcance a cada auto de adelante (autos x ambulancias)
+        amb_lane = np.array([ambulance["carril"] for ambulance in ambulances])
+        amb_pos = np.array([ambulance["posicion"] for ambulance in ambulances])
+        amb_speed = np.array([max(ambulance["velocidad_deseada"], 0.1) for ambulance in ambulances])
+        ahead = positions[:, None] - amb_pos[None, :]
+        window = (ahead > 0) & (ahead <= LANE_HORIZON_M)
+        closing = np.maximum(amb_speed[None, :] - self.speed[active][:, None], 0.5)
+        reach_s = np.where(window, ahead / closing, np.inf)
+
+        left, right = self._side_gaps(lane_positions, lanes, positions)
+        # Carriles por donde va una ambulancia que todavía no pasó: ahí no se cede
+        emergency = np.zeros((len(active), self.lanes + 2), dtype=bool)
+        behind_or_near = (ahead > -AMBULANCE_SAFE_GAP_M)
+        for j, lane in enumerate(amb_lane.tolist()):
+            emergency[:, lane + 1] |= behind_or_near[:, j]
+        rows = np.arange(len(active))
+        left_ok = (left >= LANE_MIN_GAP_M) & ~emergency[rows, lanes]
+        right_ok = (right >= LANE_MIN_GAP_M) & ~emergency[rows, np.minimum(lanes + 2, self.lanes + 1)]
+        edge = (lanes == 0) | (lanes == self.lanes - 1)
+        can_yield = left_ok | right_ok | edge
+        yield_s = np.where(can_yield, self._reaction(active) + LANE_CHANGE_S, LANE_STUCK_PENALTY_S)
+
+        # La ambulancia elige carril: el suyo o un vecino, si despejarlo cuesta menos
+        for j, ambulance in enumerate(ambulances):
+            in_window = window[:, j] & (self.state[active] != CHANGING)
+            cost = np.bincount(lanes[in_window], weights=yield_s[in_window], minlength=self.lanes)
+            lane = ambulance["carril"]
+            best = lane
+            for side in (lane - 1, lane + 1):
+                if 0 <= side < self.lanes and cost[side] + LANE_CHANGE_S < cost[best]:
+                    gap = self._gaps(lane_positions[side], np.array([ambulance["posicion"]]))[0]
+                    if gap >= AMBULANCE_SAFE_GAP_M:
+                        best = side
+            if best != lane:
+                ambulance["carril"] = best
+                amb_lane[j] = best
+                events.append({"t": round(self.t, 2), "tipo": "carril_ambulancia", "ambulancia": ambulance["id"], "desde_carril": lane, "hacia_carril": best})
+
+        # Bloqueadores: en el carril de alguna ambulancia, dentro de su ventana y sin haber empezado a moverse
+        blocking_reach = np.where(lanes[:, None] == amb_lane[None, :], reach_s, np.inf)
+        urgency = blocking_reach.min(axis=1)
+        blocking = np.flatnonzero(np.isfinite(urgency) & np.isin(self.state[active], (NORMAL, WAITING)))
+
+        # Un montículo por carril ordenado por urgencia (y, a igual urgencia, el mejor conductor primero)
+        heaps = {}
+        for i in blocking.tolist():
+            heaps.setdefault(int(lanes[i]), []).append((float(urgency[i]), -float(self.skill[active[i]]), i))
+        heads = []
+        for lane, heap in heaps.items():
+            heapq.heapify(heap)
+            heads.append((heap[0], lane))
+        heapq.heapify(heads)
+
+        # Huecos tomados en este paso por los que ya cedieron
+        reserved = {lane: [] for lane in range(self.lanes)}
+        was_waiting = set(active[self.state[active] == WAITING].tolist())
+        while heads:
+            (_, _, i), lane = heapq.heappop(heads)
+            heap = heaps[lane]
+            heapq.heappop(heap)
+            if heap:
+                heapq.heappush(heads, (heap[0], lane))
+
+            slot = int(active[i])
+            was_waiting.discard(slot)
+            position = float(positions[i])
+            candidates = []
+            for side, side_gap, ok in ((lane - 1, left[i], left_ok[i]), (lane + 1, right[i], right_ok[i])):
+                if not ok:
+                    continue
+                taken = min((abs(position - other) for other in reserved[side]), default=np.inf)
+                if min(side_gap, taken) >= LANE_MIN_GAP_M:
+                    candidates.append((min(side_gap, taken), side))
+            ambulance_id = ambulances[int(np.argmin(blocking_reach[i]))]["id"]
+            if candidates:
+                _, side = max(candidates)
+                reserved[side].append(position)
+                self._start_change(slot, side, "ceder", lane, ambulance_id, events)
+            elif edge[i]:
+                self.home_lane[slot] = lane
+                self._start_change(slot, -1, "orilla", lane, ambulance_id, events)
+            elif self.state[slot] != WAITING:
+                self.state[slot] = WAITING
+                self._changed.add(slot)
+                events.append(self._event("esperar", slot, lane, lane, ambulance_id))
+        # Los que esperaban y ya no bloquean a nadie siguen normal
+        for slot in was_waiting:
+            self.state[slot] = NORMAL
+            self._changed.add(slot)
+
+        self._advance_ambulances(ambulances, active, dt)
+        return events
+
+    def _start_change(self, slot, target, kind, lane, ambulance_id, events):
+        self._order += 1
+        self.state[slot] = CHANGING
+        self.target[slot] = target
+        self.timer[slot] = float(self._reaction(slot)) + LANE_CHANGE_S
+        self._changed.add(slot)
+        event = self._event(kind, slot, lane, target, ambulance_id)
+        event["orden"] = self._order
+        events.append(event)
+
+    def _event(self, kind, slot, from_lane, to_lane, ambulance_id=None):
+        event = {"t": round(self.t, 2), "tipo": kind, "placa": self.ids[slot], "desde_carril": from_lane, "hacia_carril": to_lane}
+        if ambulance_id is not None:
+            event["ambulancia"] = ambulance_id
+        return event
+
+    def _advance_ambulances(self, ambulances, active, dt):
+        # Cada ambulancia avanza hasta quedar a AMBULANCE_SAFE_GAP_M del auto que siga en su carril
+        lanes, positions = self.lane[active], self.pos[active]
+        for ambulance in ambulances:
+            target = ambulance["posicion"] + ambulance["velocidad_deseada"] * dt
+            ahead = positions[(lanes == ambulance["carril"]) & (positions > ambulance["posicion"])]
+            limit = float(ahead.min()) - AMBULANCE_SAFE_GAP_M if len(ahead) else np.inf
+            new_position = max(min(target, limit), ambulance["posicion"])
+            ambulance["velocidad"] = (new_position - ambulance["posicion"]) / dt if dt > 0 else 0.0
+            ambulance["bloqueada"] = target > limit
+            ambulance["posicion"] = new_position
+
+    def vehicle_state(self, slot):
+        return {
+            "placa": self.ids[slot],
+            "carril": int(self.lane[slot]),
+            "posicion": round(float(self.pos[slot]), 2),
+            "velocidad": round(float(self.speed[slot]), 2),
+            "estado": STATE_NAMES[self.state[slot]]
+        }
+
+    def run(self, dt, steps):
+        """Avanza `steps` pasos y devuelve eventos, autos que cambiaron y ambulancias."""
+        events = []
+        for _ in range(steps):
+            events.extend(self.step(dt))
+        changed = sorted(slot for slot in self._changed if self.alive[slot])
+        self._changed = set()
+        return {
+            "t": round(self.t, 2),
+            "eventos": events,
+            "vehiculos": [self.vehicle_state(slot) for slot in changed],
+            "ambulancias": [
+                {
+                    "id": ambulance["id"],
+                    "carril": ambulance["carril"],
+                    "posicion": round(ambulance["posicion"], 2),
+                    "velocidad": round(ambulance["velocidad"], 2),
+                    "bloqueada": ambulance["bloqueada"]
+                }
+                for ambulance in self.ambulances.values()
+            ],
+            "total_vehiculos": len(self.slots)
+        }
@@ -0,0 +1,322 @@
+import os
+import json
+import math
+import time
+import asyncio
+import numpy as np
+from collections import deque
+from .road_graph import EARTH_RADIUS_M
+from .eta import format_seconds
+
+LIVE_TICK_S = float(os.getenv("LIVE_TICK_MS", "250")) / 1000.0
+# Mensajes pendientes por visor; si se llena se descarta el más viejo
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "32"))
+# Más lejos que esto de su ruta, la unidad se desvió y se recalcula la ruta
+LIVE_OFF_ROUTE_M = float(os.getenv("LIVE_OFF_ROUTE_M", "60"))
+# Unidades sin publicar posición durante este tiempo salen del mapa
+LIVE_UNIT_TTL_S = float(os.getenv("LIVE_UNIT_TTL_S", "300"))
+METERS_PER_DEGREE = EARTH_RADIUS_M * math.pi / 180.0
+
+
+class DropOldestQueue:
+    """Cola acotada para un solo event loop: `put` nunca espera, descarta el mensaje más viejo."""
+
+    def __init__(self, maxsize=LIVE_QUEUE_SIZE):
+        self._items = deque(maxlen=maxsize)
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, item):
+        if len(self._items) == self._items.maxlen:
+            self.dropped += 1
+        self._items.append(item)
+        self._ready.set()
+
+    async def get(self):
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._items.popleft()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ActiveRoute:
+    """Ruta en curso de una unidad como polilínea, con segundos y metros acumulados por vértice."""
+
+    def __init__(self, route):
+        self.lat = np.asarray(route["lat"], dtype=np.float64)
+        self.lng = np.asarray(route["lng"], dtype=np.float64)
+        self.cum_seconds = np.concatenate(([0.0], np.cumsum(route["segundos"])))
+        self.cum_meters = np.concatenate(([0.0], np.cumsum(route["metros"])))
+        self.destination = route["destino"]
+        self.version = route["version"]
+        # Segmento alcanzado: solo avanza, así una ruta que pasa dos veces cerca no retrocede
+        self.progress = 0
+
+
+def locate_routes(routes, lats, lngs):
+    """Proyecta la posición de cada unidad sobre su ruta, todas en una sola pasada vectorizada.
+
+    Devuelve arreglos de metros fuera de la ruta, segundos restantes y
+    metros restantes, y avanza `progress` de cada ruta.
+    """
+    n = len(routes)
+    off_route, seconds, meters = np.zeros(n), np.zeros(n), np.zeros(n)
+    # Una ruta de un solo nodo ya llegó: todo en cero
+    active = [i for i, route in enumerate(routes) if len(route.lat) >= 2]
+    if not active:
+        return off_route, seconds, meters
+
+    starts = np.array([max(routes[i].progress - 1, 0) for i in active], dtype=np.int64)
+    counts = np.array([len(routes[i].lat) - 1 for i in active], dtype=np.int64) - starts
+    owner = np.repeat(np.arange(len(active)), counts)
+    # Índice de segmento dentro de su ruta
+    segment = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+
+    lat0 = np.concatenate([routes[i].lat[start:-1] for i, start in zip(active, starts.tolist())])
+    lng0 = np.concatenate([routes[i].lng[start:-1] for i, start in zip(active, starts.tolist())])
+    lat1 = np.concatenate([routes[i].lat[start + 1:] for i, start in zip(active, starts.tolist())])
+    lng1 = np.concatenate([routes[i].lng[start + 1:] for i, start in zip(active, starts.tolist())])
+    point_lat = np.asarray(lats, dtype=np.float64)[active][owner]
+    point_lng = np.asarray(lngs, dtype=np.float64)[active][owner]
+
+    kx = METERS_PER_DEGREE * np.cos(np.radians(point_lat))
+    ax, ay = (lng0 - point_lng) * kx, (lat0 - point_lat) * METERS_PER_DEGREE
+    vx, vy = (lng1 - lng0) * kx, (lat1 - lat0) * METERS_PER_DEGREE
+    length_sq = vx * vx + vy * vy
+    t = np.clip(-(ax * vx + ay * vy) / np.where(length_sq > 0, length_sq, 1.0), 0.0, 1.0)
+    distances = np.hypot(ax + t * vx, ay + t * vy)
+
+    # Segmento más cercano por unidad: los de cada unidad quedan contiguos
+    group_start = np.cumsum(counts) - counts
+    at_min = np.flatnonzero(distances == np.minimum.reduceat(distances, group_start)[owner])
+    best = at_min[np.concatenate(([True], owner[at_min][1:] != owner[at_min][:-1]))]
+
+    for j, i in enumerate(active):
+        route, k, fraction = routes[i], int(segment[best[j]]), float(t[best[j]])
+        route.progress = k
+        off_route[i] = distances[best[j]]
+        seconds[i] = route.cum_seconds[-1] - (route.cum_seconds[k] + fraction * (route.cum_seconds[k + 1] - route.cum_seconds[k]))
+        meters[i] = route.cum_meters[-1] - (route.cum_meters[k] + fraction * (route.cum_meters[k + 1] - route.cum_meters[k]))
+    return off_route, seconds, meters
+
+
+class Subscriber:
+    # Visor del mapa: todas las unidades, una lista de unidades o un área (lat_min, lng_min, lat_max, lng_max)
+    def __init__(self, units=None, area=None):
+        self.queue = DropOldestQueue()
+        self.set_filter(units, area)
+
+    def set_filter(self, units=None, area=None):
+        self.units = frozenset(units) if units else None
+        self.area = tuple(area) if area else None
+        self.key = (self.units, self.area)
+
+    def wants(self, state):
+        if self.units is not None and state["id"] not in self.units:
+            return False
+        if self.area is not None:
+            lat_min, lng_min, lat_max, lng_max = self.area
+            return lat_min <= state["lat"] <= lat_max and lng_min <= state["lng"] <= lng_max
+        return True
+
+
+class TrackingHub:
+    """Posiciones en vivo de las unidades, repartidas a los visores en ticks.
+
+    Las unidades publican posiciones cuando quieran (`publish` solo guarda
+    la última); cada `tick_s` se recalcula el ETA restante de las que se
+    movieron sobre su ruta activa y se manda a cada visor un solo mensaje con
+    las que le interesan, serializado una vez por filtro. Cada visor tiene su
+    propia cola acotada: uno lento pierde ticks viejos pero no frena a nadie.
+
+    `route_provider(unidad, {"lat", "lng"}, destino)` arma la ruta (en un hilo);
+    se vuelve a pedir si la unidad se desvía o si `version_provider()`
+    (cierres) cambia. `version_provider` corre en el event loop en cada tick:
+    no debe bloquear; None mientras no haya versión.
+    """
+
+    def __init__(self, route_provider, version_provider=None, tick_s=LIVE_TICK_S):
+        self.route_provider = route_provider
+        self.version_provider = version_provider
+        self.tick_s = tick_s
+        self.units = {}
+        self.subscribers = set()
+        self._dirty = set()
+        self._routing = set()
+        self._task = None
+        self.ticks = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Live tracking tick failed: {e}")
+            await asyncio.sleep(max(self.tick_s - (time.monotonic() - started), 0.0))
+
+    def publish(self, unit_id, lat, lng, t=None, destination=None):
+        state = self.units.get(unit_id)
+        if state is None:
+            state = {"id": unit_id, "ruta": None, "destino_pedido": None}
+            self.units[unit_id] = state
+        state.update(lat=float(lat), lng=float(lng), t=t if t is not None else time.time(), recibido=time.monotonic())
+        if destination is not None and destination != state["destino_pedido"]:
+            state["destino_pedido"] = destination
+            state["ruta"] = None
+            self._request_route(state, destination)
+        self._dirty.add(unit_id)
+
+    def finish(self, unit_id):
+        # La unidad llegó o canceló: sigue en el mapa, sin ruta
+        state = self.units.get(unit_id)
+        if state is not None:
+            state["ruta"] = None
+            state["destino_pedido"] = None
+            self._dirty.add(unit_id)
+
+    def _request_route(self, state, destination):
+        # Una búsqueda en curso por unidad; al terminar, la unidad se vuelve a enviar
+        unit_id = state["id"]
+        if unit_id in self._routing:
+            return
+        self._routing.add(unit_id)
+
+        async def refresh():
+            try:
+                route = await asyncio.to_thread(self.route_provider, unit_id, {"lat": state["lat"], "lng": state["lng"]}, destination)
+                if state["destino_pedido"] == destination:
+                    state["ruta"] = ActiveRoute(route) if route is not None else None
+                    state["sin_ruta"] = route is None
+                    self._locate([state])
+                    # Sin camino (p. ej. por un cierre) también se reintenta cuando cambien los cierres
+                    state["version_ruta"] = route["version"] if route is not None else self._current_version()
+            except Exception as e:
+                print(f"Live route for {unit_id} failed: {e}")
+                if state["destino_pedido"] == destination:
+                    # Igual que sin camino: se reintenta cuando cambien los cierres
+                    state["sin_ruta"] = state["ruta"] is None
+                    state["version_ruta"] = self._current_version()
+            finally:
+                self._routing.discard(unit_id)
+                self._dirty.add(unit_id)
+            # Llegó otro destino mientras se buscaba este
+            if state["destino_pedido"] is not None and state["destino_pedido"] != destination:
+                self._request_route(state, state["destino_pedido"])
+
+        asyncio.create_task(refresh())
+
+    def _current_version(self):
+        return self.version_provider() if self.version_provider is not None else None
+
+    def subscribe(self, units=None, area=None):
+        subscriber = Subscriber(units, area)
+        self.subscribers.add(subscriber)
+        self.send_snapshot(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def send_snapshot(self, subscriber):
+        # Estado actual completo al suscribirse o cambiar el filtro
+        states = [self._public(state) for state in self.units.values() if "lat" in state and subscriber.wants(state)]
+        subscriber.queue.put(self._message("estado", json.dumps(states, ensure_ascii=False), subscriber))
+
+    def tick(self):
+        self.ticks += 1
+        now = time.monotonic()
+        routed = [state for state in self.units.values() if state["destino_pedido"] is not None]
+        version = self._current_version() if routed else None
+
+        expired = [unit_id for unit_id, state in self.units.items() if now - state["recibido"] > LIVE_UNIT_TTL_S]
+        for unit_id in expired:
+            del self.units[unit_id]
+            self._dirty.discard(unit_id)
+
+        for state in routed:
+            # Cambiaron los cierres: la ruta se repara (árbol incremental) aunque la unidad no se haya movido
+            if version is not None and "version_ruta" in state and state["version_ruta"] != version:
+                self._request_route(state, state["destino_pedido"])
+
+        updates = [self.units[unit_id] for unit_id in self._dirty if unit_id in self.units]
+        self._dirty = set()
+        self._locate(updates)
+
+        removed = [{"id": unit_id, "activa": False} for unit_id in expired]
+        if not updates and not removed:
+            return
+        public = [self._public(state) for state in updates]
+        encoded = {}
+        for subscriber in self.subscribers:
+            text = encoded.get(subscriber.key)
+            if text is None:
+                selected = [item for state, item in zip(updates, public) if subscriber.wants(state)]
+                selected += [item for item in removed if subscriber.units is None or item["id"] in subscriber.units]
+                text = json.dumps(selected, ensure_ascii=False) if selected else ""
+                encoded[subscriber.key] = text
+            if text:
+                subscriber.queue.put(self._message("tick", text, subscriber))
+
+    def _locate(self, states):
+        # ETA restante desde la última posición; las que se salieron de la ruta piden otra
+        routed = [state for state in states if state["ruta"] is not None]
+        if not routed:
+            return
+        off_route, seconds, meters = locate_routes(
+            [state["ruta"] for state in routed],
+            [state["lat"] for state in routed],
+            [state["lng"] for state in routed]
+        )
+        for state, off, remaining_s, remaining_m in zip(routed, off_route.tolist(), seconds.tolist(), meters.tolist()):
+            state["fuera_de_ruta"] = off > LIVE_OFF_ROUTE_M
+            state["eta_restante_s"] = remaining_s
+            state["distancia_restante_m"] = remaining_m
+            if state["fuera_de_ruta"]:
+                self._request_route(state, state["destino_pedido"])
+
+    def _message(self, kind, units_json, subscriber):
+        # El arreglo de unidades se serializa una vez por filtro; cada visor solo agrega su contador
+        return f'{{"tipo": "{kind}", "tick": {self.ticks}, "descartados": {subscriber.queue.dropped}, "unidades": {units_json}}}'
+
+    @staticmethod
+    def _public(state):
+        route = state["ruta"]
+        item = {"id": state["id"], "lat": state["lat"], "lng": state["lng"], "t": state["t"]}
+        if route is not None:
+            item.update({
+                "destino": route.destination,
+                "eta_restante": format_seconds(state["eta_restante_s"]),
+                "eta_restante_s": round(state["eta_restante_s"], 1),
+                "distancia_restante_m": round(state["distancia_restante_m"], 1),
+                "fuera_de_ruta": state["fuera_de_ruta"],
+                "version_pesos": route.version
+            })
+        elif state.get("destino_pedido") is not None:
+            item["ruta"] = "sin ruta" if state.get("sin_ruta") else "calculando"
+        return item
+
+    def stats(self):
+        return {
+            "unidades": len(self.units),
+            "en_ruta": sum(1 for state in self.units.values() if state["ruta"] is not None),
+            "visores": len(self.subscribers),
+            "ticks": self.ticks,
+            "mensajes_descartados": sum(subscriber.queue.dropped for subscriber in self.subscribers)
+        }
@@ -0,0 +1,153 @@
+import os
+import math
+import numpy as np
+from .road_graph import EARTH_RADIUS_M
+
+MAP_MATCH_RADIUS_M = float(os.getenv("MAP_MATCH_RADIUS_M", "50"))
+MAP_MATCH_CANDIDATES = int(os.getenv("MAP_MATCH_CANDIDATES", "8"))
+# Desvío típico del GPS (emisión) y tolerancia entre distancia por calle y en línea recta (transición)
+GPS_SIGMA_M = float(os.getenv("GPS_SIGMA_M", "8"))
+TRANSITION_BETA_M = float(os.getenv("TRANSITION_BETA_M", "20"))
+# Entre pings más separados que esto la traza se corta y se empareja por tramos
+MAX_GAP_S = float(os.getenv("MAP_MATCH_MAX_GAP_S", "60"))
+# Pings por bloque de transiciones: acota la memoria de (pings x k x k) en trazas largas
+MAP_MATCH_WINDOW = int(os.getenv("MAP_MATCH_WINDOW", "2000"))
+# Saltos entre aristas no contiguas: distancia en línea recta por este factor
+DETOUR_FACTOR = 1.3
+U_TURN_PENALTY_M = 50.0
+METERS_PER_DEGREE = EARTH_RADIUS_M * math.pi / 180.0
+
+
+def transition_distances(graph, edges_a, t_a, edges_b, t_b):
+    """Distancia por calle entre candidatos consecutivos, vectorizada sobre (pasos x k x k).
+
+    Misma arista hacia adelante: el tramo entre ambas fracciones; aristas
+    contiguas: el resto de una más el comienzo de la otra; cualquier otro par,
+    una aproximación por línea recta entre los extremos (sin buscar rutas).
+    """
+    length = graph.length.astype(np.float64)
+    la, lb = length[edges_a], length[edges_b]
+    same = edges_a == edges_b
+    adjacent = graph.edge_target[edges_a] == graph.edge_source[edges_b]
+    u_turn = adjacent & (graph.edge_source[edges_a] == graph.edge_target[edges_b])
+
+    ax, ay = graph.lng[graph.edge_target[edges_a]], graph.lat[graph.edge_target[edges_a]]
+    bx, by = graph.lng[graph.edge_source[edges_b]], graph.lat[graph.edge_source[edges_b]]
+    # Equirectangular: a esta escala basta
+    gap = np.hypot((bx - ax) * np.cos(np.radians(ay)), by - ay) * METERS_PER_DEGREE
+
+    distance = (1.0 - t_a) * la + gap * DETOUR_FACTOR + t_b * lb
+    distance = np.where(adjacent, (1.0 - t_a) * la + t_b * lb + np.where(u_turn, U_TURN_PENALTY_M, 0.0), distance)
+    # Hacia atrás en la misma arista (ruido estando detenido) cuesta el doble
+    forward = (t_b - t_a) * la
+    distance = np.where(same, np.where(forward >= 0, forward, -2.0 * forward), distance)
+    return distance
+
+
+def viterbi(emission, transitions):
+    """Mejor secuencia de candidatos: emission (n x k) y transiciones en log.
+
+    `transitions` es un iterable de bloques (m x k x k) que juntos cubren los
+    n-1 pasos en orden; el puntaje se arrastra de un bloque al siguiente, así
+    que basta tener uno en memoria a la vez.
+    """
+    n, k = emission.shape
+    score = emission[0].copy()
+    back = np.zeros((n, k), dtype=np.int64)
+    i = 1
+    for block in transitions:
+        for transition in block:
+            total = score[:, None] + transition
+            back[i] = np.argmax(total, axis=0)
+            score = total[back[i], np.arange(k)] + emission[i]
+            i += 1
+    path = np.empty(n, dtype=np.int64)
+    path[-1] = int(np.argmax(score))
+    for i in range(n - 1, 0, -1):
+        path[i - 1] = back[i, path[i]]
+    return path, float(score[path[-1]])
+
+
+def match_segments(graph, lats, lngs, times):
+    """Empareja una traza (ordenada por tiempo) con aristas del grafo con un HMM.
+
+    Emisión gaussiana por distancia al candidato y transición exponencial
+    por la diferencia entre distancia por calle y en línea recta (Newson y
+    Krumm), calculadas en bloques de MAP_MATCH_WINDOW pings. Devuelve una lista de
+    tramos (índices de los pings, arista y fracción elegidas por ping); los
+    pings sin candidatos y los cortes de tiempo separan tramos.
+    """
+    index = graph.spatial_index
+    lats, lngs, times = np.asarray(lats, dtype=np.float64), np.asarray(lngs, dtype=np.float64), np.asarray(times, dtype=np.float64)
+    edges, fractions, distances = index.candidate_edges(lats, lngs, MAP_MATCH_RADIUS_M, MAP_MATCH_CANDIDATES)
+
+    usable = np.nonzero(edges[:, 0] >= 0)[0]
+    breaks = np.nonzero(np.diff(times[usable]) > MAX_GAP_S)[0] + 1
+    segments = []
+    for points in np.split(usable, breaks):
+        if len(points) == 0:
+            continue
+        seg_edges, seg_t = edges[points], fractions[points]
+        valid = seg_edges >= 0
+        emission = np.where(valid, -0.5 * (distances[points] / GPS_SIGMA_M) ** 2, -np.inf)
+
+        choice, _ = viterbi(emission, _transition_blocks(graph, lats, lngs, points, seg_edges, seg_t, valid))
+        rows = np.arange(len(points))
+        segments.append((points, seg_edges[rows, choice], seg_t[rows, choice]))
+    return segments
+
+
+def _transition_blocks(graph, lats, lngs, points, edges, fractions, valid):
+    # Log-probabilidad de transición entre pings consecutivos, MAP_MATCH_WINDOW pasos por bloque
+    safe_edges = np.maximum(edges, 0)
+    for lo in range(0, len(points) - 1, MAP_MATCH_WINDOW):
+        hi = min(lo + MAP_MATCH_WINDOW, len(points) - 1)
+        a, b = slice(lo, hi), slice(lo + 1, hi + 1)
+        straight = np.hypot(
+            (lngs[points[b]] - lngs[points[a]]) * np.cos(np.radians(lats[points[a]])),
+            lats[points[b]] - lats[points[a]]
+        ) * METERS_PER_DEGREE
+        route = transition_distances(
+            graph,
+            safe_edges[a, :, None], fractions[a, :, None],
+            safe_edges[b, None, :], fractions[b, None, :]
+        )
+        transition = -np.abs(route - straight[:, None, None]) / TRANSITION_BETA_M
+        yield np.where(valid[a, :, None] & valid[b, None, :], transition, -np.inf)
+
+
+def traversals(graph, points, edges, fractions, times, fill_gap=None):
+    """Aristas recorridas en orden y el tiempo de entrada y salida observado en cada una.
+
+    Entre aristas no contiguas se intercala `fill_gap(desde_nodo, hasta_nodo)`
+    (la ruta más corta) si se pasa. Las entradas y salidas se interpolan en
+    el tiempo según la distancia recorrida; `completa` es False en la primera
+    y la última, que se recorren solo en parte.
+    """
+    length = graph.length.astype(np.float64)
+    path = [int(edges[0])]
+    # Posición de cada ping en la ruta: inicio de su arista en `path` + fracción
+    starts = [0.0]
+    positions = [fractions[0] * length[edges[0]]]
+    for edge, t in zip(edges[1:].tolist(), fractions[1:].tolist()):
+        if edge != path[-1]:
+            if graph.edge_target[path[-1]] != graph.edge_source[edge] and fill_gap is not None:
+                for middle in fill_gap(int(graph.edge_target[path[-1]]), int(graph.edge_source[edge])) or []:
+                    starts.append(starts[-1] + length[path[-1]])
+                    path.append(middle)
+            starts.append(starts[-1] + length[path[-1]])
+            path.append(edge)
+        positions.append(starts[-1] + t * length[edge])
+
+    positions = np.maximum.accumulate(np.asarray(positions))
+    starts = np.asarray(starts)
+    path = np.asarray(path, dtype=np.int64)
+    ends = starts + length[path]
+
+    entry_m = np.clip(starts, positions[0], positions[-1])
+    exit_m = np.clip(ends, positions[0], positions[-1])
+    times = np.asarray(times, dtype=np.float64)[points]
+    entries = np.interp(entry_m, positions, times)
+    exits = np.interp(exit_m, positions, times)
+    complete = (starts >= positions[0]) & (ends <= positions[-1])
+    return path, entries, exits, exit_m - entry_m, complete
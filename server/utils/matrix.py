@@ -0,0 +1,102 @@
+import os
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+MATRIX_WORKERS = int(os.getenv("MATRIX_WORKERS", str(os.cpu_count() or 1)))
+# Con pocos árboles no conviene pagar el envío a otros procesos
+MIN_TREES_FOR_POOL = 4
+
+# Estado de cada proceso del pool: se copia una sola vez al crearlo
+_worker_graph = None
+_worker_weights = None
+_worker_metrics = None
+
+
+def tree_totals(graph, tree_edge, metrics, reverse=False):
+    """Suma de `metrics` (k x aristas) a lo largo del árbol, para todos los nodos a la vez.
+
+    Salto de punteros: en cada ronda cada nodo suma el acumulado de su
+    ancestro y pasa a apuntar al ancestro de este, así que bastan
+    log2(profundidad) operaciones vectorizadas en lugar de recorrer caminos.
+    """
+    n = graph.node_count
+    in_tree = tree_edge >= 0
+    edges = tree_edge[in_tree]
+
+    parent = np.arange(n)
+    # En el árbol hacia adelante el padre es el origen de la arista; en el inverso, su destino
+    parent[in_tree] = graph.edge_target[edges] if reverse else graph.edge_source[edges]
+
+    totals = np.zeros((metrics.shape[0], n), dtype=np.float64)
+    totals[:, in_tree] = metrics[:, edges]
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            break
+        moving = grandparent != parent
+        totals[:, moving] += totals[:, parent[moving]]
+        parent = grandparent
+    return totals
+
+
+def matrix_rows(graph, weights, metrics, roots, others, reverse=False):
+    # Un árbol por raíz; de cada árbol se leen todos los `others` de una vez
+    costs = np.empty((len(roots), len(others)), dtype=np.float64)
+    sums = np.empty((metrics.shape[0], len(roots), len(others)), dtype=np.float64)
+    others = np.asarray(others, dtype=np.int64)
+    for i, root in enumerate(roots):
+        dist, tree_edge = graph.shortest_path_tree(int(root), weights, reverse)
+        costs[i] = dist[others]
+        sums[:, i] = tree_totals(graph, tree_edge, metrics, reverse)[:, others]
+    return costs, sums
+
+
+def _init_worker(graph, weights_by_profile, metrics):
+    global _worker_graph, _worker_weights, _worker_metrics
+    _worker_graph = graph
+    _worker_weights = weights_by_profile
+    _worker_metrics = metrics
+
+
+def _worker_rows(profile_key, roots, others, reverse):
+    return matrix_rows(_worker_graph, _worker_weights[profile_key], _worker_metrics, roots, others, reverse)
+
+
+def create_pool(graph, weights_by_profile, metrics, workers=MATRIX_WORKERS):
+    # forkserver: el pool se crea con hilos de fondo corriendo, y un fork podría copiar locks tomados
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("forkserver"),
+        initializer=_init_worker,
+        initargs=(graph, weights_by_profile, metrics)
+    )
+
+
+def travel_matrix(graph, weights, metrics, sources, targets, profile_key=None, pool=None, workers=MATRIX_WORKERS):
+    """Costos y sumas de `metrics` por par (origen, destino) con búsquedas uno-a-muchos.
+
+    Se arma un árbol por cada nodo del lado más chico: árboles hacia adelante
+    desde los orígenes o árboles inversos hacia los destinos. Con `pool`, los
+    árboles se reparten entre procesos.
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    reverse = len(np.unique(targets)) < len(np.unique(sources))
+    roots, others = (targets, sources) if reverse else (sources, targets)
+
+    # Cada nodo raíz repetido se busca una sola vez
+    unique_roots, root_index = np.unique(roots, return_inverse=True)
+    if pool is None or len(unique_roots) < MIN_TREES_FOR_POOL:
+        costs, sums = matrix_rows(graph, weights, metrics, unique_roots, others, reverse)
+    else:
+        chunks = [chunk for chunk in np.array_split(unique_roots, workers) if len(chunk)]
+        futures = [pool.submit(_worker_rows, profile_key, chunk, others, reverse) for chunk in chunks]
+        results = [future.result() for future in futures]
+        costs = np.concatenate([cost for cost, _ in results], axis=0)
+        sums = np.concatenate([total for _, total in results], axis=1)
+
+    costs, sums = costs[root_index], sums[:, root_index]
+    if reverse:
+        costs, sums = costs.T, sums.transpose(0, 2, 1)
+    return costs, sums
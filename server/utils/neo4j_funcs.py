@@ -3,20 +3,72 @@ import re
 import math
 import neo4j
 import json
+import time
+import asyncio
+import threading
+from datetime import datetime, timezone
+import numpy as np
 from pathlib import Path
-from rapidfuzz import fuzz
-from unidecode import unidecode
+from rapidfuzz import fuzz, process
 from dotenv import load_dotenv
-from .trafficDetails import calculate_approx_time
-from concurrent.futures import ThreadPoolExecutor
+from .road_graph import RoadGraph, haversine_to_many_m
+from .address_index import AddressIndex, normalize_text
+from .autocomplete import AutocompleteIndex
+from .geocode_cache import GeocodeCache
+from .ttl_cache import TTLCache
+from .route_cache import RouteCache
+from .landmarks import LandmarkIndex
+from .hospital_trees import HospitalTreeService
+from .contraction import load_hierarchy
+from .traffic_profiles import TrafficWeightProfiles, PERIOD_LABELS, LENGTH_PROFILE, PROFILE_KEYS, profile_key_for, to_local_datetime
+from .traffic_factors import TrafficFactorService
+from . import trafficDetails
+from .trafficDetails import (
+    get_realtime_multiplier,
+    get_realtime_multiplier_async,
+    get_traffic_factor,
+    is_realtime_departure
+)
+from .eta import EtaEngine, format_seconds
+from .matrix import travel_matrix, create_pool
+from .alternatives import alternative_routes
+from .dispatch import assign_units, DISPATCH_TIME_BUDGET_MS
+from .road_overlay import RoadOverlay, OverlayProfiles
+from .reroute import IncrementalTree
+from .map_matching import match_segments, traversals
+from .telemetry_store import TelemetryStore
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '..', '.env'))
 
 NEO4J_URI = os.getenv("NEO4J_URI")
 NEO4J_USER = os.getenv("NEO4J_USER")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
+NEO4J_MAX_POOL_SIZE = int(os.getenv("NEO4J_MAX_POOL_SIZE", "50"))
+NEO4J_ACQUISITION_TIMEOUT_S = float(os.getenv("NEO4J_ACQUISITION_TIMEOUT_S", "10"))
 
 HOPSITALS_JSON_PATHS = Path(__file__).parent.parent.parent / "data" / "clinicas.json"
+HOSPITAL_TREES_REFRESH_S = float(os.getenv("HOSPITAL_TREES_REFRESH_S", "60"))
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "2048"))
+GEOCODE_CACHE_TTL_S = float(os.getenv("GEOCODE_CACHE_TTL_S", "3600"))
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "512"))
+ROUTE_CACHE_TTL_S = float(os.getenv("ROUTE_CACHE_TTL_S", "120"))
+# Coordenadas más lejos que esto de cualquier calle no se usan para rutear
+SNAP_MAX_DISTANCE_M = float(os.getenv("SNAP_MAX_DISTANCE_M", "500"))
+REROUTE_MAX_SESSIONS = int(os.getenv("REROUTE_MAX_SESSIONS", "256"))
+REROUTE_SESSION_TTL_S = float(os.getenv("REROUTE_SESSION_TTL_S", "3600"))
+# Sin ruta, los recorridos emparejados de /map-match quedan solo en memoria
+TELEMETRY_STORE_PATH = os.getenv("TELEMETRY_STORE_PATH")
+
+# Puntuación de candidatos de find_similar_address, indexada por partición
+PARTITION_ORDER = ['exact_match', 'exact_number', 'number_range', 'text_match', 'fallback']
+PARTITION_ADJUSTMENTS = np.array([0, -5, -5, 0, +5])
+PARTITION_PRIORITIES = np.array([5, 4, 3, 2, 1])
+PARTITION_BOOSTS = np.array([0, 15, 8, 3, 0])
+NUMERIC_PARTITIONS = [PARTITION_ORDER.index('exact_number'), PARTITION_ORDER.index('number_range')]
+# Entradas puntuadas juntas en una misma matriz de similitud
+SCORING_BATCH_SIZE = 32
+# Campos de cada paso que solo se conocen con el factor de tráfico: no van en los pasos de stream_shortest_path
+STREAM_STEP_TIMING_FIELDS = ("tiempo_paso_segundos", "tiempo_acumulado_segundos")
 
 
 BELLMAN_FORD_STEP_BY_STEP_CYPHER_QUERY = """
@@ -198,11 +250,169 @@ ORDER BY paso;
 
 class Neo4jController:
     def __init__(self):
-        self.driver = neo4j.GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+        pool_config = {
+            "max_connection_pool_size": NEO4J_MAX_POOL_SIZE,
+            "connection_acquisition_timeout": NEO4J_ACQUISITION_TIMEOUT_S
+        }
+        self.driver = neo4j.GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), **pool_config)
+        # Driver asíncrono para los endpoints async del servidor
+        self.async_driver = neo4j.AsyncGraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), **pool_config)
+        self._road_graph_async_lock = asyncio.Lock()
         self.hospitals = json.loads(HOPSITALS_JSON_PATHS.read_text())
+        self._road_graph = None
+        self._traffic_profiles = None
+        self._road_overlay = None
+        self._route_weights = None
+        self._hierarchies = {}
+        self._landmarks = {}
+        self._address_index = None
+        self._eta_engine = None
+        self._autocomplete_index = None
+        self._hospital_trees = None
+        self._traffic_factors = None
+        self._matrix_pool = None
+        self._telemetry_store = None
+        self._road_graph_lock = threading.Lock()
+        self._landmarks_lock = threading.Lock()
+        self._hospital_trees_lock = threading.Lock()
+        self._autocomplete_lock = threading.Lock()
+        self._traffic_factors_lock = threading.Lock()
+        self._matrix_pool_lock = threading.Lock()
+        self._telemetry_store_lock = threading.Lock()
+        # Textos de entrada ya resueltos: dirección + nodo, y listas de find_similar_address
+        self.geocode_cache = GeocodeCache(GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL_S)
+        # Rutas por (nodo origen, nodo destino, algoritmo, hora, tipo de día)
+        self.route_cache = RouteCache(ROUTE_CACHE_SIZE, ROUTE_CACHE_TTL_S)
+        # Árbol hacia el destino de cada ambulancia en ruta, para /reroute
+        self.reroute_sessions = TTLCache(REROUTE_MAX_SESSIONS, REROUTE_SESSION_TTL_S)
+
+    def _load_road_graph(self):
+        # Se carga una sola vez desde Neo4j, en la primera consulta que lo necesite
+        if self._road_graph is None:
+            with self._road_graph_lock:
+                if self._road_graph is None:
+                    self._install_road_graph(RoadGraph.from_neo4j(self.driver))
+
+    async def load_road_graph_async(self):
+        # Igual que _load_road_graph, pero sin bloquear el event loop mientras responde Neo4j
+        if self._road_graph is None:
+            async with self._road_graph_async_lock:
+                if self._road_graph is None:
+                    nodes, edges = await RoadGraph.fetch_records_async(self.async_driver)
+                    await asyncio.to_thread(self._install_loaded_records, nodes, edges)
+
+    def _install_loaded_records(self, nodes, edges):
+        with self._road_graph_lock:
+            if self._road_graph is None:
+                self._install_road_graph(RoadGraph.from_records(nodes, edges))
+
+    def _install_road_graph(self, graph):
+        # Se llama con _road_graph_lock tomado
+        profiles = TrafficWeightProfiles(graph)
+
+        # Jerarquías de contracción generadas fuera de línea con preprocess_ch.py
+        hierarchies = {}
+        for profile_key, weights in profiles.weights.items():
+            hierarchy = load_hierarchy(graph, weights, profile_key)
+            if hierarchy is not None:
+                hierarchies[profile_key] = hierarchy
+
+        overlay = RoadOverlay(graph)
+        self._traffic_profiles = profiles
+        self._road_overlay = overlay
+        self._route_weights = OverlayProfiles(profiles, overlay)
+        self._hierarchies = hierarchies
+        self._address_index = AddressIndex(graph.addresses)
+        self._eta_engine = EtaEngine(graph, overlay)
+        self._landmarks = {}
+        self._road_graph = graph
+        print(f"Road graph loaded: {graph.node_count} nodes, {graph.edge_count} edges, {len(hierarchies)} contraction hierarchies")
+
+    def reload_road_graph(self):
+        # Para cuando se vuelve a importar el grafo en Neo4j: lo derivado del grafo se descarta
+        # y se vuelve a cargar en la siguiente consulta
+        with self._road_graph_lock:
+            if self._hospital_trees is not None:
+                self._hospital_trees.stop()
+            if self._traffic_factors is not None:
+                self._traffic_factors.stop()
+            self._shutdown_matrix_pool()
+            self._road_graph = None
+            self._traffic_profiles = None
+            self._road_overlay = None
+            self._route_weights = None
+            self._hierarchies = {}
+            self._landmarks = {}
+            self._address_index = None
+            self._eta_engine = None
+            self._autocomplete_index = None
+            self._hospital_trees = None
+            self._traffic_factors = None
+            self.invalidate_geocode_cache()
+            self.route_cache.invalidate()
+            self.reroute_sessions.invalidate()
+
+    async def close_async(self):
+        if self._hospital_trees is not None:
+            self._hospital_trees.stop()
+        if self._traffic_factors is not None:
+            self._traffic_factors.stop()
+        self._shutdown_matrix_pool()
+        await self.async_driver.close()
+        self.driver.close()
+
+    def invalidate_geocode_cache(self):
+        self.geocode_cache.invalidate()
+
+    @property
+    def road_graph(self):
+        self._load_road_graph()
+        return self._road_graph
+
+    @property
+    def address_index(self):
+        self._load_road_graph()
+        return self._address_index
+
+    @property
+    def eta_engine(self):
+        self._load_road_graph()
+        return self._eta_engine
+
+    @property
+    def autocomplete_index(self):
+        if self._autocomplete_index is None:
+            with self._autocomplete_lock:
+                if self._autocomplete_index is None:
+                    self._autocomplete_index = AutocompleteIndex.from_graph(self.road_graph, self.hospitals)
+        return self._autocomplete_index
+
+    def autocomplete(self, prefix, limit=8):
+        return self.autocomplete_index.suggest(prefix, limit)
+
+    @property
+    def traffic_profiles(self):
+        self._load_road_graph()
+        return self._traffic_profiles
+
+    @property
+    def road_overlay(self):
+        self._load_road_graph()
+        return self._road_overlay
+
+    def overlay_version(self):
+        # Versión de los cierres sin cargar el grafo (None si todavía no está cargado)
+        overlay = self._road_overlay
+        return overlay.current_version() if overlay is not None else None
+
+    @property
+    def route_weights(self):
+        # Pesos de ruteo con los cierres vigentes aplicados; los pesos base siguen en traffic_profiles
+        self._load_road_graph()
+        return self._route_weights
     
     def normalize_text(self, text):
-        return unidecode(text.lower().strip())
+        return normalize_text(text)
         
     def clean_nan(self, value):
         if value is None:
@@ -212,35 +422,40 @@ class Neo4jController:
         return value
 
     def find_similar_address(self, address, limit=5, min_similarity=90):
-        normalized_input = self.normalize_text(address)
+        return self.find_similar_addresses([address], limit, min_similarity)[0]
 
-        number_match = re.search(r'\d+', normalized_input)
-        has_number = bool(number_match)
-        input_number = number_match.group() if has_number else None
+    def find_similar_addresses(self, addresses, limit=5, min_similarity=90):
+        generation = self.geocode_cache.generation
+        results = [None] * len(addresses)
+        cache_keys = [None] * len(addresses)
+        pending = []
+        queries = []
+        for i, address in enumerate(addresses):
+            normalized_input = self.normalize_text(address)
+            cache_keys[i] = ("similares", normalized_input, limit, min_similarity)
+            cached = self.geocode_cache.get(cache_keys[i])
+            if cached is not None:
+                results[i] = list(cached)
+                continue
 
-        # Obtener candidatos particionados en lugar de todas las direcciones
-        candidate_partitions = self._get_partitioned_candidates(normalized_input, input_number)
-        
-        # Procesar particiones en paralelo si hay suficientes candidatos
-        total_candidates = sum(len(addresses) for addresses in candidate_partitions.values())
-        
-        if total_candidates > 500:
-            matches = self._process_partitions_parallel(
-                candidate_partitions, normalized_input, has_number, input_number, min_similarity
-            )
-        else:
-            matches = self._process_partitions_sequential(
-                candidate_partitions, normalized_input, has_number, input_number, min_similarity
-            )
-        
-        # Sort by score (highest first) and take top matches
-        matches.sort(key=lambda x: (
-            -x["is_exact_match"],           # Exact matches first (negative for desc order)
-            -x["similarity_score"],         # Then by similarity score
-            -x["partition_priority"],       # Then by partition priority
-            x["address"]                    # Finally alphabetical for consistency
-        ))
-        return matches[:limit]
+            number_match = re.search(r'\d+', normalized_input)
+            input_number = number_match.group() if number_match else None
+
+            # Obtener candidatos particionados en lugar de todas las direcciones
+            candidate_partitions = self._get_partitioned_candidates(normalized_input, input_number)
+            queries.append((normalized_input, input_number, candidate_partitions))
+            pending.append(i)
+
+        # Las entradas se puntúan por bloques: una matriz de similitud por bloque
+        scored = []
+        for start in range(0, len(queries), SCORING_BATCH_SIZE):
+            scored.extend(self._score_batch(queries[start:start + SCORING_BATCH_SIZE], limit, min_similarity))
+
+        for i, matches in zip(pending, scored):
+            results[i] = matches
+            if matches:
+                self.geocode_cache.put(cache_keys[i], list(matches), generation)
+        return results
 
     def _get_partitioned_candidates(self, normalized_input, input_number):
         partitions = {
@@ -251,63 +466,29 @@ class Neo4jController:
             'fallback': []
         }
 
-        with self.driver.session() as session:
-            # Partición 0: Búsqueda exacta primero
-            result = session.run("""
-                MATCH (i:Intersection)
-                WHERE toLower(i.address) = $normalized_input
-                RETURN i.address as address
-                LIMIT 10
-            """, normalized_input=normalized_input)
-            partitions['exact_match'] = [record["address"] for record in result if record["address"]]
-            
-            if not partitions['exact_match']: # -> Solo buscar otras particiones si no hay coincidencia exacta
-                # Partición 1: Coincidencia exacta de número
-                if input_number:
-                    result = session.run("""
-                        MATCH (i:Intersection)
-                        WHERE i.address CONTAINS $number_str
-                        RETURN i.address as address
-                        LIMIT 300
-                    """, number_str=str(input_number))
-                    partitions['exact_number'] = [record["address"] for record in result if record["address"]]
-
-                # Partición 2: Rango de números cercanos
-                if input_number:
-                    target_num = int(input_number)
-                    result = session.run("""
-                        MATCH (i:Intersection)
-                        WHERE i.address =~ '.*\\\\d+.*'
-                        WITH i, [x IN split(i.address, ' ') WHERE x =~ '\\\\d+' | toInteger(x)][0] as addr_num
-                        WHERE addr_num IS NOT NULL 
-                            AND abs(addr_num - $target_num) <= 100
-                            AND abs(addr_num - $target_num) > 0
-                        RETURN i.address as address
-                        LIMIT 800
-                    """, target_num=target_num)
-                    partitions['number_range'] = [record["address"] for record in result if record["address"]]
-
-                # Partición 3: Coincidencias de texto (primeras palabras)
-                first_words = normalized_input.split()[:2]
-                if len(first_words) >= 1:
-                    result = session.run("""
-                        MATCH (i:Intersection)
-                        WHERE toLower(i.address) CONTAINS $first_word
-                        RETURN i.address as address
-                        LIMIT 1000
-                    """, first_word=first_words[0])
-                    partitions['text_match'] = [record["address"] for record in result if record["address"]]
-
-                # Partición 4: Fallback - muestra más grande si no hay suficientes candidatos
-                total_so_far = sum(len(addrs) for addrs in partitions.values())
-                if total_so_far < 200:
-                    result = session.run("""
-                        MATCH (i:Intersection)
-                        RETURN i.address as address
-                        ORDER BY rand()
-                        LIMIT 2000
-                    """)
-                    partitions['fallback'] = [record["address"] for record in result if record["address"]]
+        index = self.address_index
+
+        # Partición 0: Búsqueda exacta primero
+        partitions['exact_match'] = index.exact_matches(normalized_input, limit=10)
+
+        if not partitions['exact_match']: # -> Solo buscar otras particiones si no hay coincidencia exacta
+            # Partición 1: Coincidencia exacta de número
+            if input_number:
+                partitions['exact_number'] = index.containing_number(str(input_number), limit=300)
+
+            # Partición 2: Rango de números cercanos
+            if input_number:
+                partitions['number_range'] = index.number_range(int(input_number), normalized_input, limit=800)
+
+            # Partición 3: Coincidencias de texto (primeras palabras)
+            first_words = normalized_input.split()[:2]
+            if len(first_words) >= 1:
+                partitions['text_match'] = index.containing_text(first_words[0], limit=1000)
+
+            # Partición 4: Fallback - muestra más grande si no hay suficientes candidatos
+            total_so_far = sum(len(addrs) for addrs in partitions.values())
+            if total_so_far < 200:
+                partitions['fallback'] = index.sample(2000)
         
         return self._remove_duplicates_between_partitions(partitions)
 
@@ -315,9 +496,7 @@ class Neo4jController:
         seen = set()
         cleaned_partitions = {}
         
-        priority_order = ['exact_match', 'exact_number', 'number_range', 'text_match', 'fallback']
-        
-        for partition_name in priority_order:
+        for partition_name in PARTITION_ORDER:
             if partition_name in partitions:
                 unique_addresses = []
                 for addr in partitions[partition_name]:
@@ -328,117 +507,90 @@ class Neo4jController:
         
         return cleaned_partitions
 
-    def _process_partitions_parallel(self, partitions, normalized_input, has_number, input_number, min_similarity):
-        all_matches = []
-        
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = []
-            
-            for partition_name, addresses in partitions.items():
-                if addresses:  # Solo procesar particiones no vacías
-                    future = executor.submit(
-                        self._process_single_partition,
-                        addresses, normalized_input, has_number, input_number, 
-                        min_similarity, partition_name
-                    )
-                    futures.append(future)
-            
-            # Recolectar resultados
-            for future in futures:
-                partition_matches = future.result()
-                all_matches.extend(partition_matches)
-        
-        return all_matches
+    def _score_batch(self, queries, limit, min_similarity):
+        normalized_by_address = self.address_index.normalized_by_address
 
-    def _process_partitions_sequential(self, partitions, normalized_input, has_number, input_number, min_similarity):
-        all_matches = []
-        
-        for partition_name, addresses in partitions.items():
-            if addresses:
-                partition_matches = self._process_single_partition(
-                    addresses, normalized_input, has_number, input_number,
-                    min_similarity, partition_name
-                )
-                all_matches.extend(partition_matches)
-        
-        return all_matches
+        # Columnas: direcciones normalizadas distintas entre todas las entradas del bloque
+        columns = {}
+        for _, _, partitions in queries:
+            for addresses in partitions.values():
+                for db_address in addresses:
+                    columns.setdefault(normalized_by_address[db_address], len(columns))
 
-    def _process_single_partition(self, addresses, normalized_input, has_number, input_number, min_similarity, partition_name):
-        matches = []
-        
-        partition_adjustments = {
-            'exact_match': 0,
-            'exact_number': -5,
-            'number_range': -5,
-            'text_match': 0,
-            'fallback': +5
-        }
+        inputs = [normalized_input for normalized_input, _, _ in queries]
+        choices = list(columns)
+        if choices:
+            matrices = {
+                scorer: process.cdist(inputs, choices, scorer=scorer, dtype=np.float64, workers=-1)
+                for scorer in (fuzz.ratio, fuzz.partial_ratio, fuzz.token_sort_ratio)
+            }
 
-        partition_priorities = {
-            'exact_match': 5,
-            'exact_number': 4,
-            'number_range': 3,
-            'text_match': 2,
-            'fallback': 1
-        }
-        
-        adjusted_min_similarity = min_similarity + partition_adjustments.get(partition_name, 0)
-        
-        for db_address in addresses:
-            if not db_address:
+        results = []
+        for row, (normalized_input, input_number, partitions) in enumerate(queries):
+            addresses = [db_address for addresses in partitions.values() for db_address in addresses]
+            if not addresses:
+                results.append([])
                 continue
-            
-            normalized_db = self.normalize_text(db_address)
-
-            is_exact_match = normalized_input == normalized_db
-
-            number_matches = True
-            if has_number and input_number not in normalized_db:
-                number_matches = False
-
-
-            if partition_name in ['exact_number', 'number_range']:
-                score = fuzz.token_sort_ratio(normalized_input, normalized_db)
-
-                if score < adjusted_min_similarity:
-                    simple_ratio = fuzz.ratio(normalized_input, normalized_db)
-                    partial_ratio = fuzz.partial_ratio(normalized_input, normalized_db)
-                    score = max(score, simple_ratio, partial_ratio)
-            else:
-                simple_ratio = fuzz.ratio(normalized_input, normalized_db)
-                partial_ratio = fuzz.partial_ratio(normalized_input, normalized_db)
-                token_sort_ratio = fuzz.token_sort_ratio(normalized_input, normalized_db)
-                score = max(simple_ratio, partial_ratio, token_sort_ratio)
-            
-            score_boost = 30 if number_matches else 0
-            
-            partition_boost = {
-                'exact_number': 15,
-                'number_range': 8,
-                'text_match': 3,
-                'fallback': 0
-            }
+            partition_ids = np.concatenate([
+                np.full(len(addrs), PARTITION_ORDER.index(name), dtype=np.int64)
+                for name, addrs in partitions.items()
+            ])
+            normalized_db = np.array([normalized_by_address[db_address] for db_address in addresses])
+            cols = np.array([columns[value] for value in normalized_db], dtype=np.int64)
 
-            exact_match_boost = 50 if is_exact_match else 0
-            
-            final_score = score + score_boost + partition_boost.get(partition_name, 0) + exact_match_boost
-
-            if is_exact_match:
-                final_score = max(final_score, 150)
-            else:
-                final_score = min(final_score, 100)
-            
-            if final_score >= adjusted_min_similarity:
-                matches.append({
-                    "address": db_address,
-                    "similarity_score": min(final_score, 100),
-                    "normalized_input": normalized_input,
-                    "normalized_db": normalized_db,
-                    "partition": partition_name,
-                    "is_exact_match": is_exact_match,
-                    "partition_priority": partition_priorities.get(partition_name, 0)
-                })
-        
+            results.append(self._score_candidates(
+                normalized_input, input_number, np.array(addresses), normalized_db, partition_ids,
+                matrices[fuzz.ratio][row, cols],
+                matrices[fuzz.partial_ratio][row, cols],
+                matrices[fuzz.token_sort_ratio][row, cols],
+                min_similarity, limit
+            ))
+        return results
+
+    def _score_candidates(self, normalized_input, input_number, addresses, normalized_db, partition_ids,
+                          simple_ratio, partial_ratio, token_sort_ratio, min_similarity, limit):
+        adjusted_min_similarity = min_similarity + PARTITION_ADJUSTMENTS[partition_ids]
+
+        is_exact_match = normalized_db == normalized_input
+
+        if input_number is not None:
+            number_matches = np.char.find(normalized_db, input_number) >= 0
+        else:
+            number_matches = np.ones(len(addresses), dtype=bool)
+
+        # Particiones numéricas: token_sort_ratio, y el máximo de los tres solo si no alcanza el umbral
+        best_of_three = np.maximum(np.maximum(simple_ratio, partial_ratio), token_sort_ratio)
+        numeric_partition = np.isin(partition_ids, NUMERIC_PARTITIONS)
+        score = np.where(
+            numeric_partition & (token_sort_ratio >= adjusted_min_similarity),
+            token_sort_ratio,
+            best_of_three
+        )
+
+        raw_score = score + np.where(number_matches, 30, 0) + PARTITION_BOOSTS[partition_ids] + np.where(is_exact_match, 50, 0)
+        final_score = np.where(is_exact_match, np.maximum(raw_score, 150), np.minimum(raw_score, 100))
+        # Los puntajes recortados se reportan como el entero 100, igual que min(score, 100)
+        capped = is_exact_match | (raw_score > 100)
+
+        keep = np.nonzero(final_score >= adjusted_min_similarity)[0]
+        similarity_score = np.minimum(final_score[keep], 100)
+        priority = PARTITION_PRIORITIES[partition_ids[keep]]
+
+        # Exactas primero, luego por puntaje, prioridad de partición y orden alfabético
+        order = np.lexsort((addresses[keep], -priority, -similarity_score, ~is_exact_match[keep]))[:limit]
+
+        matches = []
+        for j in order:
+            i = keep[j]
+            matches.append({
+                "address": str(addresses[i]),
+                "similarity_score": 100 if capped[i] else float(final_score[i]),
+                "normalized_input": normalized_input,
+                "normalized_db": str(normalized_db[i]),
+                "partition": PARTITION_ORDER[partition_ids[i]],
+                "is_exact_match": bool(is_exact_match[i]),
+                "partition_priority": int(priority[j])
+            })
         return matches
         
     def __init_case_sensitive(self):
@@ -451,48 +603,887 @@ class Neo4jController:
             self.__init_case_sensitive()
         return self.case_insensitive_map.get(hospital.lower())
 
-    def find_shortest_path(self, start_location: str, end_location: str, bellman: bool=True):
-        start_address = self.get_address_from_hospital(start_location)
-        end_address = self.get_address_from_hospital(end_location)
+    def resolve_address(self, location):
+        resolved = self.resolve_location(location)
+        return resolved["address"] if resolved else None
+
+    def resolve_location(self, location, destination=False):
+        # Hospital o dirección más parecida, con su nodo en el grafo; se cachea por texto normalizado
+        if isinstance(location, dict):
+            return self.snap_location(location, destination)
+        cache_key = ("direccion", self.normalize_text(location))
+        resolved = self.geocode_cache.get(cache_key)
+        if resolved is not None:
+            return resolved
 
-        if start_address is None:
-            start_location_match = self.find_similar_address(start_location, limit=1)
-            start_address = start_location_match[0]["address"]
+        generation = self.geocode_cache.generation
+        address = self.get_address_from_hospital(location)
+        if address is None:
+            location_match = self.find_similar_address(location, limit=1)
+            address = location_match[0]["address"] if location_match else None
+        if address is None:
+            return None
 
-        if end_address is None:
-            end_location_match = self.find_similar_address(end_location, limit=1)
-            end_address = end_location_match[0]["address"]
+        resolved = {"address": address, "node": self.road_graph.node_for_address(address)}
+        self.geocode_cache.put(cache_key, resolved, generation)
+        return resolved
+
+    def snap_location(self, point, destination=False):
+        """{"lat", "lng"} ajustado a la calle más cercana, en el formato de resolve_location.
+
+        El nodo es el extremo de la arista más cercana desde el que se puede
+        salir (o al que se puede llegar si `destination`); `ajuste` dice dónde
+        cayó el punto y a cuántos metros.
+        """
+        graph = self.road_graph
+        nodes, edges, fractions, distances, lats, lngs = graph.spatial_index.snap_nodes([point["lat"]], [point["lng"]], destination)
+        if nodes[0] < 0 or distances[0] > SNAP_MAX_DISTANCE_M:
+            return None
+        node = int(nodes[0])
+        return {
+            "address": graph.addresses[node],
+            "node": node,
+            "ajuste": {
+                "lat": round(float(lats[0]), 7),
+                "lng": round(float(lngs[0]), 7),
+                "distancia_metros": round(float(distances[0]), 1),
+                "osmid": int(graph.osmids[node])
+            }
+        }
+
+    def snap_points(self, points, mode="arista", destination=False):
+        """Ajuste masivo de coordenadas al grafo, en columnas.
+
+        `mode` "nodo" devuelve la intersección con calles más cercana; "arista"
+        proyecta sobre la calle más cercana y elige el nodo como snap_location.
+        """
+        graph = self.road_graph
+        index = graph.spatial_index
+        lats = np.array([point["lat"] for point in points], dtype=np.float64)
+        lngs = np.array([point["lng"] for point in points], dtype=np.float64)
+        if mode == "nodo":
+            nodes, distances = index.nearest_nodes(lats, lngs)
+            snapped_lats, snapped_lngs = graph.lat[np.maximum(nodes, 0)], graph.lng[np.maximum(nodes, 0)]
+        else:
+            nodes, edges, fractions, distances, snapped_lats, snapped_lngs = index.snap_nodes(lats, lngs, destination)
+
+        found = nodes >= 0
+        result = {
+            "osmids": np.where(found, graph.osmids[np.maximum(nodes, 0)], -1).tolist(),
+            "direcciones": [graph.addresses[node] if node >= 0 else None for node in nodes.tolist()],
+            "lat": np.round(snapped_lats, 7).tolist(),
+            "lng": np.round(snapped_lngs, 7).tolist(),
+            "distancias_metros": np.round(distances, 1).tolist()
+        }
+        if mode != "nodo":
+            safe = np.maximum(edges, 0)
+            result["aristas"] = np.column_stack((
+                np.where(edges >= 0, graph.osmids[graph.edge_source[safe]], -1),
+                np.where(edges >= 0, graph.osmids[graph.edge_target[safe]], -1)
+            )).tolist()
+            result["fracciones"] = np.round(fractions, 3).tolist()
+        return result
+
+    def find_shortest_path(self, start_location: str, end_location: str, bellman: bool=True, departure_time=None, heuristic=None, bypass_cache=False):
+        start = self.resolve_location(start_location)
+        end = self.resolve_location(end_location, destination=True)
+        start_address = start["address"] if start else None
+        end_address = end["address"] if end else None
 
         print(f"Start location: {start_address}")
         print(f"End location: {end_address}")
-        
+
+        def compute():
+            return self._compute_route(start, end, bellman, departure_time, heuristic)
+
+        cache_key = self._route_cache_key(start, end, bellman, departure_time, heuristic)
+        if cache_key is None:
+            return compute()
+        return self.route_cache.get_or_compute(cache_key, compute, bypass=bypass_cache)
+
+    async def find_shortest_path_async(self, start_location: str, end_location: str, bellman: bool=True, departure_time=None, heuristic=None, bypass_cache=False):
+        await self.load_road_graph_async()
+        # Origen y destino se resuelven a la vez
+        start, end = await asyncio.gather(
+            asyncio.to_thread(self.resolve_location, start_location),
+            asyncio.to_thread(self.resolve_location, end_location, True)
+        )
+        start_address = start["address"] if start else None
+        end_address = end["address"] if end else None
+
+        print(f"Start location: {start_address}")
+        print(f"End location: {end_address}")
+
+        async def compute():
+            return await self._compute_route_async(start, end, bellman, departure_time, heuristic)
+
+        cache_key = self._route_cache_key(start, end, bellman, departure_time, heuristic)
+        if cache_key is None:
+            return await compute()
+        return await self.route_cache.get_or_compute_async(cache_key, compute, bypass=bypass_cache)
+
+    async def stream_shortest_path(self, start_location: str, end_location: str, bellman: bool=True, departure_time=None, heuristic=None):
+        """Igual que find_shortest_path_async, pero entrega un dict por paso apenas se arma.
+
+        Cada paso va como {"tipo": "paso", ...registro}, sin los segundos por
+        paso (dependen del factor de tráfico); al final, una línea
+        {"tipo": "resumen", ...} con los mismos campos que /shortest-path
+        salvo "ruta", más "pasos". Salga del caché o de una búsqueda nueva, el
+        formato es el mismo, y la ruta terminada queda en route_cache.
+        """
+        await self.load_road_graph_async()
+        start, end = await asyncio.gather(
+            asyncio.to_thread(self.resolve_location, start_location),
+            asyncio.to_thread(self.resolve_location, end_location, True)
+        )
+        start_address = start["address"] if start else None
+        end_address = end["address"] if end else None
+
+        print(f"Start location: {start_address}")
+        print(f"End location: {end_address}")
+
+        cache_key = self._route_cache_key(start, end, bellman, departure_time, heuristic)
+        cached = self.route_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            for record in cached["ruta"]:
+                yield self._stream_step(record)
+            yield self._stream_summary(cached)
+            return
+
+        generation = self.route_cache.generation
+        source, edges, settled, route_fields = await asyncio.to_thread(
+            self._route_search, start, end, bellman, departure_time, heuristic
+        )
+        clean_records = []
+        realtime_multiplier = None
+        try:
+            if edges:
+                # El factor de tráfico (HERE o el servicio de fondo) se pide mientras se envían los pasos
+                graph = self.road_graph
+                endpoints = [self._endpoint_record(source, int(graph.edge_target[edges[-1]]))]
+                realtime_multiplier = asyncio.create_task(
+                    get_realtime_multiplier_async(endpoints, departure_time, self.traffic_factors)
+                )
+                for record in graph.iter_records(edges, source):
+                    record.update(route_fields)
+                    clean_record = self._clean_records([record])[0]
+                    clean_records.append(clean_record)
+                    yield self._stream_step(clean_record)
+
+            response = self._route_response(
+                clean_records, edges, settled, departure_time,
+                await realtime_multiplier if realtime_multiplier is not None else 1.0
+            )
+        finally:
+            # El cliente se desconectó a mitad de la ruta: no se espera más a HERE
+            if realtime_multiplier is not None and not realtime_multiplier.done():
+                realtime_multiplier.cancel()
+        if cache_key is not None:
+            self.route_cache.put(cache_key, response, generation)
+        yield self._stream_summary(response)
+
+    @staticmethod
+    def _stream_step(record):
+        return {"tipo": "paso", **{key: value for key, value in record.items() if key not in STREAM_STEP_TIMING_FIELDS}}
+
+    @staticmethod
+    def _stream_summary(response):
+        summary = {key: value for key, value in response.items() if key != "ruta"}
+        return {"tipo": "resumen", **summary, "pasos": len(response["ruta"])}
+
+    def _endpoint_record(self, source, target):
+        # Lo único que necesitan get_realtime_multiplier(_async) de los registros: origen y destino
+        graph = self.road_graph
+        return {"fromLat": graph._lat[source], "fromLng": graph._lng[source], "toLat": graph._lat[target], "toLng": graph._lng[target]}
+
+    def find_route_streets(self, start_location: str, end_location: str, departure_time=None, bypass_cache=False):
+        """Solo las calles de la ruta más rápida, en orden y sin repetir, con sus metros.
+
+        Misma búsqueda que /shortest-path, pero sin armar los registros por
+        paso ni calcular el ETA (ni consultar a HERE).
+        """
+        start = self.resolve_location(start_location)
+        end = self.resolve_location(end_location, destination=True)
+
+        def compute():
+            _, edges, _, _ = self._route_search(start, end, True, departure_time)
+            return self._street_totals(edges)
+
+        cache_key = self._route_cache_key(start, end, True, departure_time, "calles")
+        if cache_key is None:
+            return compute()
+        return self.route_cache.get_or_compute(cache_key, compute, bypass=bypass_cache)
+
+    def _street_totals(self, edges):
+        graph = self.road_graph
+        if not edges:
+            return {"calles": [], "detalle": [], "distancia_total": 0.0}
+
+        edges = np.asarray(edges, dtype=np.int64)
+        name_ids, first_seen, inverse = np.unique(graph.name_id[edges], return_index=True, return_inverse=True)
+        lengths = np.bincount(inverse, weights=graph.length[edges].astype(np.float64))
+
+        # Orden de aparición en la ruta; nombres distintos en la tabla (listas) pueden dar la misma calle
+        totals = {}
+        for i in np.argsort(first_seen, kind="stable").tolist():
+            name = graph.names[name_ids[i]]
+            if isinstance(name, list):
+                name = name[0] if name else None
+            if not isinstance(name, str):
+                continue
+            totals[name] = totals.get(name, 0.0) + float(lengths[i])
+
+        return {
+            "calles": list(totals),
+            "detalle": [{"calle": name, "distancia_metros": round(length, 1)} for name, length in totals.items()],
+            "distancia_total": round(float(graph.length[edges].astype(np.float64).sum()), 1)
+        }
+
+    def find_alternative_routes(self, start_location: str, end_location: str, k=3, departure_time=None, bypass_cache=False):
+        """Hasta `k` rutas distintas con su ETA, para esquivar una avenida bloqueada.
+
+        Método de penalización sobre los pesos de la franja horaria
+        (utils/alternatives.py); `solapamiento` es la fracción de la ruta que
+        comparte con alguna de las anteriores.
+        """
+        start = self.resolve_location(start_location)
+        end = self.resolve_location(end_location, destination=True)
+
+        def compute():
+            if start is None or end is None or start["node"] is None or end["node"] is None:
+                return {"alternativas": [], "nodos_explorados": 0}
+            graph = self.road_graph
+            source, target = start["node"], end["node"]
+            day_type, period = profile_key_for(departure_time)
+            weights, heuristic_scale = self.route_weights.get((day_type, period))
+            routes = alternative_routes(graph, source, target, weights, heuristic_scale, k)
+
+            alternatives = []
+            traffic_factor = None
+            for rank, (edges, cost, overlap, _) in enumerate(routes):
+                records = self._clean_records(graph.build_records(edges, source))
+                if traffic_factor is None:
+                    # Mismos extremos para todas: un solo factor en tiempo real
+                    realtime_multiplier = get_realtime_multiplier(records, departure_time, self.traffic_factors) if records else 1.0
+                    traffic_factor = get_traffic_factor(departure_time, realtime_multiplier)
+                total_seconds = self.eta_engine.annotate(records, edges, traffic_factor)
+                alternatives.append({
+                    "alternativa": rank + 1,
+                    "tiempo_estimado": format_seconds(total_seconds) if records else "Tiempo no disponible",
+                    "tiempo_estimado_segundos": round(total_seconds, 1),
+                    "distancia_metros": round(float(graph.length[edges].astype(np.float64).sum()), 1) if edges else 0.0,
+                    "pesoTotalTrafico": round(cost, 2),
+                    "solapamiento": round(overlap, 3),
+                    "calles": self._street_totals(edges)["calles"],
+                    "ruta": records
+                })
+            return {
+                "estrategiaDeRuta": f"Rutas alternativas según tráfico ({PERIOD_LABELS[period]}, {'fin de semana' if day_type == 'weekend' else 'día de semana'})",
+                "alternativas": alternatives,
+                "nodos_explorados": sum(settled for *_, settled in routes)
+            }
+
+        cache_key = self._route_cache_key(start, end, True, departure_time, f"alternativas-{k}")
+        if cache_key is None:
+            return compute()
+        return self.route_cache.get_or_compute(cache_key, compute, bypass=bypass_cache)
+
+    def _route_cache_key(self, start, end, bellman, departure_time, heuristic):
+        if start is None or end is None or start["node"] is None or end["node"] is None:
+            return None
+        local_time = to_local_datetime(departure_time)
+        day_type, _ = profile_key_for(local_time)
+        return (start["node"], end["node"], "bellman" if bellman else "astar", heuristic, local_time.hour, day_type, self.road_overlay.current_version())
+
+    def _compute_route(self, start, end, bellman, departure_time, heuristic):
+        records, settled, edges = self._run_graph_route(start, end, bellman, departure_time, heuristic)
+
+        clean_records = self._clean_records(records)
+        realtime_multiplier = get_realtime_multiplier(clean_records, departure_time, self.traffic_factors) if clean_records else 1.0
+
+        return self._route_response(clean_records, edges, settled, departure_time, realtime_multiplier)
+
+    async def _compute_route_async(self, start, end, bellman, departure_time, heuristic):
+        # La búsqueda es CPU en memoria (a un hilo); la consulta a HERE no ocupa ningún hilo
+        records, settled, edges = await asyncio.to_thread(self._run_graph_route, start, end, bellman, departure_time, heuristic)
+
+        clean_records = self._clean_records(records)
+        realtime_multiplier = await get_realtime_multiplier_async(clean_records, departure_time, self.traffic_factors) if clean_records else 1.0
+
+        return self._route_response(clean_records, edges, settled, departure_time, realtime_multiplier)
+
+    def _route_response(self, clean_records, edges, settled, departure_time, realtime_multiplier):
+        if not clean_records:
+            return {"tiempo_estimado": "Tiempo no disponible", "tiempo_estimado_segundos": None, "ruta": clean_records, "nodos_explorados": settled}
+
+        # Segundos por paso y acumulados con el mismo modelo que calculate_approx_time
+        traffic_factor = get_traffic_factor(departure_time, realtime_multiplier)
+        total_seconds = self.eta_engine.annotate(clean_records, edges, traffic_factor)
+        return {
+            "tiempo_estimado": format_seconds(total_seconds),
+            "tiempo_estimado_segundos": round(total_seconds, 1),
+            "ruta": clean_records,
+            "nodos_explorados": settled
+        }
+
+    def _run_cypher_route(self, query, start_address, end_address, **params):
         with self.driver.session() as session:
             result = session.run(
-                BELLMAN_FORD_STEP_BY_STEP_CYPHER_QUERY if bellman else A_STAR_STEP_BY_STEP_CYPHER_QUERY,
+                query,
                 start_address=start_address, 
                 end_address=end_address,
-                current_hour=12,
-                day_type="weekday"
+                **params
             )
 
             # Consume all records at once
-            records = [dict(record) for record in result]
-
-            # Clean up the records
-            clean_records = []
-            for record in records:
-                clean_record = {}
-                for key, value in record.items():
-                    if value is not None:
-                        if hasattr(value, 'items'):
-                            clean_record[key] = {k: self.clean_nan(v) for k, v in value.items()}
-                        else:
-                            clean_record[key] = self.clean_nan(value)
-                    else:
-                        clean_record[key] = None
-                clean_records.append(clean_record)
+            return [dict(record) for record in result]
+
+    def _run_graph_route(self, start, end, bellman, departure_time, heuristic=None):
+        source, edges, settled, route_fields = self._route_search(start, end, bellman, departure_time, heuristic)
+        if not edges:
+            return [], settled, []
+
+        records = self.road_graph.build_records(edges, source)
+        self._decorate_records(records, route_fields)
+        return records, settled, edges
+
+    def _route_search(self, start, end, bellman, departure_time, heuristic=None):
+        # (nodo origen, aristas, nodos asentados, campos de ruta que van en cada paso)
+        graph = self.road_graph
+        # start/end como los devuelve resolve_location (el nodo ya viene resuelto, también para coordenadas)
+        source = start["node"] if start else None
+        target = end["node"] if end else None
+        if source is None or target is None:
+            return source, [], 0, {}
 
-            total_travel_time = calculate_approx_time(clean_records)
-       
+        if not bellman:
+            edges, _, settled = self._route_edges(source, target, LENGTH_PROFILE, heuristic)
+            return source, edges or [], settled, {}
+
+        # Una sola búsqueda sobre los pesos de tiempo de viaje de la franja horaria de salida
+        day_type, period = profile_key_for(departure_time)
+        edges, total_weight, settled = self._route_edges(source, target, (day_type, period), heuristic)
+        if not edges:
+            return source, [], settled, {}
+
+        return source, edges, settled, {
+            "distanciaTotal": round(sum(graph._lengths[edge] for edge in edges), 3),
+            "estrategiaDeRuta": f"Ruta más rápida según tráfico ({PERIOD_LABELS[period]}, {'fin de semana' if day_type == 'weekend' else 'día de semana'})",
+            "pesoTotalTrafico": round(total_weight, 2)
+        }
+
+    def _decorate_records(self, records, route_fields):
+        for record in records:
+            record.update(route_fields)
+
+    def _route_edges(self, source, target, profile_key, heuristic=None):
+        # heuristic: None (jerarquía de contracción si existe), 'haversine' o 'alt'
+        hierarchy = self._hierarchies.get(profile_key)
+        # La jerarquía se contrajo con los pesos base: con cierres vigentes no sirve
+        if hierarchy is not None and heuristic is None and not self.road_overlay.active:
+            return hierarchy.query(source, target)
+
+        graph = self.road_graph
+        weights, heuristic_scale = self.route_weights.get(profile_key)
+        lower_bound = None
+        if heuristic == "alt":
+            # Landmarks con pesos base: la cota se escala por si algún cierre abarata aristas
+            alt_bound = self._landmark_index(profile_key).heuristic(source, target) * self.road_overlay.min_multiplier()
+            lower_bound = np.maximum(alt_bound, graph.haversine_heuristic(target, heuristic_scale))
+        return graph.astar(source, target, weights, heuristic_scale, lower_bound)
+
+    def _landmark_index(self, profile_key):
+        # Las distancias a los landmarks se precalculan la primera vez que se pide ALT en un perfil
+        landmarks = self._landmarks.get(profile_key)
+        if landmarks is None:
+            with self._landmarks_lock:
+                landmarks = self._landmarks.get(profile_key)
+                if landmarks is None:
+                    graph = self.road_graph
+                    hospital_nodes = [graph.node_for_address(address) for address in self.hospitals.values()]
+                    landmarks = LandmarkIndex(graph, self.traffic_profiles.get(profile_key)[0], hospital_nodes)
+                    self._landmarks[profile_key] = landmarks
+        return landmarks
+
+    @property
+    def hospital_trees(self):
+        if self._hospital_trees is None:
+            with self._hospital_trees_lock:
+                if self._hospital_trees is None:
+                    graph = self.road_graph
+                    hospital_nodes = {}
+                    for name, address in self.hospitals.items():
+                        node = graph.node_for_address(address)
+                        if node is None:
+                            node = graph.node_for_address(self.resolve_address(address))
+                        if node is not None:
+                            hospital_nodes[name] = node
+
+                    route_weights = self.route_weights
+                    # Los cierres afectan a todos los perfiles por igual: una sola versión
+                    service = HospitalTreeService(graph, route_weights, hospital_nodes, lambda profile_key: route_weights.version())
+                    # Primero la franja horaria actual, luego el resto
+                    current = profile_key_for()
+                    service.start_background_refresh(
+                        [current] + [key for key in PROFILE_KEYS if key != current],
+                        HOSPITAL_TREES_REFRESH_S
+                    )
+                    self._hospital_trees = service
+        return self._hospital_trees
+
+    @property
+    def traffic_factors(self):
+        # Sin API key de HERE no hay nada que refrescar: los ETA usan get_traffic_index
+        if self._traffic_factors is None and trafficDetails.HERE_API_KEY:
+            with self._traffic_factors_lock:
+                if self._traffic_factors is None:
+                    service = TrafficFactorService.from_graph(self.road_graph)
+                    service.start_background_refresh()
+                    self._traffic_factors = service
+        return self._traffic_factors
+
+    def find_nearest_hospitals(self, location=None, osmid=None, k=3, departure_time=None):
+        graph = self.road_graph
+        if osmid is not None:
+            node = graph.node_index.get(osmid)
+        else:
+            resolved = self.resolve_location(location)
+            node = resolved["node"] if resolved else None
+        if node is None:
+            return None
+
+        trees = self.hospital_trees.get(profile_key_for(departure_time))
+        # Candidatos por costo del árbol, reordenados por ETA en una sola pasada vectorizada
+        candidates = trees.nearest(node, 2 * k)
+        routes = [trees.path_edges(hospital, node) for hospital, _ in candidates]
+        traffic_factors = [
+            get_traffic_factor(departure_time, self._realtime_multiplier_between(node, int(trees.nodes[hospital]), departure_time))
+            for hospital, _ in candidates
+        ]
+        eta_seconds = self.eta_engine.batch_totals(routes, traffic_factors)
+
+        hospitals = []
+        for i in np.argsort(eta_seconds, kind="stable")[:k]:
+            hospital, cost = candidates[i]
+            name = trees.names[hospital]
+            records = self._clean_records(graph.build_records(routes[i], node))
+            total_seconds = self.eta_engine.annotate(records, routes[i], traffic_factors[i])
+            hospitals.append({
+                "hospital": name,
+                "direccion": self.hospitals[name],
+                "costo": round(cost, 2),
+                "distancia_metros": records[0]["distanciaTotal"] if records else 0.0,
+                "tiempo_estimado": format_seconds(total_seconds) if records else "Tiempo no disponible",
+                "tiempo_estimado_segundos": round(total_seconds, 1),
+                "ruta": records
+            })
+
+        return {"origen": graph.addresses[node], "hospitales": hospitals}
+
+    def travel_matrix(self, sources, targets=None, departure_time=None):
+        """Tiempos y distancias de todos los orígenes a todos los destinos.
+
+        Cada punto es una dirección, un nombre de hospital o {"lat", "lng"};
+        sin `targets` se usan todos los hospitales de clinicas.json.
+        """
+        graph = self.road_graph
+        if targets is None:
+            targets = list(self.hospitals)
+
+        source_nodes = [self._matrix_node(point) for point in sources]
+        target_nodes = [self._matrix_node(point, destination=True) for point in targets]
+        times, meters = self._matrix_arrays(source_nodes, target_nodes, departure_time)
+
+        def compact(matrix, decimals):
+            return [[None if np.isnan(value) else round(value, decimals) for value in row] for row in matrix.tolist()]
+
+        return {
+            "origenes": [graph.addresses[node] if node is not None else None for node in source_nodes],
+            "destinos": [graph.addresses[node] if node is not None else None for node in target_nodes],
+            "tiempos_segundos": compact(times, 1),
+            "distancias_metros": compact(meters, 1)
+        }
+
+    def _matrix_arrays(self, source_nodes, target_nodes, departure_time=None):
+        # (segundos, metros) por par como arreglos; NaN si no hay ruta o el nodo es None
+        times = np.full((len(source_nodes), len(target_nodes)), np.nan)
+        meters = np.full((len(source_nodes), len(target_nodes)), np.nan)
+        rows = [i for i, node in enumerate(source_nodes) if node is not None]
+        cols = [j for j, node in enumerate(target_nodes) if node is not None]
+        if not rows or not cols:
+            return times, meters
+
+        profile_key = profile_key_for(departure_time)
+        weights, _ = self.route_weights.get(profile_key)
+        # Los procesos del pool tienen los pesos base: con cierres vigentes se calcula aquí
+        pool = None if self.road_overlay.active else self.matrix_pool
+        costs, sums = travel_matrix(
+            self.road_graph, weights, self._matrix_metrics(),
+            [source_nodes[i] for i in rows], [target_nodes[j] for j in cols],
+            profile_key=profile_key, pool=pool
+        )
+
+        # Mismo factor de tráfico que las rutas: en tiempo real por par si hay, si no la franja horaria
+        if self.traffic_factors is None or not is_realtime_departure(departure_time):
+            factors = get_traffic_factor(departure_time, 1.0)
+        else:
+            factors = np.array([
+                [get_traffic_factor(departure_time, self._realtime_multiplier_between(source_nodes[i], target_nodes[j], departure_time)) for j in cols]
+                for i in rows
+            ])
+        reachable = np.isfinite(costs)
+        block = np.ix_(rows, cols)
+        meters[block] = np.where(reachable, sums[0], np.nan)
+        times[block] = np.where(reachable, sums[1] * factors, np.nan)
+        return times, meters
 
-        return {"tiempo_estimado": total_travel_time, "ruta": clean_records}
+    def dispatch(self, units, incidents, hospitals=None, departure_time=None, time_budget_ms=DISPATCH_TIME_BUDGET_MS):
+        """Qué unidad atiende cada incidente cuando llegan varios a la vez.
+
+        `units`: [{"id", "location"}], `incidents`: [{"location", "priority"}];
+        las ubicaciones son direcciones, nombres de hospital o {"lat", "lng"}.
+        Minimiza la suma de ETAs ponderados por prioridad con el método
+        húngaro, o de forma voraz si la instancia es muy grande o la
+        asignación se pasa de `time_budget_ms` (la matriz de ETAs no cuenta).
+        """
+        start = time.perf_counter()
+        graph = self.road_graph
+
+        unit_nodes = [self._matrix_node(unit["location"]) for unit in units]
+        incident_nodes = [self._matrix_node(incident["location"], destination=True) for incident in incidents]
+
+        # Un árbol inverso por incidente alcanza para todas las unidades
+        unit_seconds, _ = self._matrix_arrays(unit_nodes, incident_nodes, departure_time)
+
+        priorities = [incident["priority"] for incident in incidents]
+        assignment, method = assign_units(unit_seconds.T, priorities, time.perf_counter() + time_budget_ms / 1000.0)
+        nearest_hospitals = self._nearest_hospital_etas(incident_nodes, hospitals, departure_time)
+
+        profile_key = profile_key_for(departure_time)
+        assignments = []
+        for i, incident in enumerate(incidents):
+            node = incident_nodes[i]
+            unit = int(assignment[i])
+            entry = {
+                "incidente": i,
+                "direccion": graph.addresses[node] if node is not None else None,
+                "prioridad": incident["priority"],
+                "unidad": units[unit]["id"] if unit >= 0 else None,
+                "tiempo_estimado": "Tiempo no disponible",
+                "tiempo_estimado_segundos": None,
+                "distancia_metros": None,
+                "ruta": [],
+                "hospital": None
+            }
+            if unit >= 0:
+                source = unit_nodes[unit]
+                edges, _, _ = self._route_edges(source, node, profile_key)
+                records = self._clean_records(graph.build_records(edges or [], source))
+                traffic_factor = get_traffic_factor(departure_time, self._realtime_multiplier_between(source, node, departure_time))
+                total_seconds = self.eta_engine.annotate(records, edges or [], traffic_factor)
+                entry.update({
+                    "tiempo_estimado": format_seconds(total_seconds),
+                    "tiempo_estimado_segundos": round(total_seconds, 1),
+                    "distancia_metros": round(float(graph.length[edges].astype(np.float64).sum()), 1) if edges else 0.0,
+                    "ruta": records
+                })
+            entry["hospital"] = nearest_hospitals[i]
+            assignments.append(entry)
+
+        assigned = {int(unit) for unit in assignment if unit >= 0}
+        return {
+            "asignaciones": assignments,
+            "unidades_libres": [unit["id"] for j, unit in enumerate(units) if j not in assigned],
+            "metodo": method,
+            "tiempo_calculo_ms": round((time.perf_counter() - start) * 1000.0, 1)
+        }
+
+    def _nearest_hospital_etas(self, nodes, hospital_names=None, departure_time=None, candidates=3):
+        # Hospital con menor ETA desde cada nodo, leído de los árboles inversos de hospital_trees
+        trees = self.hospital_trees.get(profile_key_for(departure_time))
+        allowed = np.array([hospital_names is None or name in hospital_names for name in trees.names], dtype=bool)
+        results = []
+        for node in nodes:
+            if node is None or not allowed.any():
+                results.append(None)
+                continue
+            costs = np.where(allowed, trees.cost[:, node], np.inf)
+            reachable = np.nonzero(np.isfinite(costs))[0]
+            if len(reachable) == 0:
+                results.append(None)
+                continue
+            # Candidatos por costo del árbol, reordenados por ETA como en find_nearest_hospitals
+            ranked = reachable[np.argsort(costs[reachable], kind="stable")[:candidates]].tolist()
+            routes = [trees.path_edges(hospital, node) or [] for hospital in ranked]
+            traffic_factors = [
+                get_traffic_factor(departure_time, self._realtime_multiplier_between(node, int(trees.nodes[hospital]), departure_time))
+                for hospital in ranked
+            ]
+            eta_seconds = self.eta_engine.batch_totals(routes, traffic_factors)
+            best = int(np.argmin(eta_seconds))
+            results.append({
+                "hospital": trees.names[ranked[best]],
+                "tiempo_estimado_segundos": round(float(eta_seconds[best]), 1)
+            })
+        return results
+
+    def _matrix_node(self, point, destination=False):
+        resolved = self.resolve_location(point, destination)
+        return resolved["node"] if resolved else None
+
+    def _matrix_metrics(self):
+        # Filas que se acumulan por el árbol: metros y segundos base del modelo de ETA
+        return np.vstack([self.road_graph.length.astype(np.float64), self.eta_engine.edge_seconds])
+
+    @property
+    def matrix_pool(self):
+        # Procesos con su propia copia del grafo y de los perfiles, creados la primera vez
+        if self._matrix_pool is None:
+            with self._matrix_pool_lock:
+                if self._matrix_pool is None:
+                    profiles = self.traffic_profiles
+                    weights_by_profile = {key: profiles.get(key)[0] for key in PROFILE_KEYS}
+                    self._matrix_pool = create_pool(self.road_graph, weights_by_profile, self._matrix_metrics())
+        return self._matrix_pool
+
+    def _shutdown_matrix_pool(self):
+        if self._matrix_pool is not None:
+            self._matrix_pool.shutdown(wait=False, cancel_futures=True)
+            self._matrix_pool = None
+
+    def add_road_closure(self, kind, value=None, duration_s=None, reason=None, street=None,
+                         lat=None, lng=None, radius_m=None, from_osmid=None, to_osmid=None):
+        """Agrega un cierre o cambio de costo al RoadOverlay.
+
+        Las aristas se eligen por segmento (`from_osmid`/`to_osmid`, ambos
+        sentidos), por calle (`street`) y/o por cercanía a un punto
+        (`lat`, `lng`, `radius_m`); los criterios se combinan. Devuelve None si
+        no coincide ninguna arista y lanza ValueError si no viene ningún criterio.
+        """
+        edges = self._closure_edges(street, lat, lng, radius_m, from_osmid, to_osmid)
+        if edges is None or len(edges) == 0:
+            return None
+        return self.road_overlay.add(edges, kind, value, duration_s, reason)
+
+    def _closure_edges(self, street=None, lat=None, lng=None, radius_m=None, from_osmid=None, to_osmid=None):
+        graph = self.road_graph
+        selected = np.ones(graph.edge_count, dtype=bool)
+        criteria = False
+
+        if from_osmid is not None and to_osmid is not None:
+            u, v = graph.node_index.get(from_osmid), graph.node_index.get(to_osmid)
+            if u is None or v is None:
+                return None
+            selected &= ((graph.edge_source == u) & (graph.edge_target == v)) | ((graph.edge_source == v) & (graph.edge_target == u))
+            criteria = True
+
+        if street is not None:
+            wanted = self.normalize_text(street)
+            name_ids = [
+                i for i, name in enumerate(graph.names)
+                if any(isinstance(part, str) and self.normalize_text(part) == wanted
+                       for part in (name if isinstance(name, list) else [name]))
+            ]
+            selected &= np.isin(graph.name_id, name_ids)
+            criteria = True
+
+        if lat is not None and lng is not None:
+            near = haversine_to_many_m(graph.lat, graph.lng, lat, lng) <= (radius_m or 50.0)
+            selected &= near[graph.edge_source] | near[graph.edge_target]
+            criteria = True
+
+        if not criteria:
+            raise ValueError("Falta el tramo del cierre: desde_osmid y hasta_osmid, calle o lat y lng")
+        return np.nonzero(selected)[0]
+
+    def list_road_closures(self):
+        overlay = self.road_overlay
+        return {"version": overlay.current_version(), "cierres": overlay.entries(), **overlay.stats()}
+
+    def remove_road_closure(self, closure_id):
+        return self.road_overlay.remove(closure_id)
+
+    def reroute(self, ambulance_id, location, end_location=None, departure_time=None):
+        """Ruta de una ambulancia en curso desde su posición actual.
+
+        La primera llamada (o un destino nuevo) arma un árbol inverso hacia
+        el destino; las siguientes lo reutilizan: si la ambulancia se desvió
+        basta con leer el árbol, y si cambiaron los cierres se repara solo la
+        parte afectada. Devuelve None si la posición o el destino no se
+        resuelven.
+        """
+        path = self._reroute_path(ambulance_id, location, end_location, departure_time)
+        if path is None:
+            return None
+        node, target, edges, version, reused, updated = path
+
+        graph = self.road_graph
+        records = self._clean_records(graph.build_records(edges, node)) if edges else []
+        traffic_factor = get_traffic_factor(departure_time, self._realtime_multiplier_between(node, target, departure_time))
+        total_seconds = self.eta_engine.annotate(records, edges or [], traffic_factor)
+        return {
+            "unidad": ambulance_id,
+            "origen": graph.addresses[node],
+            "destino": graph.addresses[target],
+            "tiempo_estimado": format_seconds(total_seconds) if edges is not None else "Tiempo no disponible",
+            "tiempo_estimado_segundos": round(total_seconds, 1) if edges is not None else None,
+            "distancia_metros": round(float(graph.length[edges].astype(np.float64).sum()), 1) if edges else 0.0,
+            "ruta": records,
+            "version_pesos": version,
+            "arbol_reutilizado": reused,
+            "nodos_actualizados": updated
+        }
+
+    def live_route(self, ambulance_id, location, end_location=None):
+        """Ruta activa de una unidad para el seguimiento en vivo, como polilínea.
+
+        Usa los mismos árboles que reroute. Devuelve {"lat", "lng"} de los
+        nodos, "segundos" y "metros" por arista (con el tráfico de ahora),
+        "destino" y "version"; None si la posición o el destino no se resuelven
+        o no hay camino.
+        """
+        path = self._reroute_path(ambulance_id, location, end_location)
+        if path is None or path[2] is None:
+            return None
+        node, target, edges, version, _, _ = path
+
+        graph = self.road_graph
+        nodes = [node] + graph.edge_target[edges].tolist()
+        traffic_factor = get_traffic_factor(None, self._realtime_multiplier_between(node, target, None))
+        return {
+            "lat": graph.lat[nodes].tolist(),
+            "lng": graph.lng[nodes].tolist(),
+            "segundos": self.eta_engine.step_seconds(edges, traffic_factor).tolist(),
+            "metros": graph.length[edges].astype(np.float64).tolist(),
+            "destino": graph.addresses[target],
+            "version": version
+        }
+
+    def _reroute_path(self, ambulance_id, location, end_location=None, departure_time=None):
+        # (nodo, destino, aristas, versión, árbol reutilizado, nodos actualizados); None si no se resuelve
+        graph = self.road_graph
+        node = self._matrix_node(location)
+        session = self.reroute_sessions.get(ambulance_id)
+        if end_location is not None:
+            target = self._matrix_node(end_location, destination=True)
+        else:
+            target = session.target if session is not None else None
+        if node is None or target is None:
+            return None
+
+        profile_key = profile_key_for(departure_time)
+        weights, _ = self.route_weights.get(profile_key)
+        version = self.road_overlay.current_version()
+        multipliers = self.road_overlay.multipliers()
+
+        reused = session is not None and session.target == target and session.profile_key == profile_key
+        if reused:
+            with session.lock:
+                updated = session.repair(weights, multipliers, version)
+                edges = session.path_from(node)
+        else:
+            session = IncrementalTree(graph, target, weights, multipliers, profile_key, version)
+            updated = graph.node_count
+            edges = session.path_from(node)
+        self.reroute_sessions.put(ambulance_id, session)
+        return node, target, edges, version, reused, updated
+
+    @property
+    def telemetry_store(self):
+        if self._telemetry_store is None:
+            with self._telemetry_store_lock:
+                if self._telemetry_store is None:
+                    self._telemetry_store = TelemetryStore(TELEMETRY_STORE_PATH)
+        # Las aristas guardadas se traducen al grafo vigente (también después de reload_road_graph)
+        graph = self.road_graph
+        if self._telemetry_store.graph is not graph:
+            self._telemetry_store.bind(graph)
+        return self._telemetry_store
+
+    def map_match(self, traces):
+        """Empareja trazas GPS con las calles y entrega un dict por arista recorrida.
+
+        `traces` es una lista de {"vehicle_id", "points": [{"lat", "lng", "t"}]}
+        con `t` en segundos epoch. Cada arista sale como {"tipo": "arista", ...}
+        apenas se empareja su traza, con la velocidad observada y el tiempo que
+        estima el modelo de ETA para esa hora; todas se guardan además en
+        telemetry_store. Al final, una línea {"tipo": "resumen", ...}.
+        """
+        graph = self.road_graph
+        store = self.telemetry_store
+        started = time.perf_counter()
+        points_total = matched_total = edges_total = 0
+
+        def fill_gap(source, target):
+            # Pings salteados (túnel, señal perdida): el tramo más corto entre ambas aristas
+            return graph.astar(source, target)[0]
+
+        for trace in traces:
+            points = sorted(trace["points"], key=lambda point: point["t"])
+            points_total += len(points)
+            if not points:
+                continue
+            lats = np.array([point["lat"] for point in points], dtype=np.float64)
+            lngs = np.array([point["lng"] for point in points], dtype=np.float64)
+            times = np.array([point["t"] for point in points], dtype=np.float64)
+
+            for indices, edges, fractions in match_segments(graph, lats, lngs, times):
+                matched_total += len(indices)
+                path, entries, exits, meters, complete = traversals(graph, indices, edges, fractions, times, fill_gap)
+                departure_time = datetime.fromtimestamp(float(times[indices[0]]), timezone.utc)
+                estimated = self.eta_engine.step_seconds(path, get_traffic_factor(to_local_datetime(departure_time)))
+                observed = exits - entries
+                store.append(trace["vehicle_id"], path, entries, exits, meters, observed, estimated, complete)
+                edges_total += len(path)
+
+                speeds = np.divide(meters * 3.6, observed, out=np.zeros(len(path)), where=observed > 0)
+                for i, edge in enumerate(path.tolist()):
+                    yield {
+                        "tipo": "arista",
+                        "unidad": trace["vehicle_id"],
+                        "desde_osmid": int(graph.osmids[graph.edge_source[edge]]),
+                        "hasta_osmid": int(graph.osmids[graph.edge_target[edge]]),
+                        "calle": graph.names[graph.name_id[edge]],
+                        "entrada": round(float(entries[i]), 1),
+                        "salida": round(float(exits[i]), 1),
+                        "metros": round(float(meters[i]), 1),
+                        "velocidad_kmh": round(float(speeds[i]), 1),
+                        "segundos_observados": round(float(observed[i]), 1),
+                        "segundos_estimados": round(float(estimated[i]), 1),
+                        "completa": bool(complete[i])
+                    }
+
+        elapsed = time.perf_counter() - started
+        yield {
+            "tipo": "resumen",
+            "trazas": len(traces),
+            "puntos": points_total,
+            "puntos_emparejados": matched_total,
+            "aristas": edges_total,
+            "tiempo_calculo_ms": round(elapsed * 1000, 1),
+            "puntos_por_segundo": round(points_total / elapsed) if elapsed > 0 else None
+        }
+
+    def _realtime_multiplier_between(self, source, target, departure_time):
+        # Factor de tráfico ya refrescado en segundo plano; 1.0 cae a la franja horaria
+        traffic_factors = self.traffic_factors
+        if traffic_factors is None or not is_realtime_departure(departure_time):
+            return 1.0
+        graph = self.road_graph
+        factor = traffic_factors.factor_between(graph._lat[source], graph._lng[source], graph._lat[target], graph._lng[target])
+        return factor if factor is not None else 1.0
+
+    def _clean_records(self, records):
+        clean_records = []
+        for record in records:
+            clean_record = {}
+            for key, value in record.items():
+                if value is not None:
+                    if hasattr(value, 'items'):
+                        clean_record[key] = {k: self.clean_nan(v) for k, v in value.items()}
+                    else:
+                        clean_record[key] = self.clean_nan(value)
+                else:
+                    clean_record[key] = None
+            clean_records.append(clean_record)
+        return clean_records
@@ -0,0 +1,111 @@
+import heapq
+import math
+import threading
+
+
+class IncrementalTree:
+    """Árbol inverso de caminos mínimos hacia el destino de una ambulancia, reparable.
+
+    Con el árbol, la ruta desde cualquier nodo (la ambulancia se desvió) es
+    seguir `tree_edge` hasta el destino, sin buscar. Cuando cambian los pesos
+    (RoadOverlay), `repair` solo recalcula los nodos cuyo camino usaba una
+    arista modificada y propaga las mejoras desde las aristas abaratadas, al
+    estilo de Ramalingam-Reps: el trabajo es proporcional al cambio y no a
+    la ciudad.
+    """
+
+    def __init__(self, graph, target, weights, multipliers, profile_key, version):
+        self.graph = graph
+        self.target = target
+        self.profile_key = profile_key
+        self.version = version
+        self.multipliers = dict(multipliers)
+        dist, tree_edge = graph.shortest_path_tree(target, weights, reverse=True)
+        self.dist = dist.tolist()
+        self.tree_edge = tree_edge.tolist()
+        self.lock = threading.Lock()
+
+    def repair(self, weights, multipliers, version):
+        # Devuelve la cantidad de nodos cuya distancia se recalculó
+        if version == self.version:
+            return 0
+        graph = self.graph
+        sources, targets = graph._sources, graph._targets
+        indptr, reverse_indptr, reverse_edges = graph._indptr, graph._reverse_indptr, graph._reverse_edges
+        dist, tree_edge = self.dist, self.tree_edge
+
+        changed = [
+            edge for edge in set(self.multipliers) | set(multipliers)
+            if self.multipliers.get(edge, 1.0) != multipliers.get(edge, 1.0)
+        ]
+        self.multipliers = dict(multipliers)
+        self.version = version
+
+        # Nodos cuyo camino al destino pasaba por una arista modificada: el subárbol detrás de ella
+        affected = set()
+        stack = [sources[edge] for edge in changed if tree_edge[sources[edge]] == edge]
+        while stack:
+            node = stack.pop()
+            if node in affected:
+                continue
+            affected.add(node)
+            for i in range(reverse_indptr[node], reverse_indptr[node + 1]):
+                edge = reverse_edges[i]
+                if tree_edge[sources[edge]] == edge:
+                    stack.append(sources[edge])
+
+        for node in affected:
+            dist[node] = math.inf
+            tree_edge[node] = -1
+
+        heap = []
+        # Cada nodo afectado arranca con su mejor salida hacia un nodo que sigue siendo válido
+        for node in affected:
+            for edge in range(indptr[node], indptr[node + 1]):
+                nxt = targets[edge]
+                if nxt in affected:
+                    continue
+                candidate = weights[edge] + dist[nxt]
+                if candidate < dist[node]:
+                    dist[node] = candidate
+                    tree_edge[node] = edge
+            if dist[node] < math.inf:
+                heap.append((dist[node], node))
+
+        # Aristas abaratadas fuera del árbol pueden mejorar nodos no afectados
+        for edge in changed:
+            node = sources[edge]
+            candidate = weights[edge] + dist[targets[edge]]
+            if candidate < dist[node]:
+                dist[node] = candidate
+                tree_edge[node] = edge
+                heap.append((candidate, node))
+
+        heapq.heapify(heap)
+        updated = set(affected)
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            for i in range(reverse_indptr[node], reverse_indptr[node + 1]):
+                edge = reverse_edges[i]
+                prev = sources[edge]
+                nd = d + weights[edge]
+                if nd < dist[prev]:
+                    updated.add(prev)
+                    dist[prev] = nd
+                    tree_edge[prev] = edge
+                    heapq.heappush(heap, (nd, prev))
+        return len(updated)
+
+    def path_from(self, node):
+        # Aristas desde `node` hasta el destino; None si no hay camino
+        edges = []
+        targets, tree_edge = self.graph._targets, self.tree_edge
+        while node != self.target:
+            edge = tree_edge[node]
+            if edge < 0:
+                return None
+            edges.append(edge)
+            node = targets[edge]
+        return edges
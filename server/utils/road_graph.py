@@ -0,0 +1,371 @@
+import math
+import heapq
+import numpy as np
+
+
+GRAPH_NODES_CYPHER_QUERY = """
+MATCH (i:Intersection)
+WHERE i.location IS NOT NULL
+RETURN i.osmid AS osmid, i.address AS address, i.location.y AS lat, i.location.x AS lng
+"""
+
+GRAPH_EDGES_CYPHER_QUERY = """
+MATCH (a:Intersection)-[r:ROAD_SEGMENT]->(b:Intersection)
+WHERE r.length IS NOT NULL AND a.location IS NOT NULL AND b.location IS NOT NULL
+RETURN a.osmid AS u, b.osmid AS v, r.length AS length, r.name AS name,
+    r.highway AS highway, r.oneway AS oneway, r.max_speed AS max_speed
+"""
+
+# Radio usado por OSMnx para calcular `length`: la heurística nunca sobreestima
+EARTH_RADIUS_M = 6371009.0
+# Radio que usa Neo4j en point.distance() para puntos WGS-84
+NEO4J_EARTH_RADIUS_M = 6378140.0
+
+
+def haversine_m(lat1, lng1, lat2, lng2, radius=EARTH_RADIUS_M):
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * radius * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_to_many_m(lats, lngs, lat, lng, radius=EARTH_RADIUS_M):
+    phi1 = np.radians(lats)
+    phi2 = math.radians(lat)
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * math.cos(phi2) * np.sin(np.radians(lng - lngs) / 2) ** 2
+    return 2 * radius * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def primary_highway(highway):
+    # OSMnx guarda una lista cuando un segmento fusiona varios tipos de vía
+    if isinstance(highway, list):
+        return highway[0] if highway else None
+    return highway
+
+
+def _intern_key(value):
+    # Las propiedades de OSMnx pueden ser listas o NaN, que no sirven como llave de dict
+    if isinstance(value, list):
+        return ("list", tuple(value))
+    if isinstance(value, float) and math.isnan(value):
+        return ("nan",)
+    return ("value", value)
+
+
+class _Interner:
+    def __init__(self):
+        self.values = []
+        self._ids = {}
+
+    def add(self, value):
+        key = _intern_key(value)
+        idx = self._ids.get(key)
+        if idx is None:
+            idx = len(self.values)
+            self._ids[key] = idx
+            self.values.append(value)
+        return idx
+
+
+class RoadGraph:
+    """Grafo vial de Neo4j cargado en memoria como arreglos compactos (CSR)."""
+
+    def __init__(self, osmids, lats, lngs, addresses, edges):
+        self.osmids = np.asarray(osmids, dtype=np.int64)
+        self.lat = np.asarray(lats, dtype=np.float64)
+        self.lng = np.asarray(lngs, dtype=np.float64)
+        self.addresses = list(addresses)
+        self.node_count = len(self.osmids)
+
+        self.node_index = {int(osmid): i for i, osmid in enumerate(self.osmids)}
+        self.address_to_node = {}
+        for i, address in enumerate(self.addresses):
+            if address and address not in self.address_to_node:
+                self.address_to_node[address] = i
+
+        self._build_edges(edges)
+        self._spatial_index = None
+
+        # Vistas en listas de Python: indexarlas es mucho más rápido que indexar numpy escalar a escalar
+        self._indptr = self.indptr.tolist()
+        self._targets = self.edge_target.tolist()
+        self._sources = self.edge_source.tolist()
+        self._reverse_indptr = self.reverse_indptr.tolist()
+        self._reverse_edges = self.reverse_edges.tolist()
+        self._lengths = self.length.tolist()
+        self._lat = self.lat.tolist()
+        self._lng = self.lng.tolist()
+
+    def _build_edges(self, edges):
+        names = _Interner()
+        highways = _Interner()
+        speeds = _Interner()
+
+        src, dst, length, name_id, highway_id, oneway, speed_id = [], [], [], [], [], [], []
+        present = set()
+        parsed = []
+
+        for edge in edges:
+            u = self.node_index.get(edge["u"])
+            v = self.node_index.get(edge["v"])
+            if u is None or v is None or edge.get("length") is None:
+                continue
+            parsed.append((u, v, edge))
+            present.add((u, v))
+
+        def append(u, v, edge, is_oneway):
+            src.append(u)
+            dst.append(v)
+            length.append(float(edge["length"]))
+            name_id.append(names.add(edge.get("name")))
+            highway_id.append(highways.add(edge.get("highway")))
+            oneway.append(is_oneway)
+            speed_id.append(speeds.add(edge.get("max_speed")))
+
+        for u, v, edge in parsed:
+            is_oneway = edge.get("oneway") is True
+            append(u, v, edge, is_oneway)
+            # Calle de doble sentido sin el segmento inverso importado: se agrega el sentido contrario
+            if not is_oneway and (v, u) not in present:
+                append(v, u, edge, is_oneway)
+                present.add((v, u))
+
+        src = np.asarray(src, dtype=np.int32)
+        order = np.argsort(src, kind="stable")
+
+        self.edge_count = len(order)
+        self.edge_source = src[order]
+        self.edge_target = np.asarray(dst, dtype=np.int32)[order]
+        self.length = np.asarray(length, dtype=np.float32)[order]
+        self.name_id = np.asarray(name_id, dtype=np.int32)[order]
+        self.highway_id = np.asarray(highway_id, dtype=np.int32)[order]
+        self.oneway = np.asarray(oneway, dtype=bool)[order]
+        self.speed_id = np.asarray(speed_id, dtype=np.int32)[order]
+
+        self.names = names.values
+        self.highways = highways.values
+        self.max_speeds = speeds.values
+
+        counts = np.bincount(self.edge_source, minlength=self.node_count)
+        self.indptr = np.zeros(self.node_count + 1, dtype=np.int32)
+        np.cumsum(counts, out=self.indptr[1:])
+
+        # CSR inverso (aristas entrantes por nodo) para búsquedas hacia atrás
+        self.reverse_edges = np.argsort(self.edge_target, kind="stable").astype(np.int32)
+        counts = np.bincount(self.edge_target, minlength=self.node_count)
+        self.reverse_indptr = np.zeros(self.node_count + 1, dtype=np.int32)
+        np.cumsum(counts, out=self.reverse_indptr[1:])
+
+    @classmethod
+    def from_neo4j(cls, driver):
+        with driver.session() as session:
+            nodes = [dict(record) for record in session.run(GRAPH_NODES_CYPHER_QUERY)]
+            edges = [dict(record) for record in session.run(GRAPH_EDGES_CYPHER_QUERY)]
+        return cls.from_records(nodes, edges)
+
+    @classmethod
+    async def fetch_records_async(cls, driver):
+        # Mismas consultas con el AsyncGraphDatabase; los arreglos se arman luego con from_records
+        async with driver.session() as session:
+            result = await session.run(GRAPH_NODES_CYPHER_QUERY)
+            nodes = [dict(record) async for record in result]
+            result = await session.run(GRAPH_EDGES_CYPHER_QUERY)
+            edges = [dict(record) async for record in result]
+        return nodes, edges
+
+    @classmethod
+    def from_records(cls, nodes, edges):
+        return cls(
+            [node["osmid"] for node in nodes],
+            [node["lat"] for node in nodes],
+            [node["lng"] for node in nodes],
+            [node["address"] for node in nodes],
+            edges
+        )
+
+    def node_for_address(self, address):
+        return self.address_to_node.get(address)
+
+    @property
+    def spatial_index(self):
+        # Grilla para ajustar coordenadas GPS al grafo; se arma en el primer uso
+        if self._spatial_index is None:
+            from .spatial_index import SpatialIndex
+            self._spatial_index = SpatialIndex(self)
+        return self._spatial_index
+
+    def edges_between_osmids(self, from_osmids, to_osmids):
+        """Arista de cada par (osmid origen, osmid destino), o -1 si el grafo actual no la tiene.
+
+        Los índices de arista dependen del orden en que Neo4j devuelve los
+        segmentos; los pares de osmid no, así que sirven para guardar aristas.
+        """
+        from_osmids = np.asarray(from_osmids, dtype=np.int64)
+        to_osmids = np.asarray(to_osmids, dtype=np.int64)
+        if self.node_count == 0 or self.edge_count == 0:
+            return np.full(len(from_osmids), -1, dtype=np.int64)
+
+        node_order = np.argsort(self.osmids)
+        sorted_osmids = self.osmids[node_order]
+
+        def nodes_of(osmids):
+            i = np.minimum(np.searchsorted(sorted_osmids, osmids), self.node_count - 1)
+            return np.where(sorted_osmids[i] == osmids, node_order[i], -1)
+
+        u, v = nodes_of(from_osmids), nodes_of(to_osmids)
+        keys = self.edge_source.astype(np.int64) * self.node_count + self.edge_target
+        edge_order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[edge_order]
+        wanted = u * self.node_count + v
+        i = np.minimum(np.searchsorted(sorted_keys, wanted), self.edge_count - 1)
+        found = (u >= 0) & (v >= 0) & (sorted_keys[i] == wanted)
+        return np.where(found, edge_order[i], -1)
+
+    def nearest_node(self, lat, lng):
+        nodes, _ = self.spatial_index.nearest_nodes([lat], [lng])
+        return int(nodes[0]) if nodes[0] >= 0 else None
+
+    def straight_line_m(self, a, b, radius=EARTH_RADIUS_M):
+        return haversine_m(self._lat[a], self._lng[a], self._lat[b], self._lng[b], radius)
+
+    def distances_to_m(self, node, radius=EARTH_RADIUS_M):
+        return haversine_to_many_m(self.lat, self.lng, self._lat[node], self._lng[node], radius)
+
+    def haversine_heuristic(self, target, heuristic_scale=1.0):
+        # Heurística de todos los nodos en una sola operación vectorizada;
+        # el margen cubre los redondeos de float32 en las longitudes
+        return 0.999 * heuristic_scale * self.distances_to_m(target)
+
+    def astar(self, source, target, weights=None, heuristic_scale=1.0, heuristic=None):
+        """A* con heurística haversine.
+
+        `weights` es una lista con el costo de cada arista (por defecto, la
+        longitud) y `heuristic_scale` el costo mínimo por metro, para que la
+        heurística siga siendo admisible. `heuristic` permite pasar una cota
+        inferior ya calculada por nodo (p. ej. ALT). Devuelve (lista de
+        aristas, costo total, nodos asentados); la lista es None si no existe
+        camino.
+        """
+        if source == target:
+            return [], 0.0, 0
+
+        indptr, targets = self._indptr, self._targets
+        lengths = self._lengths if weights is None else weights
+        if heuristic is None:
+            heuristic = self.haversine_heuristic(target, heuristic_scale)
+        heuristic = heuristic.tolist()
+
+        dist = {source: 0.0}
+        parent_edge = {}
+        settled = set()
+        heap = [(heuristic[source], 0.0, source)]
+
+        while heap:
+            _, d, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            if node == target:
+                return self._unwind(parent_edge, source, target), d, len(settled)
+
+            for edge in range(indptr[node], indptr[node + 1]):
+                nxt = targets[edge]
+                if nxt in settled:
+                    continue
+                nd = d + lengths[edge]
+                if nd < dist.get(nxt, math.inf):
+                    dist[nxt] = nd
+                    parent_edge[nxt] = edge
+                    heapq.heappush(heap, (nd + heuristic[nxt], nd, nxt))
+
+        return None, math.inf, len(settled)
+
+    def shortest_distances(self, source, weights=None, reverse=False):
+        """Dijkstra completo desde `source` (o hacia `source` si `reverse`)."""
+        return self.shortest_path_tree(source, weights, reverse)[0]
+
+    def shortest_path_tree(self, source, weights=None, reverse=False):
+        """Árbol de caminos mínimos con raíz en `source`.
+
+        Devuelve (distancias, arista del árbol por nodo). Con `reverse` el árbol
+        es hacia `source` y la arista de cada nodo es la que sale de él en
+        dirección a la raíz; -1 en la raíz y en nodos inalcanzables.
+        """
+        if reverse:
+            indptr, edge_ids, ends = self._reverse_indptr, self._reverse_edges, self._sources
+        else:
+            indptr, edge_ids, ends = self._indptr, None, self._targets
+        lengths = self._lengths if weights is None else weights
+
+        dist = [math.inf] * self.node_count
+        tree_edge = [-1] * self.node_count
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            for i in range(indptr[node], indptr[node + 1]):
+                edge = i if edge_ids is None else edge_ids[i]
+                nxt = ends[edge]
+                nd = d + lengths[edge]
+                if nd < dist[nxt]:
+                    dist[nxt] = nd
+                    tree_edge[nxt] = edge
+                    heapq.heappush(heap, (nd, nxt))
+        return np.asarray(dist, dtype=np.float64), np.asarray(tree_edge, dtype=np.int32)
+
+    def _unwind(self, parent_edge, source, target):
+        path = []
+        node = target
+        edge_source = self.edge_source
+        while node != source:
+            edge = parent_edge[node]
+            path.append(edge)
+            node = int(edge_source[edge])
+        path.reverse()
+        return path
+
+    def highway_of(self, edge):
+        return primary_highway(self.highways[self.highway_id[edge]])
+
+    def path_nodes(self, edges, source):
+        nodes = [source]
+        nodes.extend(int(self.edge_target[edge]) for edge in edges)
+        return nodes
+
+    def build_records(self, edges, source):
+        """Registros paso a paso con la misma forma que devuelven las consultas Cypher."""
+        return list(self.iter_records(edges, source))
+
+    def iter_records(self, edges, source):
+        # Generador: cada registro se arma recién cuando se pide (respuestas en streaming)
+        nodes = self.path_nodes(edges, source)
+        if not edges:
+            return
+
+        destination = nodes[-1]
+        total_distance = round(sum(self._lengths[edge] for edge in edges), 3)
+        last = len(edges) - 1
+
+        for i, edge in enumerate(edges):
+            a, b = nodes[i], nodes[i + 1]
+            yield {
+                "paso": i + 1,
+                "desde": self.addresses[a],
+                "hasta": self.addresses[b],
+                "fromLat": self._lat[a],
+                "fromLng": self._lng[a],
+                "toLat": self._lat[b],
+                "toLng": self._lng[b],
+                "nombreCalle": self.names[self.name_id[edge]],
+                "tipoCalle": self.highways[self.highway_id[edge]],
+                "unidireccional": "Sí" if self.oneway[edge] else "No",
+                "distancia_metros": round(self._lengths[edge], 3),
+                "distanciaLineaRectaAlDestino": self.straight_line_m(a, destination, NEO4J_EARTH_RADIUS_M),
+                "velocidadMaxima_kmh": self.max_speeds[self.speed_id[edge]],
+                "instruccion": "Inicio" if i == 0 else "Destino" if i == last else "Continuar por",
+                "distanciaTotal": total_distance if i == 0 else None
+            }
@@ -0,0 +1,177 @@
+import time
+import threading
+import numpy as np
+from .traffic_profiles import edge_speeds_kmh
+
+OVERLAY_KINDS = ("bloqueo", "multiplicar", "velocidad")
+
+
+class RoadOverlay:
+    """Cierres y cambios de costo por arista, en memoria y versionados.
+
+    Cada entrada afecta un conjunto de aristas: "bloqueo" las corta,
+    "multiplicar" multiplica su costo por `valor` y "velocidad" fija la
+    velocidad en `valor` km/h. `version` sube con cada cambio (incluido el
+    vencimiento de una entrada), así cachés y árboles saben cuándo recalcular.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.version = 0
+        self._speeds = edge_speeds_kmh(graph)
+        self._entries = {}
+        self._next_id = 1
+        self._multipliers = {}
+        self._multipliers_version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        self.current_version()
+        return bool(self._entries)
+
+    def current_version(self):
+        # Las entradas vencidas se descartan al consultar la versión
+        now = time.monotonic()
+        with self._lock:
+            expired = [entry_id for entry_id, entry in self._entries.items()
+                       if entry["expira"] is not None and entry["expira"] <= now]
+            for entry_id in expired:
+                del self._entries[entry_id]
+            if expired:
+                self.version += 1
+            return self.version
+
+    def add(self, edges, kind, value=None, duration_s=None, reason=None):
+        if kind not in OVERLAY_KINDS:
+            raise ValueError(f"Tipo de cierre desconocido: {kind}")
+        if kind != "bloqueo" and (value is None or value <= 0):
+            raise ValueError(f"'{kind}' necesita un valor positivo")
+
+        with self._lock:
+            entry = {
+                "id": self._next_id,
+                "tipo": kind,
+                "valor": value,
+                "motivo": reason,
+                "aristas": np.unique(np.asarray(edges, dtype=np.int64)),
+                "expira": time.monotonic() + duration_s if duration_s else None
+            }
+            self._entries[entry["id"]] = entry
+            self._next_id += 1
+            self.version += 1
+        return self.describe(entry)
+
+    def remove(self, entry_id):
+        with self._lock:
+            if self._entries.pop(entry_id, None) is None:
+                return False
+            self.version += 1
+            return True
+
+    def entries(self):
+        self.current_version()
+        with self._lock:
+            return [self.describe(entry) for entry in self._entries.values()]
+
+    def describe(self, entry):
+        remaining = entry["expira"] - time.monotonic() if entry["expira"] is not None else None
+        graph = self.graph
+        return {
+            "id": entry["id"],
+            "tipo": entry["tipo"],
+            "valor": entry["valor"],
+            "motivo": entry["motivo"],
+            "aristas": int(len(entry["aristas"])),
+            "segmentos": [
+                [int(graph.osmids[graph.edge_source[edge]]), int(graph.osmids[graph.edge_target[edge]])]
+                for edge in entry["aristas"][:20].tolist()
+            ],
+            "expira_en_s": round(max(remaining, 0.0), 1) if remaining is not None else None
+        }
+
+    def multipliers(self):
+        """{arista: multiplicador de costo} de las entradas vigentes; inf si está bloqueada.
+
+        Varios "multiplicar" sobre una arista se componen; de varias
+        "velocidad" vale la más baja.
+        """
+        version = self.current_version()
+        with self._lock:
+            if self._multipliers_version == version:
+                return self._multipliers
+
+            factors = {}
+            speeds = {}
+            blocked = set()
+            for entry in self._entries.values():
+                edges = entry["aristas"].tolist()
+                if entry["tipo"] == "bloqueo":
+                    blocked.update(edges)
+                elif entry["tipo"] == "multiplicar":
+                    for edge in edges:
+                        factors[edge] = factors.get(edge, 1.0) * entry["valor"]
+                else:
+                    for edge in edges:
+                        speeds[edge] = min(speeds.get(edge, np.inf), entry["valor"])
+
+            for edge, speed in speeds.items():
+                # El tiempo de viaje es inversamente proporcional a la velocidad
+                factors[edge] = factors.get(edge, 1.0) * float(self._speeds[edge]) / speed
+            for edge in blocked:
+                factors[edge] = np.inf
+
+            self._multipliers = factors
+            self._multipliers_version = version
+            return factors
+
+    def min_multiplier(self):
+        # Cota para mantener admisibles las heurísticas calculadas con los pesos base
+        multipliers = self.multipliers()
+        return min(1.0, min(multipliers.values())) if multipliers else 1.0
+
+    def stats(self):
+        multipliers = self.multipliers()
+        return {
+            "version": self.version,
+            "entradas": len(self._entries),
+            "aristas_afectadas": len(multipliers),
+            "aristas_bloqueadas": sum(1 for value in multipliers.values() if value == np.inf)
+        }
+
+
+class OverlayProfiles:
+    """TrafficWeightProfiles con el RoadOverlay aplicado; misma interfaz `get`.
+
+    Sin entradas vigentes devuelve los pesos base tal cual; con entradas,
+    una copia de la lista de pesos con solo las aristas afectadas
+    modificadas, guardada por perfil hasta que cambie la versión.
+    """
+
+    def __init__(self, profiles, overlay):
+        self.profiles = profiles
+        self.overlay = overlay
+        self._patched = {}
+        self._lock = threading.Lock()
+
+    def version(self):
+        return self.overlay.current_version()
+
+    def get(self, key):
+        weights, heuristic_scale = self.profiles.get(key)
+        version = self.overlay.current_version()
+        if not self.overlay.active:
+            return weights, heuristic_scale
+
+        with self._lock:
+            cached = self._patched.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1], cached[2]
+
+            multipliers = self.overlay.multipliers()
+            patched = list(weights)
+            for edge, multiplier in multipliers.items():
+                patched[edge] = weights[edge] * multiplier
+            scale = heuristic_scale * self.overlay.min_multiplier()
+            self._patched[key] = (version, patched, scale)
+            return patched, scale
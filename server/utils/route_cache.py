@@ -0,0 +1,139 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from .ttl_cache import TTLCache
+
+
+class FlightAbandoned(Exception):
+    """El pedido que calculaba la ruta se canceló; quienes esperaban vuelven a intentar."""
+
+
+class RouteCache(TTLCache):
+    """Caché de rutas calculadas con coalescencia de pedidos idénticos simultáneos (single-flight).
+
+    Si llegan N pedidos con la misma llave mientras la ruta se está
+    calculando, solo el primero la calcula y el resto espera su resultado.
+    Los cierres ya van en la llave (versión del RoadOverlay); `invalidate`
+    es para cuando se recarga el grafo, y descarta también las rutas que
+    estaban calculándose con el grafo anterior.
+    """
+
+    def __init__(self, maxsize=512, ttl_s=120.0):
+        super().__init__(maxsize, ttl_s)
+        # Versión del grafo: sube con cada invalidate
+        self.generation = 0
+        self.coalesced = 0
+        self.bypassed = 0
+        self._in_flight = {}
+        self._flight_lock = threading.Lock()
+
+    def put(self, key, value, generation=None):
+        with self._lock:
+            # Una ruta calculada sobre el grafo anterior no debe volver a entrar
+            if generation is not None and generation != self.generation:
+                return
+            self._store(key, value)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def _claim(self, key):
+        # (valor cacheado, vuelo en curso, si este pedido es el que calcula)
+        with self._flight_lock:
+            value = self.get(key)
+            if value is not None:
+                return value, None, False
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return None, flight, False
+            flight = Future()
+            self._in_flight[key] = flight
+            return None, flight, True
+
+    def _land(self, key, flight, generation, value=None, error=None):
+        with self._flight_lock:
+            if error is None:
+                self.put(key, value, generation)
+            del self._in_flight[key]
+        if flight.done():
+            return
+        if error is None:
+            flight.set_result(value)
+        else:
+            flight.set_exception(error)
+
+    def _count_bypass(self):
+        with self._flight_lock:
+            self.bypassed += 1
+
+    def get_or_compute(self, key, compute, bypass=False):
+        generation = self.generation
+        if bypass:
+            # Se recalcula sin esperar a nadie y el resultado reemplaza al cacheado
+            self._count_bypass()
+            value = compute()
+            self.put(key, value, generation)
+            return value
+
+        while True:
+            value, flight, leader = self._claim(key)
+            if flight is None:
+                return value
+            if leader:
+                break
+            try:
+                return flight.result()
+            except FlightAbandoned:
+                continue
+
+        try:
+            value = compute()
+        except Exception as e:
+            self._land(key, flight, generation, error=e)
+            raise
+        self._land(key, flight, generation, value)
+        return value
+
+    async def get_or_compute_async(self, key, compute, bypass=False):
+        # `compute` es una corrutina; los vuelos se comparten con get_or_compute
+        generation = self.generation
+        if bypass:
+            self._count_bypass()
+            value = await compute()
+            self.put(key, value, generation)
+            return value
+
+        while True:
+            value, flight, leader = self._claim(key)
+            if flight is None:
+                return value
+            if leader:
+                break
+            try:
+                # shield: si se cancela este pedido no se cancela el vuelo de los demás
+                return await asyncio.shield(asyncio.wrap_future(flight))
+            except FlightAbandoned:
+                continue
+
+        try:
+            value = await compute()
+        except Exception as e:
+            self._land(key, flight, generation, error=e)
+            raise
+        except asyncio.CancelledError:
+            # La cancelación es de este pedido, no de la ruta: el vuelo se libera y otro la calcula
+            self._land(key, flight, generation, error=FlightAbandoned())
+            raise
+        self._land(key, flight, generation, value)
+        return value
+
+    def stats(self):
+        stats = super().stats()
+        with self._flight_lock:
+            stats["coalescidas"] = self.coalesced
+            stats["sin_cache"] = self.bypassed
+            stats["en_calculo"] = len(self._in_flight)
+        return stats
@@ -0,0 +1,150 @@
+import math
+import numpy as np
+
+# Campos que en la respuesta detallada se repiten en cada paso y en la compacta van una sola vez
+ROUTE_LEVEL_FIELDS = ["distanciaTotal", "estrategiaDeRuta", "pesoTotalTrafico"]
+POLYLINE_PRECISION = 5
+# Metros por pixel en el ecuador a zoom 0 (teselas de 256 px de Web Mercator)
+METERS_PER_PIXEL_Z0 = 156543.03392
+
+
+def encode_polyline(lats, lngs, precision=POLYLINE_PRECISION):
+    """Polyline codificada de Google: deltas enteros en varint base64 de 5 bits."""
+    if len(lats) == 0:
+        return ""
+    factor = 10 ** precision
+    points = np.column_stack((
+        np.round(np.asarray(lats, dtype=np.float64) * factor),
+        np.round(np.asarray(lngs, dtype=np.float64) * factor)
+    )).astype(np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    # Signo en el bit más bajo
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1).tolist()
+
+    chunks = []
+    for value in values:
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def tolerance_for_zoom(zoom, latitude):
+    # Medio pixel a ese zoom: lo que se simplifica no se ve en el mapa
+    return 0.5 * METERS_PER_PIXEL_Z0 * math.cos(math.radians(latitude)) / (2 ** zoom)
+
+
+def douglas_peucker(lats, lngs, tolerance_m):
+    """Índices de los puntos que se conservan, en orden.
+
+    Trabaja en una proyección equirectangular local en metros; cada tramo
+    calcula la distancia de todos sus puntos internos en una operación.
+    """
+    n = len(lats)
+    if n <= 2 or tolerance_m <= 0:
+        return np.arange(n)
+
+    lat0 = math.radians(float(np.mean(lats)))
+    y = np.radians(np.asarray(lats, dtype=np.float64)) * 6371009.0
+    x = np.radians(np.asarray(lngs, dtype=np.float64)) * 6371009.0 * math.cos(lat0)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            distance = np.hypot(px, py)
+        else:
+            distance = np.abs(dx * py - dy * px) / length
+        i = int(np.argmax(distance))
+        if distance[i] > tolerance_m:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.nonzero(keep)[0]
+
+
+def street_name(name):
+    if isinstance(name, list):
+        return name[0] if name else None
+    return name
+
+
+def group_maneuvers(records):
+    # Pasos consecutivos por la misma calle en una sola maniobra; `punto` es el
+    # índice en la geometría donde empieza (el origen del paso i es el punto i)
+    maneuvers = []
+    for i, record in enumerate(records):
+        name = street_name(record.get("nombreCalle"))
+        if maneuvers and maneuvers[-1]["calle"] == name:
+            maneuver = maneuvers[-1]
+            maneuver["pasos"] += 1
+            maneuver["distancia_metros"] += record.get("distancia_metros") or 0.0
+            maneuver["hasta"] = record.get("hasta")
+        else:
+            maneuver = {
+                "calle": name,
+                "tipo": street_name(record.get("tipoCalle")),
+                "desde": record.get("desde"),
+                "hasta": record.get("hasta"),
+                "punto": i,
+                "pasos": 1,
+                "distancia_metros": record.get("distancia_metros") or 0.0
+            }
+            maneuvers.append(maneuver)
+        if "tiempo_acumulado_segundos" in record:
+            maneuver["tiempo_acumulado_segundos"] = record["tiempo_acumulado_segundos"]
+
+    for maneuver in maneuvers:
+        maneuver["distancia_metros"] = round(maneuver["distancia_metros"], 1)
+    return maneuvers
+
+
+def compact_route(result, zoom=None):
+    """Versión compacta de la respuesta de find_shortest_path.
+
+    Resumen de la ruta una sola vez, geometría como polyline codificada
+    (simplificada con Douglas-Peucker si se pasa `zoom`) y calles agrupadas
+    en maniobras que apuntan a un índice de la geometría.
+    """
+    records = result.get("ruta") or []
+    summary = {key: value for key, value in result.items() if key != "ruta"}
+    summary["pasos"] = len(records)
+    if records:
+        for field in ROUTE_LEVEL_FIELDS:
+            if records[0].get(field) is not None:
+                summary[field] = records[0][field]
+
+    if not records:
+        return {"resumen": summary, "polyline": "", "maniobras": []}
+
+    # Cada punto interior una sola vez: el origen de cada paso más el destino final
+    lats = np.array([record["fromLat"] for record in records] + [records[-1]["toLat"]], dtype=np.float64)
+    lngs = np.array([record["fromLng"] for record in records] + [records[-1]["toLng"]], dtype=np.float64)
+
+    maneuvers = group_maneuvers(records)
+    kept = np.arange(len(lats))
+    if zoom is not None:
+        # Los inicios de maniobra se conservan siempre: son los giros
+        starts = np.array([maneuver["punto"] for maneuver in maneuvers], dtype=np.int64)
+        kept = np.union1d(douglas_peucker(lats, lngs, tolerance_for_zoom(zoom, float(lats.mean()))), starts)
+        for maneuver, position in zip(maneuvers, np.searchsorted(kept, starts).tolist()):
+            maneuver["punto"] = position
+
+    compact = {
+        "resumen": summary,
+        "polyline": encode_polyline(lats[kept], lngs[kept]),
+        "precision": POLYLINE_PRECISION,
+        "maniobras": maneuvers
+    }
+    if zoom is not None:
+        compact["zoom"] = zoom
+    return compact
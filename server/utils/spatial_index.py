@@ -0,0 +1,218 @@
+import os
+import math
+import numpy as np
+from .road_graph import EARTH_RADIUS_M
+
+SPATIAL_CELL_M = float(os.getenv("SPATIAL_CELL_M", "150"))
+
+
+def _buckets(cells, items, cell_count):
+    # CSR celda -> elementos: los elementos de la celda c son items[start[c]:start[c + 1]]
+    order = np.argsort(cells, kind="stable")
+    start = np.zeros(cell_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cells, minlength=cell_count), out=start[1:])
+    return items[order], start
+
+
+class SpatialIndex:
+    """Grilla de celdas de `cell_m` metros sobre los nodos y aristas del grafo.
+
+    Las coordenadas se proyectan una vez a metros (equirectangular local, de
+    sobra para una ciudad). Cada nodo va en su celda y cada arista en todas
+    las celdas que toca su caja; la búsqueda recorre anillos de celdas
+    alrededor de cada punto, todos los puntos pendientes a la vez, y termina
+    para un punto cuando el anillo siguiente ya no puede tener algo más cerca.
+    """
+
+    def __init__(self, graph, cell_m=SPATIAL_CELL_M):
+        self.graph = graph
+        self.cell_m = cell_m
+        self.kx = EARTH_RADIUS_M * math.cos(math.radians(float(graph.lat.mean()))) * math.pi / 180.0
+        self.ky = EARTH_RADIUS_M * math.pi / 180.0
+        self.x = graph.lng * self.kx
+        self.y = graph.lat * self.ky
+        self.x0 = float(self.x.min())
+        self.y0 = float(self.y.min())
+        self.width = int((self.x.max() - self.x0) // cell_m) + 1
+        self.height = int((self.y.max() - self.y0) // cell_m) + 1
+        cell_count = self.width * self.height
+
+        # Solo intersecciones con alguna calle: un nodo aislado no sirve para rutear
+        degree = np.bincount(graph.edge_source, minlength=graph.node_count) + np.bincount(graph.edge_target, minlength=graph.node_count)
+        nodes = np.nonzero(degree > 0)[0]
+        cx, cy = self._cells(self.x[nodes], self.y[nodes])
+        self.node_items, self.node_start = _buckets(cy * self.width + cx, nodes, cell_count)
+
+        src, dst = graph.edge_source, graph.edge_target
+        cx0, cy0 = self._cells(np.minimum(self.x[src], self.x[dst]), np.minimum(self.y[src], self.y[dst]))
+        cx1, cy1 = self._cells(np.maximum(self.x[src], self.x[dst]), np.maximum(self.y[src], self.y[dst]))
+        spans_x, spans_y = cx1 - cx0 + 1, cy1 - cy0 + 1
+        counts = spans_x * spans_y
+        edges = np.repeat(np.arange(graph.edge_count), counts)
+        # Posición de cada copia dentro de la caja de su arista
+        offset = np.arange(len(edges)) - np.repeat(np.cumsum(counts) - counts, counts)
+        ex = np.repeat(cx0, counts) + offset % np.repeat(spans_x, counts)
+        ey = np.repeat(cy0, counts) + offset // np.repeat(spans_x, counts)
+        self.edge_items, self.edge_start = _buckets(ey * self.width + ex, edges, cell_count)
+        self._rings = {}
+
+    def _project(self, lats, lngs):
+        return np.asarray(lngs, dtype=np.float64) * self.kx, np.asarray(lats, dtype=np.float64) * self.ky
+
+    def _cells(self, x, y):
+        cx = np.clip(((x - self.x0) // self.cell_m).astype(np.int64), 0, self.width - 1)
+        cy = np.clip(((y - self.y0) // self.cell_m).astype(np.int64), 0, self.height - 1)
+        return cx, cy
+
+    def _ring(self, r):
+        # Desplazamientos (dx, dy) del borde del cuadrado de radio r
+        ring = self._rings.get(r)
+        if ring is None:
+            if r == 0:
+                ring = (np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64))
+            else:
+                side = np.arange(-r, r + 1)
+                inner = np.arange(-r + 1, r)
+                ring = (
+                    np.concatenate([side, side, np.full(len(inner), -r), np.full(len(inner), r)]),
+                    np.concatenate([np.full(len(side), -r), np.full(len(side), r), inner, inner])
+                )
+            self._rings[r] = ring
+        return ring
+
+    def _search(self, px, py, items, start, distance_sq):
+        # (elemento más cercano, distancia^2) por punto; -1 si la grilla está vacía
+        n = len(px)
+        best = np.full(n, np.inf)
+        best_item = np.full(n, -1, dtype=np.int64)
+        cx, cy = self._cells(px, py)
+        pending = np.arange(n)
+        for r in range(max(self.width, self.height)):
+            if len(pending) == 0:
+                break
+            dx, dy = self._ring(r)
+            ccx = cx[pending][:, None] + dx[None, :]
+            ccy = cy[pending][:, None] + dy[None, :]
+            valid = (ccx >= 0) & (ccx < self.width) & (ccy >= 0) & (ccy < self.height)
+            owner = np.broadcast_to(pending[:, None], ccx.shape)[valid]
+            cells = (ccy * self.width + ccx)[valid]
+
+            counts = start[cells + 1] - start[cells]
+            if counts.sum():
+                points = np.repeat(owner, counts)
+                first = np.repeat(start[cells] - (np.cumsum(counts) - counts), counts)
+                candidates = items[first + np.arange(len(points))]
+                d2 = distance_sq(points, candidates)
+                # Los candidatos de cada punto quedan contiguos: mínimo por grupo sin ordenar
+                group_start = np.flatnonzero(np.concatenate(([True], points[1:] != points[:-1])))
+                group_of = np.repeat(np.arange(len(group_start)), np.diff(np.append(group_start, len(points))))
+                at_min = np.flatnonzero(d2 == np.minimum.reduceat(d2, group_start)[group_of])
+                winners = at_min[np.concatenate(([True], group_of[at_min][1:] != group_of[at_min][:-1]))]
+                better = d2[winners] < best[points[winners]]
+                best[points[winners][better]] = d2[winners][better]
+                best_item[points[winners][better]] = candidates[winners][better]
+
+            # Lo que falte buscar está al menos a r celdas completas de distancia
+            pending = pending[best[pending] > (r * self.cell_m) ** 2]
+        return best_item, best
+
+    def nearest_nodes(self, lats, lngs):
+        """Intersección con calles más cercana a cada punto: (nodos, distancias en metros)."""
+        px, py = self._project(lats, lngs)
+
+        def distance_sq(points, nodes):
+            return (px[points] - self.x[nodes]) ** 2 + (py[points] - self.y[nodes]) ** 2
+
+        nodes, d2 = self._search(px, py, self.node_items, self.node_start, distance_sq)
+        return nodes, np.sqrt(d2)
+
+    def _project_on_edges(self, px, py, points, edges):
+        # (fracción 0..1 sobre la arista, distancia^2, x e y proyectados) de cada par punto-arista
+        src, dst = self.graph.edge_source[edges], self.graph.edge_target[edges]
+        ax, ay = self.x[src], self.y[src]
+        vx, vy = self.x[dst] - ax, self.y[dst] - ay
+        length_sq = vx * vx + vy * vy
+        t = np.clip(((px[points] - ax) * vx + (py[points] - ay) * vy) / np.where(length_sq > 0, length_sq, 1.0), 0.0, 1.0)
+        sx, sy = ax + t * vx, ay + t * vy
+        return t, (px[points] - sx) ** 2 + (py[points] - sy) ** 2, sx, sy
+
+    def snap_to_edges(self, lats, lngs):
+        """Proyección de cada punto sobre la arista más cercana.
+
+        Devuelve (aristas, fracción 0..1 desde el origen de la arista,
+        distancias en metros, lat y lng del punto proyectado).
+        """
+        px, py = self._project(lats, lngs)
+
+        def distance_sq(points, edges):
+            return self._project_on_edges(px, py, points, edges)[1]
+
+        edges, d2 = self._search(px, py, self.edge_items, self.edge_start, distance_sq)
+        found = np.nonzero(edges >= 0)[0]
+        t = np.zeros(len(edges))
+        snapped_x, snapped_y = px.copy(), py.copy()
+        if len(found):
+            t[found], _, snapped_x[found], snapped_y[found] = self._project_on_edges(px, py, found, edges[found])
+        return edges, t, np.sqrt(d2), snapped_y / self.ky, snapped_x / self.kx
+
+    def candidate_edges(self, lats, lngs, radius_m, k):
+        """Hasta `k` aristas a menos de `radius_m` de cada punto, la más cercana primero.
+
+        Devuelve arreglos (puntos x k) de aristas (-1 donde sobran lugares),
+        fracciones y distancias en metros.
+        """
+        px, py = self._project(lats, lngs)
+        n = len(px)
+        reach = int(math.ceil(radius_m / self.cell_m))
+        dx, dy = np.meshgrid(np.arange(-reach, reach + 1), np.arange(-reach, reach + 1))
+        cx, cy = self._cells(px, py)
+        ccx = cx[:, None] + dx.ravel()[None, :]
+        ccy = cy[:, None] + dy.ravel()[None, :]
+        valid = (ccx >= 0) & (ccx < self.width) & (ccy >= 0) & (ccy < self.height)
+        owner = np.broadcast_to(np.arange(n)[:, None], ccx.shape)[valid]
+        cells = (ccy * self.width + ccx)[valid]
+
+        counts = self.edge_start[cells + 1] - self.edge_start[cells]
+        points = np.repeat(owner, counts)
+        first = np.repeat(self.edge_start[cells] - (np.cumsum(counts) - counts), counts)
+        edges = self.edge_items[first + np.arange(len(points))]
+
+        # Una arista larga aparece en varias celdas: una vez por punto
+        order = np.lexsort((edges, points))
+        points, edges = points[order], edges[order]
+        unique = np.concatenate(([True], (points[1:] != points[:-1]) | (edges[1:] != edges[:-1])))
+        points, edges = points[unique], edges[unique]
+
+        t, d2, _, _ = self._project_on_edges(px, py, points, edges)
+        near = d2 <= radius_m * radius_m
+        points, edges, t, d2 = points[near], edges[near], t[near], d2[near]
+
+        order = np.lexsort((d2, points))
+        points, edges, t, d2 = points[order], edges[order], t[order], d2[order]
+        group_start = np.searchsorted(points, points, side="left")
+        rank = np.arange(len(points)) - group_start
+        keep = rank < k
+
+        out_edges = np.full((n, k), -1, dtype=np.int64)
+        out_t = np.zeros((n, k))
+        out_d = np.full((n, k), np.inf)
+        out_edges[points[keep], rank[keep]] = edges[keep]
+        out_t[points[keep], rank[keep]] = t[keep]
+        out_d[points[keep], rank[keep]] = np.sqrt(d2[keep])
+        return out_edges, out_t, out_d
+
+    def snap_nodes(self, lats, lngs, destination=False):
+        """Nodo del grafo desde (o hacia) el que rutear para cada punto, vía su arista más cercana.
+
+        En una calle de un sentido se sale por el final de la arista (o se
+        llega por su inicio si `destination`); en doble sentido, el extremo
+        más cercano. Devuelve (nodos, aristas, fracciones, distancias, lat, lng).
+        """
+        edges, t, distances, lats, lngs = self.snap_to_edges(lats, lngs)
+        nodes = np.full(len(edges), -1, dtype=np.int64)
+        found = edges >= 0
+        e = edges[found]
+        src, dst = self.graph.edge_source[e], self.graph.edge_target[e]
+        nearer = np.where(t[found] < 0.5, src, dst)
+        nodes[found] = np.where(self.graph.oneway[e], src if destination else dst, nearer)
+        return nodes, edges, t, distances, lats, lngs
@@ -0,0 +1,142 @@
+import threading
+import numpy as np
+from pathlib import Path
+
+# Un registro por arista recorrida: quién, cuál, cuándo entró y salió, y lo observado contra lo estimado.
+# La arista va por sus osmid: los índices del grafo en memoria cambian al recargarlo
+TRAVERSAL_DTYPE = np.dtype([
+    ("unidad", np.int32),
+    ("desde_osmid", np.int64),
+    ("hasta_osmid", np.int64),
+    ("entrada", np.float64),
+    ("salida", np.float64),
+    ("metros", np.float32),
+    ("segundos_observados", np.float32),
+    ("segundos_estimados", np.float32),
+    ("completa", np.bool_)
+])
+
+
+class TelemetryStore:
+    """Recorridos por arista de la flota, solo de agregar, como arreglo estructurado de NumPy.
+
+    En memoria crece por duplicación; con `path` cada lote además se anexa
+    en binario a `<path>.bin` (se relee con np.fromfile y TRAVERSAL_DTYPE) y
+    los identificadores de unidad nuevos a `<path>.unidades`, una por línea:
+    el número de línea es el código guardado en la columna `unidad`.
+
+    `bind(graph)` traduce los pares de osmid al índice de arista del grafo
+    cargado (-1 si ya no existe); se vuelve a llamar cada vez que se recarga.
+    """
+
+    def __init__(self, path=None, capacity=4096):
+        self._rows = np.zeros(capacity, dtype=TRAVERSAL_DTYPE)
+        self._edges = np.full(capacity, -1, dtype=np.int64)
+        self._size = 0
+        self.graph = None
+        self._units = []
+        self._unit_codes = {}
+        self._lock = threading.Lock()
+        self.path = Path(path) if path else None
+        if self.path is not None:
+            self._load()
+
+    def _load(self):
+        units_path = self.path.with_suffix(".unidades")
+        if units_path.exists():
+            for unit in units_path.read_text().splitlines():
+                self._unit_codes[unit] = len(self._units)
+                self._units.append(unit)
+        rows_path = self.path.with_suffix(".bin")
+        if rows_path.exists():
+            # Un último registro a medio escribir (corte abrupto) se descarta
+            rows = np.fromfile(rows_path, dtype=np.uint8)
+            rows = rows[:len(rows) - len(rows) % TRAVERSAL_DTYPE.itemsize].view(TRAVERSAL_DTYPE)
+            self._reserve(len(rows))
+            self._rows[:len(rows)] = rows
+            self._size = len(rows)
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed > len(self._rows):
+            rows = np.zeros(max(needed, 2 * len(self._rows)), dtype=TRAVERSAL_DTYPE)
+            rows[:self._size] = self._rows[:self._size]
+            edges = np.full(len(rows), -1, dtype=np.int64)
+            edges[:self._size] = self._edges[:self._size]
+            self._rows = rows
+            self._edges = edges
+
+    def bind(self, graph):
+        with self._lock:
+            rows = self._rows[:self._size]
+            self._edges[:self._size] = graph.edges_between_osmids(rows["desde_osmid"], rows["hasta_osmid"])
+            self.graph = graph
+
+    def unit_code(self, unit):
+        # Se llama con _lock tomado
+        code = self._unit_codes.get(unit)
+        if code is None:
+            code = len(self._units)
+            self._unit_codes[unit] = code
+            self._units.append(unit)
+            if self.path is not None:
+                with open(self.path.with_suffix(".unidades"), "a") as f:
+                    f.write(f"{unit}\n")
+        return code
+
+    def append(self, unit, edges, entries, exits, meters, observed_s, estimated_s, complete):
+        # `edges` son índices de arista del grafo pasado a bind
+        with self._lock:
+            graph = self.graph
+            batch = np.zeros(len(edges), dtype=TRAVERSAL_DTYPE)
+            batch["unidad"] = self.unit_code(unit)
+            batch["desde_osmid"] = graph.osmids[graph.edge_source[edges]]
+            batch["hasta_osmid"] = graph.osmids[graph.edge_target[edges]]
+            batch["entrada"] = entries
+            batch["salida"] = exits
+            batch["metros"] = meters
+            batch["segundos_observados"] = observed_s
+            batch["segundos_estimados"] = estimated_s
+            batch["completa"] = complete
+
+            self._reserve(len(batch))
+            self._rows[self._size:self._size + len(batch)] = batch
+            self._edges[self._size:self._size + len(batch)] = edges
+            self._size += len(batch)
+            if self.path is not None:
+                with open(self.path.with_suffix(".bin"), "ab") as f:
+                    batch.tofile(f)
+
+    def rows(self):
+        # Vista de solo lectura de lo guardado hasta ahora
+        view = self._rows[:self._size]
+        view.flags.writeable = False
+        return view
+
+    def edge_summary(self, min_samples=3):
+        """Por arista del grafo con al menos `min_samples` recorridos completos: (aristas, muestras, observado / estimado)."""
+        rows = self.rows()
+        edges = self._edges[:self._size]
+        keep = rows["completa"] & (rows["segundos_estimados"] > 0) & (edges >= 0)
+        rows, edges = rows[keep], edges[keep]
+        edge_count = self.graph.edge_count
+        samples = np.bincount(edges, minlength=edge_count)
+        observed = np.bincount(edges, weights=rows["segundos_observados"], minlength=edge_count)
+        estimated = np.bincount(edges, weights=rows["segundos_estimados"], minlength=edge_count)
+        edges = np.nonzero(samples >= min_samples)[0]
+        return edges, samples[edges], observed[edges] / estimated[edges]
+
+    def stats(self):
+        rows = self.rows()
+        complete = rows[rows["completa"] & (rows["segundos_estimados"] > 0)]
+        observed = float(complete["segundos_observados"].sum())
+        estimated = float(complete["segundos_estimados"].sum())
+        return {
+            "registros": int(len(rows)),
+            "unidades": len(self._units),
+            "aristas_distintas": int(len(np.unique(rows[["desde_osmid", "hasta_osmid"]]))) if len(rows) else 0,
+            "bytes": int(rows.nbytes),
+            # > 1: las ambulancias tardan más de lo que estima el modelo de ETA
+            "observado_vs_estimado": round(observed / estimated, 3) if estimated > 0 else None,
+            "archivo": str(self.path.with_suffix(".bin")) if self.path is not None else None
+        }
@@ -1,13 +1,24 @@
 import os
+import httpx
 import requests
 from dotenv import load_dotenv
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from typing import Dict, Optional, Union, List, Tuple
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '..', '.env'))
 
 HERE_API_KEY = os.getenv('HERE_API_KEY')
-HERE_API_BASE_URL = 'https://router.hereapi.com/v8/routes'
+# Configurable para probar contra un HERE local (here_stub.py)
+HERE_API_BASE_URL = os.getenv('HERE_API_BASE_URL', 'https://router.hereapi.com/v8/routes')
+HERE_CONNECT_TIMEOUT_S = float(os.getenv('HERE_CONNECT_TIMEOUT_S', '2'))
+HERE_READ_TIMEOUT_S = float(os.getenv('HERE_READ_TIMEOUT_S', '5'))
+HERE_MAX_CONNECTIONS = int(os.getenv('HERE_MAX_CONNECTIONS', '20'))
+
+# Cliente HTTP asíncrono compartido (pool de conexiones a HERE), se crea en el primer uso
+_async_client = None
+
+# Los factores en tiempo real solo valen para salidas cercanas a ahora
+REALTIME_WINDOW = timedelta(minutes=30)
 
 TRAFFIC_PATTERNS = {
     'weekday': {
@@ -38,7 +49,7 @@ TRAFFIC_MULTIPLIERS = {
     'weekend_low_traffic': 0.8
 }
 
-def get_route_details(origin: str, destination:str, departure_time: Optional[datetime] = None, transport_mode: str = "car", return_fields: list = ['polyline', 'incidents', 'summary'], spans: list = ['incidents']):
+def _route_details_params(origin, destination, departure_time, transport_mode, return_fields, spans):
     if not HERE_API_KEY:
         raise ValueError("API KEY not provided or found")
 
@@ -49,7 +60,7 @@ def get_route_details(origin: str, destination:str, departure_time: Optional[dat
 
     departure_time_iso = departure_time.isoformat(timespec='seconds')
 
-    params = {
+    return {
         'origin': origin,
         'destination': destination,
         'transportMode': transport_mode,
@@ -59,8 +70,11 @@ def get_route_details(origin: str, destination:str, departure_time: Optional[dat
         'apiKey': HERE_API_KEY
     }
 
+def get_route_details(origin: str, destination:str, departure_time: Optional[datetime] = None, transport_mode: str = "car", return_fields: list = ['polyline', 'incidents', 'summary'], spans: list = ['incidents']):
+    params = _route_details_params(origin, destination, departure_time, transport_mode, return_fields, spans)
+
     try:
-        response = requests.get(HERE_API_BASE_URL, params=params, timeout=6000)
+        response = requests.get(HERE_API_BASE_URL, params=params, timeout=(HERE_CONNECT_TIMEOUT_S, HERE_READ_TIMEOUT_S))
         response.raise_for_status() 
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -68,6 +82,33 @@ def get_route_details(origin: str, destination:str, departure_time: Optional[dat
     except ValueError as e:
         raise Exception(f"Error parsing response from HERE API: {str(e)}")
 
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HERE_READ_TIMEOUT_S, connect=HERE_CONNECT_TIMEOUT_S),
+            limits=httpx.Limits(max_connections=HERE_MAX_CONNECTIONS, max_keepalive_connections=HERE_MAX_CONNECTIONS)
+        )
+    return _async_client
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+async def get_route_details_async(origin: str, destination:str, departure_time: Optional[datetime] = None, transport_mode: str = "car", return_fields: list = ['polyline', 'incidents', 'summary'], spans: list = ['incidents']):
+    params = _route_details_params(origin, destination, departure_time, transport_mode, return_fields, spans)
+
+    try:
+        response = await get_async_client().get(HERE_API_BASE_URL, params=params)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPError as e:
+        raise Exception(f"Error making request to HERE API: {str(e)}")
+    except ValueError as e:
+        raise Exception(f"Error parsing response from HERE API: {str(e)}")
+
 def extract_real_time_traffic_factor(here_response: Dict) -> float:
     try:
         routes = here_response.get('routes', [])
@@ -103,54 +144,109 @@ def get_route_coordinates_from_records(records: List[Dict]) -> Tuple[str, str]:
     
     return None, None
 
-def get_traffic_index(target_datetime=None):
+def get_traffic_period(target_datetime=None) -> Tuple[str, str]:
     if target_datetime is None:
         target_datetime = datetime.now()
     
     hour = target_datetime.hour
-    is_weekend = target_datetime.weekday() >= 5
-    
-    if is_weekend:
-        if hour in TRAFFIC_PATTERNS['weekend']['moderate']:
-            return TRAFFIC_MULTIPLIERS['moderate']
-        else:
-            return TRAFFIC_MULTIPLIERS['weekend_low_traffic']
-    else:
-        if hour in TRAFFIC_PATTERNS['weekday']['morning_rush']:
-            return TRAFFIC_MULTIPLIERS['morning_rush']
-        elif hour in TRAFFIC_PATTERNS['weekday']['evening_rush']:
-            return TRAFFIC_MULTIPLIERS['evening_rush']
-        elif hour in TRAFFIC_PATTERNS['weekday']['midday']:
-            return TRAFFIC_MULTIPLIERS['midday']
-        else:
-            return TRAFFIC_MULTIPLIERS['low_traffic']
+    day_type = 'weekend' if target_datetime.weekday() >= 5 else 'weekday'
+
+    for period, hours in TRAFFIC_PATTERNS[day_type].items():
+        if hour in hours:
+            return day_type, period
+    return day_type, 'low_traffic'
+
+def get_period_multiplier(day_type: str, period: str) -> float:
+    if day_type == 'weekend' and period == 'low_traffic':
+        return TRAFFIC_MULTIPLIERS['weekend_low_traffic']
+    return TRAFFIC_MULTIPLIERS[period]
+
+def get_traffic_index(target_datetime=None):
+    return get_period_multiplier(*get_traffic_period(target_datetime))
 
 
 def get_road_type_multiplier(road_type):
+    if isinstance(road_type, list):
+        road_type = road_type[0] if road_type else None
     return ROAD_TYPE_TRAFFIC.get(road_type, 1.0)
 
-def calculate_approx_time(records, target_datetime=None, use_realtime=True):
-    if not records: 
-        return "Tiempo no disponible"
+def parse_speed_kmh(velocidad) -> float:
+    # Distintos tipos de datos en los valores de velocidad :)
+    if isinstance(velocidad, list):
+        try:
+            velocidad = int(str(velocidad[:-1]))
+        except (IndexError, ValueError, TypeError):
+            velocidad = 20
+    elif isinstance(velocidad, str):
+        try:
+            velocidad = int(velocidad)
+        except (ValueError, TypeError):
+            velocidad = 20
+    elif velocidad is None:
+        velocidad = 20
+    return velocidad
+
+def is_realtime_departure(target_datetime=None):
+    if target_datetime is None:
+        return True
+    now = datetime.now(timezone.utc) if target_datetime.tzinfo is not None else datetime.now()
+    return abs(target_datetime - now) <= REALTIME_WINDOW
+
+def cached_realtime_multiplier(records, target_datetime, traffic_factors):
+    # Factor del servicio de fondo (TrafficFactorService); 1.0 cae a get_traffic_index
+    if not is_realtime_departure(target_datetime):
+        return 1.0
+    factor = traffic_factors.route_factor(records)
+    return factor if factor is not None else 1.0
+
+def get_realtime_multiplier(records, target_datetime=None, traffic_factors=None):
+    # 1.0 significa "sin dato en tiempo real": se usa get_traffic_index
+    if traffic_factors is not None:
+        return cached_realtime_multiplier(records, target_datetime, traffic_factors)
 
-    fallback_traffic_multiplier = get_traffic_index(target_datetime)
     realtime_multiplier = 1.0
+    try:
+        origin, destination = get_route_coordinates_from_records(records)
+        if origin and destination:
+            here_response = get_route_details(origin, destination, target_datetime)
+            realtime_multiplier = extract_real_time_traffic_factor(here_response)
+            print(f"Realtime multiplier: {realtime_multiplier}")
 
-    if use_realtime:
-        try:
-            origin, destination = get_route_coordinates_from_records(records)
-            if origin and destination:
-                here_response = get_route_details(origin, destination, target_datetime)
-                realtime_multiplier = extract_real_time_traffic_factor(here_response)
-                print(f"Realtime multiplier: {realtime_multiplier}")
-            
-        except Exception as e:
-            print(f"Error al obtener el tiempo real: {str(e)}")
+    except Exception as e:
+        print(f"Error al obtener el tiempo real: {str(e)}")
+    return realtime_multiplier
 
+async def get_realtime_multiplier_async(records, target_datetime=None, traffic_factors=None):
+    # Igual que get_realtime_multiplier, pero sin bloquear el event loop mientras responde HERE
+    if traffic_factors is not None:
+        return cached_realtime_multiplier(records, target_datetime, traffic_factors)
+
+    realtime_multiplier = 1.0
+    try:
+        origin, destination = get_route_coordinates_from_records(records)
+        if origin and destination:
+            here_response = await get_route_details_async(origin, destination, target_datetime)
+            realtime_multiplier = extract_real_time_traffic_factor(here_response)
+            print(f"Realtime multiplier: {realtime_multiplier}")
+
+    except Exception as e:
+        print(f"Error al obtener el tiempo real: {str(e)}")
+    return realtime_multiplier
+
+def get_traffic_factor(target_datetime=None, realtime_multiplier=1.0):
     if realtime_multiplier != 1.0:
-        traffic_factor = realtime_multiplier 
-    else:
-        traffic_factor = fallback_traffic_multiplier
+        return realtime_multiplier
+    return get_traffic_index(target_datetime)
+
+def calculate_approx_time(records, target_datetime=None, use_realtime=True, traffic_factors=None):
+    if not records: 
+        return "Tiempo no disponible"
+
+    realtime_multiplier = get_realtime_multiplier(records, target_datetime, traffic_factors) if use_realtime else 1.0
+    return format_approx_time(records, target_datetime, realtime_multiplier)
+
+def format_approx_time(records, target_datetime=None, realtime_multiplier=1.0):
+    traffic_factor = get_traffic_factor(target_datetime, realtime_multiplier)
             
     tiempos = []
     for record in records:
@@ -160,19 +256,7 @@ def calculate_approx_time(records, target_datetime=None, use_realtime=True):
 
         road_multiplier = get_road_type_multiplier(tipo_calle)
 
-        # Distintos tipos de datos en los valores de velocidad :)
-        if isinstance(velocidad, list):
-            try:
-                velocidad = int(str(velocidad[:-1]))
-            except (IndexError, ValueError, TypeError):
-                velocidad = 20
-        elif isinstance(velocidad, str):
-            try:
-                velocidad = int(velocidad)
-            except (ValueError, TypeError):
-                velocidad = 20
-        elif velocidad is None:
-            velocidad = 20
+        velocidad = parse_speed_kmh(velocidad)
 
         velocidad_promedio = velocidad * 0.8 if distancia > 5000 else velocidad * 0.6
         tiempo_base = ((distancia/1000) / velocidad_promedio) * 1.15
@@ -180,7 +264,9 @@ def calculate_approx_time(records, target_datetime=None, use_realtime=True):
         tiempo_ajustado = tiempo_base * traffic_factor * road_multiplier
         tiempos.append(tiempo_ajustado)
 
-    total_horas = sum(tiempos)
+    return format_hours(sum(tiempos))
+
+def format_hours(total_horas):
     horas = int(total_horas)
     minutos = int((total_horas - horas) * 60)
 
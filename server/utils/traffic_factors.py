@@ -0,0 +1,182 @@
+import os
+import time
+import threading
+import numpy as np
+from .trafficDetails import get_route_details, extract_real_time_traffic_factor
+
+TRAFFIC_GRID_SIZE = int(os.getenv("TRAFFIC_GRID_SIZE", "6"))
+TRAFFIC_FACTORS_REFRESH_S = float(os.getenv("TRAFFIC_FACTORS_REFRESH_S", "300"))
+# Un factor más viejo que esto ya no se usa y se cae a get_traffic_index
+TRAFFIC_FACTORS_MAX_AGE_S = float(os.getenv("TRAFFIC_FACTORS_MAX_AGE_S", "900"))
+
+
+class CircuitBreaker:
+    """Corta las llamadas a HERE tras `threshold` fallos seguidos durante `cooldown_s`.
+
+    Pasado el enfriamiento deja pasar una llamada de prueba (semiabierto): si
+    funciona se cierra, si falla vuelve a abrirse.
+    """
+
+    def __init__(self, threshold=5, cooldown_s=60.0):
+        self.threshold = threshold
+        self.cooldown_s = cooldown_s
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "cerrado"
+            if time.monotonic() - self.opened_at >= self.cooldown_s:
+                return "semiabierto"
+            return "abierto"
+
+    def allow(self):
+        return self.state != "abierto"
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+class TrafficFactorService:
+    """Factores de tráfico en tiempo real (duration / baseDuration de HERE) por celda de una grilla.
+
+    La grilla cubre la caja del grafo vial; cada celda se mide con un
+    corredor diagonal de esquina a esquina. Un hilo en segundo plano los
+    refresca y `lookup` solo indexa arreglos, así que calcular un ETA ya no
+    espera a HERE.
+    """
+
+    def __init__(self, min_lat, min_lng, max_lat, max_lng, grid_size=TRAFFIC_GRID_SIZE,
+                 max_age_s=TRAFFIC_FACTORS_MAX_AGE_S, breaker=None, fetch=None):
+        self.grid_size = grid_size
+        self.min_lat = min_lat
+        self.min_lng = min_lng
+        self.cell_lat = max((max_lat - min_lat) / grid_size, 1e-9)
+        self.cell_lng = max((max_lng - min_lng) / grid_size, 1e-9)
+        self.max_age_s = max_age_s
+        self.breaker = breaker or CircuitBreaker()
+        self.fetch = fetch or self._fetch_from_here
+
+        cells = grid_size * grid_size
+        self.factors = np.ones(cells, dtype=np.float64)
+        self.updated_at = np.full(cells, -np.inf)
+        # Para cada celda, la celda refrescada más cercana (según el último ciclo)
+        self.nearest_fresh = np.full(cells, -1, dtype=np.int32)
+        rows, cols = np.divmod(np.arange(cells), grid_size)
+        self._cell_rows = rows
+        self._cell_cols = cols
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_graph(cls, graph, **kwargs):
+        return cls(float(graph.lat.min()), float(graph.lng.min()), float(graph.lat.max()), float(graph.lng.max()), **kwargs)
+
+    def cell_of(self, lat, lng):
+        row = min(max(int((lat - self.min_lat) / self.cell_lat), 0), self.grid_size - 1)
+        col = min(max(int((lng - self.min_lng) / self.cell_lng), 0), self.grid_size - 1)
+        return row * self.grid_size + col
+
+    def corridor(self, cell):
+        row, col = divmod(cell, self.grid_size)
+        lat0 = self.min_lat + row * self.cell_lat
+        lng0 = self.min_lng + col * self.cell_lng
+        return f"{lat0:.6f},{lng0:.6f}", f"{lat0 + self.cell_lat:.6f},{lng0 + self.cell_lng:.6f}"
+
+    def _fetch_from_here(self, origin, destination):
+        return extract_real_time_traffic_factor(get_route_details(origin, destination))
+
+    def refresh_cell(self, cell):
+        if not self.breaker.allow():
+            return False
+        try:
+            factor = float(self.fetch(*self.corridor(cell)))
+        except Exception as e:
+            self.breaker.record_failure()
+            print(f"Error al refrescar factor de tráfico de la celda {cell}: {str(e)}")
+            return False
+        self.breaker.record_success()
+        self.factors[cell] = factor
+        self.updated_at[cell] = time.monotonic()
+        return True
+
+    def refresh_all(self):
+        refreshed = 0
+        for cell in range(self.grid_size * self.grid_size):
+            if self._stop.is_set() or not self.breaker.allow():
+                break
+            refreshed += self.refresh_cell(cell)
+        self._update_nearest_fresh()
+        return refreshed
+
+    def _update_nearest_fresh(self):
+        fresh = np.nonzero(time.monotonic() - self.updated_at <= self.max_age_s)[0]
+        if len(fresh) == 0:
+            self.nearest_fresh[:] = -1
+            return
+        # Distancia en celdas de cada celda a cada celda fresca (la grilla es chica)
+        distance = np.hypot(
+            self._cell_rows[:, None] - self._cell_rows[fresh][None, :],
+            self._cell_cols[:, None] - self._cell_cols[fresh][None, :]
+        )
+        self.nearest_fresh[:] = fresh[np.argmin(distance, axis=1)]
+
+    def lookup(self, lat, lng):
+        # Factor fresco de la celda o de la celda fresca más cercana; None si no hay
+        now = time.monotonic()
+        cell = self.cell_of(lat, lng)
+        if now - self.updated_at[cell] <= self.max_age_s:
+            return float(self.factors[cell])
+        nearest = self.nearest_fresh[cell]
+        if nearest >= 0 and now - self.updated_at[nearest] <= self.max_age_s:
+            return float(self.factors[nearest])
+        return None
+
+    def factor_between(self, from_lat, from_lng, to_lat, to_lng):
+        # Promedio de los factores en el origen y el destino
+        factors = [self.lookup(from_lat, from_lng), self.lookup(to_lat, to_lng)]
+        factors = [factor for factor in factors if factor is not None]
+        return sum(factors) / len(factors) if factors else None
+
+    def route_factor(self, records):
+        return self.factor_between(records[0]["fromLat"], records[0]["fromLng"], records[-1]["toLat"], records[-1]["toLng"])
+
+    def start_background_refresh(self, interval_s=TRAFFIC_FACTORS_REFRESH_S):
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                refreshed = self.refresh_all()
+                print(f"Traffic factors: {refreshed} cells refreshed in {time.perf_counter() - start:.1f}s (breaker {self.breaker.state})")
+                self._stop.wait(interval_s)
+
+        self._thread = threading.Thread(target=run, name="traffic-factors", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        age = time.monotonic() - self.updated_at
+        fresh = age <= self.max_age_s
+        return {
+            "celdas": int(self.grid_size * self.grid_size),
+            "celdas_frescas": int(fresh.sum()),
+            "factor_promedio": round(float(self.factors[fresh].mean()), 3) if fresh.any() else None,
+            "antiguedad_max_s": round(float(age[fresh].max()), 1) if fresh.any() else None,
+            "circuito": self.breaker.state
+        }
@@ -0,0 +1,91 @@
+from datetime import datetime
+import numpy as np
+from .road_graph import primary_highway
+from .trafficDetails import (
+    TRAFFIC_PATTERNS,
+    ROAD_TYPE_TRAFFIC,
+    get_traffic_period,
+    get_period_multiplier,
+    parse_speed_kmh
+)
+
+PERIOD_LABELS = {
+    'morning_rush': 'hora punta de la mañana',
+    'evening_rush': 'hora punta de la tarde',
+    'midday': 'mediodía',
+    'moderate': 'tráfico moderado',
+    'low_traffic': 'tráfico bajo'
+}
+
+# Perfil de distancia pura, usado por A*
+LENGTH_PROFILE = 'length'
+
+# Todas las franjas (day_type, period) definidas en TRAFFIC_PATTERNS
+PROFILE_KEYS = [
+    (day_type, period)
+    for day_type, periods in TRAFFIC_PATTERNS.items()
+    for period in periods
+]
+
+
+def to_local_datetime(departure_time=None):
+    if departure_time is None:
+        return datetime.now()
+    if departure_time.tzinfo is not None:
+        return departure_time.astimezone().replace(tzinfo=None)
+    return departure_time
+
+
+def profile_key_for(departure_time=None):
+    return get_traffic_period(to_local_datetime(departure_time))
+
+
+def edge_speeds_kmh(graph):
+    speeds = np.array([float(parse_speed_kmh(value)) for value in graph.max_speeds], dtype=np.float64)
+    speeds[~(speeds > 0)] = 20.0
+    return speeds[graph.speed_id]
+
+
+def base_travel_seconds(graph):
+    # Mismo modelo de velocidad que calculate_approx_time, sin el factor de tráfico
+    speed = edge_speeds_kmh(graph)
+
+    length = graph.length.astype(np.float64)
+    average_speed = np.where(length > 5000, speed * 0.8, speed * 0.6)
+    return (length / 1000.0) / average_speed * 3600.0 * 1.15
+
+
+def road_type_multipliers(graph):
+    table = np.array([
+        ROAD_TYPE_TRAFFIC.get(primary_highway(value), 1.0) for value in graph.highways
+    ], dtype=np.float64)
+    return table[graph.highway_id]
+
+
+class TrafficWeightProfiles:
+    """Pesos por arista (segundos) precalculados para cada franja horaria."""
+
+    def __init__(self, graph):
+        self.graph = graph
+        base = base_travel_seconds(graph)
+        road = road_type_multipliers(graph)
+        length = graph.length.astype(np.float64)
+        routable = length > 0
+
+        self.weights = {LENGTH_PROFILE: graph.length}
+        self._weight_lists = {LENGTH_PROFILE: graph.length.tolist()}
+        self.heuristic_scales = {LENGTH_PROFILE: 1.0}
+
+        for day_type, period in PROFILE_KEYS:
+            time_multiplier = get_period_multiplier(day_type, period)
+            # La penalización del tipo de vía crece con el nivel de tráfico de la franja:
+            # a las 2am una avenida principal casi no se penaliza, a las 7am sí
+            weights = (base * time_multiplier * np.power(road, time_multiplier)).astype(np.float32)
+
+            key = (day_type, period)
+            self.weights[key] = weights
+            self._weight_lists[key] = weights.tolist()
+            self.heuristic_scales[key] = float(np.min(weights[routable] / length[routable])) if routable.any() else 0.0
+
+    def get(self, key):
+        return self._weight_lists[key], self.heuristic_scales[key]
@@ -0,0 +1,63 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Diccionario LRU acotado con expiración (TTL) por entrada, seguro entre hilos.
+
+    Sirve tanto de caché como de almacén de sesiones: `get` renueva la
+    posición LRU pero no el vencimiento; `put` lo renueva. Cuenta aciertos,
+    fallos y desalojos para los endpoints de estadísticas.
+    """
+
+    def __init__(self, maxsize=2048, ttl_s=3600.0):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if time.monotonic() - stored_at <= self.ttl_s:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        # Se llama con _lock tomado
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entradas": len(self._entries),
+                "capacidad": self.maxsize,
+                "ttl_s": self.ttl_s,
+                "aciertos": self.hits,
+                "fallos": self.misses,
+                "desalojos": self.evictions,
+                "tasa_aciertos": round(self.hits / lookups, 4) if lookups else 0.0
+            }